@@ -0,0 +1,413 @@
+"""Нагрузочный тест групповой сессии: одновременный вход и прохождение опроса
+
+Сценарий повторяет то, что происходит на занятии: --users участников
+одновременно (или с разгоном за --ramp-up секунд) входят на сайт, открывают
+профиль, сохраняют его, открывают /survey/<id>/ и отправляют бланк
+(--iterations раз), а администратор в это время обновляет /report/. Клиенты -
+задачи asyncio с простым HTTP/1.1 клиентом на потоках asyncio (без сторонних
+библиотек); cookie сессии и CSRF-токен берутся из ответов, как в браузере.
+
+По умолчанию тест сам запускает сервер разработки Django (многопоточный
+runserver) на копии db.sqlite3 во временном каталоге и создает пользователей
+load-user-N и администратора load-admin. Сервер работает с настройками
+DATABASES проекта без изменений; для сравнения можно задать время ожидания
+блокировки SQLite (--sqlite-timeout, у Django по умолчанию 5 с) и режим
+транзакций IMMEDIATE (--immediate). Ошибки сервера записываются в журнал, так
+что ошибки блокировки SQLite («database is locked») считаются отдельно от
+остальных ошибок. С --url тест идет на уже запущенный сервер (например,
+gunicorn или uvicorn); пользователей для него создает --prepare-only, а
+блокировки SQLite тогда видны только как ответы 500.
+
+По каждому endpoint выводятся число запросов, пропускная способность,
+задержки p50/p95/p99 и ошибки.
+
+Запуск из корня проекта:
+    python benchmarks/loadtest.py --users 40 --iterations 2 --json loadtest.json
+    python benchmarks/loadtest.py --users 40 --ramp-up 10 --report-interval 0.5
+"""
+import argparse
+import asyncio
+import json
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date
+from http.cookies import SimpleCookie
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+USER_PREFIX = 'load-user-'
+ADMIN_USERNAME = 'load-admin'
+PASSWORD = 'load-test-password'
+LOCK_MARKER = 'database is locked'
+ID_PATTERN = re.compile(r'/\d+')
+
+# Подготовка базы и запуск runserver в отдельном процессе
+SERVER = r"""
+import json, os, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'san.settings')
+import django
+from django.conf import settings
+
+config = json.loads(sys.argv[1])
+django.setup()
+settings.DEBUG = False
+settings.ALLOWED_HOSTS = ['127.0.0.1', 'localhost']
+from django.db import connections
+connections['default'].close()
+if config['database']:
+    connections['default'].settings_dict['NAME'] = config['database']
+if connections['default'].vendor == 'sqlite':
+    # Только по явным флагам: по умолчанию сервер работает с настройками базы проекта.
+    # timeout - сколько соединение ждет чужую запись до «database is locked»; IMMEDIATE берет
+    # блокировку записи в начале транзакции (иначе читающая, а потом пишущая транзакция не ждет)
+    options = connections['default'].settings_dict.setdefault('OPTIONS', {})
+    if config['sqlite_timeout'] is not None:
+        options['timeout'] = config['sqlite_timeout']
+    if config['immediate']:
+        options['transaction_mode'] = 'IMMEDIATE'
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.signals import got_request_exception
+from django.db import close_old_connections
+
+call_command('migrate', verbosity=0)
+for index in range(1, config['users'] + 1):
+    if not User.objects.filter(username=f"{config['prefix']}{index}").exists():
+        User.objects.create_user(f"{config['prefix']}{index}", password=config['password'])
+if not User.objects.filter(username=config['admin']).exists():
+    User.objects.create_user(config['admin'], password=config['password'], is_staff=True)
+close_old_connections()
+if config['prepare_only']:
+    sys.exit()
+
+def log_error(sender, request=None, **kwargs):
+    error = sys.exc_info()[1]
+    with open(config['error_log'], 'a', encoding='utf-8') as f:
+        f.write(json.dumps({'method': request.method if request else '', 'path': request.path if request else '',
+                            'error': f'{type(error).__name__}: {error}'}, ensure_ascii=False) + '\n')
+
+got_request_exception.connect(log_error)
+call_command('runserver', f"127.0.0.1:{config['port']}", use_reloader=False, use_threading=True,
+             skip_checks=True)
+"""
+
+
+def endpoint(method, path):
+    """Имя endpoint для статистики: метод и путь без числовых идентификаторов"""
+    return f"{method} {ID_PATTERN.sub('/<id>', path)}"
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def add(self, name, seconds, error=None):
+        self.latencies[name].append(seconds)
+        if error:
+            self.errors[name][error] += 1
+
+
+class HttpError(Exception):
+    pass
+
+
+class Session:
+    """Пользователь браузера: cookie, CSRF-токен, одно соединение на запрос (Connection: close)"""
+
+    def __init__(self, base_url, stats, timeout):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.stats = stats
+        self.timeout = timeout
+        self.cookies = {}
+
+    async def request(self, method, path, data=None, expect=(200,)):
+        name = endpoint(method, path)
+        body = urlencode(data).encode() if data is not None else b''
+        headers = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', 'Connection: close',
+                   'User-Agent: san-loadtest']
+        if self.cookies:
+            headers.append('Cookie: ' + '; '.join(f'{key}={value}' for key, value in self.cookies.items()))
+        if data is not None:
+            headers += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}']
+        started = time.perf_counter()
+        try:
+            status, response_headers, content = await asyncio.wait_for(
+                self._exchange(('\r\n'.join(headers) + '\r\n\r\n').encode() + body), self.timeout)
+        except (OSError, asyncio.TimeoutError, ValueError) as error:
+            self.stats.add(name, time.perf_counter() - started, type(error).__name__)
+            raise HttpError(f'{name}: {type(error).__name__}') from error
+        self.stats.add(name, time.perf_counter() - started, None if status in expect else f'HTTP {status}')
+        for value in response_headers.get('set-cookie', []):
+            for key, morsel in SimpleCookie(value).items():
+                self.cookies[key] = morsel.value
+        if status not in expect:
+            raise HttpError(f'{name}: HTTP {status}')
+        return response_headers, content.decode('utf-8', 'replace')
+
+    async def _exchange(self, raw):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            writer.write(raw)
+            await writer.drain()
+            head = await reader.readuntil(b'\r\n\r\n')
+            content = await reader.read()
+        finally:
+            writer.close()
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = defaultdict(list)
+        for line in lines[1:]:
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()].append(value.strip())
+        if 'chunked' in headers.get('transfer-encoding', [''])[0]:
+            content = dechunk(content)
+        return status, headers, content
+
+    async def login(self, username):
+        _, page = await self.request('GET', '/login/')
+        await self.request('POST', '/login/', {
+            'csrfmiddlewaretoken': form_value(page, 'csrfmiddlewaretoken'),
+            'username': username, 'password': PASSWORD,
+        }, expect=(302,))
+
+
+def dechunk(content):
+    result, rest = b'', content
+    while rest:
+        size, _, rest = rest.partition(b'\r\n')
+        size = int(size.split(b';')[0], 16)
+        if size == 0:
+            break
+        result, rest = result + rest[:size], rest[size + 2:]
+    return result
+
+
+def form_value(page, name):
+    """Значение скрытого поля формы (csrfmiddlewaretoken, client_key)"""
+    match = re.search(rf'name="{name}" value="([^"]*)"', page) or re.search(rf'value="([^"]*)" name="{name}"', page)
+    if not match:
+        raise HttpError(f'На странице нет поля {name}')
+    return match.group(1)
+
+
+async def participant_flow(index, args, stats):
+    """Вход -> профиль -> сохранение профиля -> опрос -> отправка бланка; True, если прошел до конца"""
+    if args.users > 1:
+        await asyncio.sleep(args.ramp_up * (index - 1) / (args.users - 1))
+    rng = random.Random(index)
+    session = Session(args.url, stats, args.timeout)
+    try:
+        await session.login(f'{USER_PREFIX}{index}')
+        _, page = await session.request('GET', '/profile/')
+        headers, _ = await session.request('POST', '/profile/', {
+            'csrfmiddlewaretoken': form_value(page, 'csrfmiddlewaretoken'),
+            'name': f'Участник нагрузки {index}', 'gender': rng.choice('MF'),
+            'birth_date': date(rng.randint(1960, 2006), rng.randint(1, 12), rng.randint(1, 28)).isoformat(),
+        }, expect=(302,))
+        survey_path = urlsplit(headers['location'][0]).path
+        for iteration in range(args.iterations):
+            _, page = await session.request('GET', survey_path)
+            await session.request('POST', survey_path, {
+                'csrfmiddlewaretoken': form_value(page, 'csrfmiddlewaretoken'),
+                'client_key': form_value(page, 'client_key'),
+                'phase': 'after' if iteration % 2 else 'before',
+                **{f'q{num}': rng.randint(-3, 3) for num in range(1, 31)},
+            })
+        return True
+    except HttpError:
+        return False
+
+
+async def admin_flow(args, stats, stop):
+    """Администратор обновляет отчет, пока идут участники"""
+    session = Session(args.url, stats, args.timeout)
+    logged_in = False
+    while not stop.is_set():
+        try:
+            # Вход тоже может упасть на блокировке базы - тогда пробуем снова
+            if not logged_in:
+                await session.login(ADMIN_USERNAME)
+                logged_in = True
+            await session.request('GET', '/report/')
+        except HttpError:
+            pass
+        try:
+            await asyncio.wait_for(stop.wait(), args.report_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args):
+    stats = Stats()
+    stop = asyncio.Event()
+    admins = [asyncio.create_task(admin_flow(args, stats, stop)) for _ in range(args.admins)]
+    started = time.perf_counter()
+    completed = await asyncio.gather(*(participant_flow(index, args, stats)
+                                       for index in range(1, args.users + 1)))
+    seconds = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*admins)
+    return stats, seconds, sum(completed)
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, max(0, round(fraction * len(values)) - 1))]
+
+
+def summarize(stats, seconds, completed, users, server_errors):
+    locked = defaultdict(int)
+    other = defaultdict(int)
+    for error in server_errors:
+        name = endpoint(error['method'], error['path'])
+        if LOCK_MARKER in error['error']:
+            locked[name] += 1
+        else:
+            other[name] += 1
+    endpoints = {}
+    for name, latencies in sorted(stats.latencies.items()):
+        latencies = sorted(latencies)
+        # Блокировки SQLite приходят клиенту как HTTP 500 и считаются отдельно
+        errors = sum(stats.errors[name].values()) - min(locked[name], stats.errors[name].get('HTTP 500', 0))
+        endpoints[name] = {
+            'requests': len(latencies),
+            'rps': len(latencies) / seconds,
+            'p50_ms': percentile(latencies, 0.5) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'errors': errors,
+            'error_rate': errors / len(latencies),
+            'error_kinds': dict(stats.errors[name]),
+            'sqlite_locked': locked[name],
+            'server_exceptions': other[name],
+        }
+    return {'seconds': seconds, 'users': users, 'completed_flows': completed, 'endpoints': endpoints,
+            'errors': sum(row['errors'] for row in endpoints.values()),
+            'sqlite_locked': sum(locked.values())}
+
+
+def print_summary(summary):
+    print(f"Сценарий пройден: {summary['completed_flows']} из {summary['users']} участников "
+          f"за {summary['seconds']:.1f} с")
+    print(f"{'Endpoint':<28} {'Запр.':>6} {'Запр./с':>8} {'p50, мс':>9} {'p95, мс':>9} {'p99, мс':>9} "
+          f"{'Ошибки':>7} {'Locked':>7}")
+    for name, row in summary['endpoints'].items():
+        print(f"{name:<28} {row['requests']:>6} {row['rps']:>8.1f} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['errors']:>7} {row['sqlite_locked']:>7}")
+        for kind, count in sorted(row['error_kinds'].items()):
+            print(f"{'':<28}   {kind}: {count}")
+    print(f"Ошибки (без блокировок SQLite): {summary['errors']}")
+    print(f"Ошибки блокировки SQLite (database is locked): {summary['sqlite_locked']}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def server_config(args, workdir, port=None):
+    return {
+        'database': str(args.database) if args.database else None,
+        'port': port, 'users': args.users, 'prefix': USER_PREFIX, 'admin': ADMIN_USERNAME,
+        'password': PASSWORD, 'prepare_only': port is None, 'error_log': str(workdir / 'errors.jsonl'),
+        'sqlite_timeout': args.sqlite_timeout, 'immediate': args.immediate,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=40, help="Число одновременных участников")
+    parser.add_argument('--iterations', type=int, default=1, help="Сколько бланков отправляет каждый участник")
+    parser.add_argument('--ramp-up', type=float, default=0.0,
+                        help="За сколько секунд стартуют все участники (0 - одновременно)")
+    parser.add_argument('--admins', type=int, default=1, help="Сколько администраторов обновляют отчет")
+    parser.add_argument('--report-interval', type=float, default=1.0,
+                        help="Пауза администратора между обновлениями отчета, с")
+    parser.add_argument('--timeout', type=float, default=60.0, help="Таймаут одного запроса, с")
+    parser.add_argument('--url', help="Адрес уже запущенного сервера (иначе запускается runserver)")
+    parser.add_argument('--database', type=Path,
+                        help="Файл SQLite для сервера (по умолчанию - копия db.sqlite3 во временном каталоге)")
+    parser.add_argument('--sqlite-timeout', type=float,
+                        help="Сколько секунд соединение SQLite сервера ждет освобождения базы "
+                             "(по умолчанию - как в настройках проекта)")
+    parser.add_argument('--immediate', action='store_true',
+                        help="Открывать транзакции SQLite сервера в режиме IMMEDIATE")
+    parser.add_argument('--prepare-only', action='store_true',
+                        help="Только создать пользователей теста в базе --database (или в базе из настроек)")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='san_loadtest_'))
+    try:
+        if args.prepare_only:
+            subprocess.run([sys.executable, '-c', SERVER, json.dumps(server_config(args, workdir))],
+                           cwd=BASE_DIR, check=True)
+            return
+
+        server = None
+        if not args.url:
+            if not args.database:
+                args.database = workdir / 'db.sqlite3'
+                shutil.copy(BASE_DIR / 'db.sqlite3', args.database)
+            port = free_port()
+            log = open(workdir / 'server.log', 'w')
+            server = subprocess.Popen([sys.executable, '-c', SERVER, json.dumps(server_config(args, workdir, port))],
+                                      cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT)
+            if not wait_for_server(port, server):
+                server.kill()
+                log.close()
+                sys.exit(f"Сервер не запустился:\n{(workdir / 'server.log').read_text()[-3000:]}")
+            args.url = f'http://127.0.0.1:{port}'
+
+        try:
+            stats, seconds, completed = asyncio.run(run(args))
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+                log.close()
+
+        error_log = workdir / 'errors.jsonl'
+        server_errors = []
+        if error_log.exists():
+            server_errors = [json.loads(line) for line in error_log.read_text(encoding='utf-8').splitlines()]
+        summary = summarize(stats, seconds, completed, args.users, server_errors)
+        print_summary(summary)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({'python': sys.version, 'url': args.url, 'iterations': args.iterations,
+                           'ramp_up': args.ramp_up, 'admins': args.admins,
+                           'sqlite_timeout': args.sqlite_timeout, 'immediate': args.immediate, **summary,
+                           'server_errors': server_errors}, f, ensure_ascii=False, indent=2)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""Микробенчмарки основных страниц и подсчета баллов на синтетических данных
+
+Для каждого размера (число ответов) создается отдельная база SQLite в
+--data-dir: миграции и synthetic.seed() с size / 10 участниками по 10 ответов.
+Готовые базы используются повторно, так что данные между запусками (и между
+коммитами) одинаковые. Замеряются:
+- report: страница отчета (сводная таблица и пары) и report_charts - первый
+  график, при котором строятся все графики отчета;
+- responses_list, participants_list, admin_dashboard;
+- take_survey_post: отправка бланка (в откатываемой транзакции, база не меняется);
+- compute_scores: подсчет баллов одного бланка, мкс на ответ;
+- score_array: подсчет баллов всех size ответов матрицей numpy.
+Страницы замеряются «холодными»: перед каждым повтором кэш отчета и панели
+очищается. Запросы идут через тестовый клиент Django от имени сотрудника.
+
+Результаты сохраняются в JSON вместе с коммитом; --compare показывает
+изменение относительно сохраненного ранее файла.
+
+Запуск из корня проекта (база на 1M ответов создается несколько минут):
+    python benchmarks/run.py --sizes 1000 10000 100000 --json bench.json
+    python benchmarks/run.py --sizes 1000 10000 100000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'san.settings')
+
+import django  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+RESPONSES_PER_PARTICIPANT = 10
+# Последний день синтетических ответов: одинаковые данные независимо от даты запуска
+UNTIL = date(2025, 1, 1)
+USERNAME = 'benchmark'
+SCORING_SAMPLE = 10000
+
+
+def commit():
+    """Текущий коммит; с суффиксом -dirty, если есть незакоммиченные изменения"""
+    try:
+        head = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f'{head}-dirty' if dirty else head
+
+
+def use_database(path):
+    from django.db import connections
+
+    connections['default'].close()
+    connections['default'].settings_dict['NAME'] = str(path)
+
+
+def prepare_database(path, size):
+    """Создает базу на size ответов, если ее еще нет; возвращает время создания (или None)"""
+    from django.contrib.auth.models import User
+    from django.core.management import call_command
+
+    from san_app import synthetic
+
+    use_database(path)
+    if path.exists():
+        return None
+    started = time.perf_counter()
+    try:
+        call_command('migrate', verbosity=0)
+        User.objects.create_user(USERNAME, password=USERNAME, is_staff=True)
+        synthetic.seed(max(1, size // RESPONSES_PER_PARTICIPANT), RESPONSES_PER_PARTICIPANT, until=UNTIL)
+    except BaseException:
+        # Недостроенную базу не оставляем: следующий запуск создаст ее заново
+        use_database(path)
+        path.unlink(missing_ok=True)
+        raise
+    return time.perf_counter() - started
+
+
+def clear_caches():
+    from django.core.cache import cache
+
+    from san_app.report_cache import report_cache
+
+    cache.clear()
+    report_cache.clear()
+
+
+def timed(func, repeat):
+    """Время повторов в мс; перед каждым повтором кэши очищаются"""
+    samples = []
+    for _ in range(repeat):
+        clear_caches()
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {'median_ms': statistics.median(samples), 'min_ms': min(samples), 'runs': samples}
+
+
+def get(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url}: код ответа {response.status_code}')
+    return response
+
+
+def post_survey(client, url, data):
+    from django.db import transaction
+
+    # Бланк сохраняется и сразу откатывается, чтобы повторы не меняли данные
+    with transaction.atomic():
+        response = client.post(url, data)
+        transaction.set_rollback(True)
+    if response.status_code != 200:
+        raise RuntimeError(f'{url}: код ответа {response.status_code}')
+
+
+def bench_size(size, data_dir, repeat):
+    import numpy as np
+    from django.test import Client
+    from django.urls import reverse
+
+    from san_app import synthetic
+    from san_app.models import Participant
+    from san_app.scoring import Q_FIELDS, compute_scores, score_array
+
+    path = data_dir / f'san_{size}.sqlite3'
+    seeded = prepare_database(path, size)
+    clear_caches()
+
+    from django.contrib.auth.models import User
+
+    client = Client()
+    client.force_login(User.objects.get(username=USERNAME))
+    participant = Participant.objects.order_by('id').first()
+    survey = {'phase': 'before', **{field: 1 for field in Q_FIELDS}}
+    survey_url = reverse('take_survey', args=[participant.id])
+    chart_url = reverse('report_chart', args=['means_bar', 'png'])
+
+    def report_with_charts():
+        get(client, reverse('report'))
+        get(client, chart_url)
+
+    results = {
+        'seed_seconds': seeded,
+        'report': timed(lambda: get(client, reverse('report')), repeat),
+        'report_charts': timed(report_with_charts, repeat),
+        'responses_list': timed(lambda: get(client, reverse('responses_list')), repeat),
+        'participants_list': timed(lambda: get(client, reverse('participants_list')), repeat),
+        'admin_dashboard': timed(lambda: get(client, reverse('admin_dashboard')), repeat),
+        'take_survey_post': timed(lambda: post_survey(client, survey_url, survey), repeat),
+    }
+
+    rng = np.random.default_rng(size)
+    answers = synthetic.answers_from_levels(rng, rng.normal(0, 0.7, (size, 3)))
+    sample = answers[:SCORING_SAMPLE].tolist()
+    scoring = timed(lambda: [compute_scores(row) for row in sample], repeat)
+    results['compute_scores'] = {
+        'median_us_per_response': scoring['median_ms'] * 1000 / len(sample),
+        'min_us_per_response': scoring['min_ms'] * 1000 / len(sample),
+    }
+    results['score_array'] = timed(lambda: score_array(answers), repeat)
+    return results
+
+
+def metric(result):
+    """Сравниваемое значение замера: медиана в мс или мкс на ответ"""
+    return result.get('median_ms', result.get('median_us_per_response'))
+
+
+def print_results(results, baseline=None):
+    baseline = baseline or {}
+    print(f"{'Размер':>9} {'Замер':<20} {'Медиана':>12} {'Минимум':>12} {'Было':>12} {'Изм.':>8}")
+    for size, benches in results.items():
+        for name, result in benches.items():
+            if not isinstance(result, dict):
+                continue
+            unit = 'мс' if 'median_ms' in result else 'мкс'
+            low = result.get('min_ms', result.get('min_us_per_response'))
+            line = f"{size:>9} {name:<20} {metric(result):>9.2f} {unit:<2} {low:>9.2f} {unit:<2}"
+            old = baseline.get(size, {}).get(name)
+            if isinstance(old, dict) and metric(old):
+                change = (metric(result) - metric(old)) / metric(old) * 100
+                line += f" {metric(old):>9.2f} {unit:<2} {change:>+7.1f}%"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help="Число ответов в базах")
+    parser.add_argument('--repeat', type=int, default=5, help="Повторов каждого замера (берется медиана)")
+    parser.add_argument('--data-dir', type=Path, default=Path(tempfile.gettempdir()) / 'san_benchmarks',
+                        help="Каталог баз с синтетическими данными (создаются один раз)")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    parser.add_argument('--compare', help="JSON-файл прошлого запуска для сравнения")
+    args = parser.parse_args()
+
+    django.setup()
+    from django.conf import settings
+
+    settings.DEBUG = False
+    settings.ALLOWED_HOSTS = ['testserver']
+    # Графики строятся прямо в запросе графика, а не фоновым заданием
+    settings.REPORT_JOBS_ENABLED = False
+    settings.METRICS_ENABLED = False
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for size in args.sizes:
+        print(f"Размер {size}...", file=sys.stderr)
+        results[str(size)] = bench_size(size, args.data_dir, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print(f"Сравнение с коммитом {baseline.get('commit')}")
+        baseline = baseline['sizes']
+    print_results(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'commit': commit(), 'python': platform.python_version(), 'django': django.get_version(),
+                       'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat, 'sizes': results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Время импорта и базовый объем памяти (RSS) точек входа san.wsgi и san.asgi
+
+Каждое измерение выполняется в отдельном чистом процессе Python: импортируется
+модуль приложения и загружается URLConf (как перед первым запросом). Для
+сравнения отдельно измеряется загрузка модуля отчетов san_app.reporting.
+
+Запуск из корня проекта:
+    python benchmarks/startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# Модули аналитического стека, которых не должно быть в памяти после старта
+HEAVY_MODULES = ['numpy', 'pandas', 'matplotlib', 'seaborn', 'scipy']
+
+PROBE = """
+import json, os, resource, sys, time
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'san.settings')
+
+def rss_kb():
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss // 1024 if sys.platform == 'darwin' else maxrss
+
+baseline = rss_kb()
+start = time.perf_counter()
+import importlib
+importlib.import_module(sys.argv[1])
+if sys.argv[1] != 'san_app.reporting':
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'rss_kb': rss_kb(),
+    'interpreter_rss_kb': baseline,
+    'heavy_modules': [name for name in %r if name in sys.modules],
+}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(module, runs):
+    samples = []
+    for _ in range(runs):
+        if module == 'san_app.reporting':
+            # Модулю отчетов нужен настроенный Django - настраиваем его до замера
+            code = "import django, os; os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'san.settings'); django.setup()\n"
+        else:
+            code = ''
+        result = subprocess.run(
+            [sys.executable, '-c', code + PROBE, module],
+            cwd=BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        'module': module,
+        'runs': runs,
+        'import_seconds_median': statistics.median(s['seconds'] for s in samples),
+        'import_seconds_min': min(s['seconds'] for s in samples),
+        'rss_mb_median': statistics.median(s['rss_kb'] for s in samples) / 1024,
+        'interpreter_rss_mb': statistics.median(s['interpreter_rss_kb'] for s in samples) / 1024,
+        'heavy_modules': samples[-1]['heavy_modules'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="Число запусков на модуль")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    parser.add_argument('--modules', nargs='+', default=['san.wsgi', 'san.asgi', 'san_app.reporting'])
+    args = parser.parse_args()
+
+    results = [measure(module, args.runs) for module in args.modules]
+    print(f"{'Модуль':<20} {'Импорт, мс':>12} {'RSS, МБ':>10}  Тяжелые модули")
+    for r in results:
+        print(f"{r['module']:<20} {r['import_seconds_median'] * 1000:>12.1f} {r['rss_mb_median']:>10.1f}  "
+              f"{', '.join(r['heavy_modules']) or '-'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'results': results}, f,
+                      ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
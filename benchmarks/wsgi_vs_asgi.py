@@ -0,0 +1,224 @@
+"""Нагрузочное сравнение синхронных view под WSGI и асинхронных view под ASGI
+
+Каждый режим запускается в отдельном процессе Python и обслуживает запросы
+обработчиком Django без сети, так что сравнивается только сам путь запроса:
+- wsgi: WSGIHandler и синхронные view (ASYNC_VIEWS = False), конкурентные
+  клиенты - потоки, как у многопоточного WSGI-сервера;
+- asgi: ASGIHandler и асинхронные view (ASYNC_VIEWS = True), конкурентные
+  клиенты - задачи одного цикла событий.
+Запросы идут от имени администратора --username (сессия в подписанной cookie,
+в базу не пишется). С --background один клиент все время запрашивает страницу
+отчета: видно, задерживает ли тяжелый отчет остальные запросы.
+
+Запуск из корня проекта:
+    python benchmarks/wsgi_vs_asgi.py --username admin --concurrency 20 --requests 50 --json wsgi_asgi.json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+DEFAULT_PATHS = ['/admin-dashboard/', '/participants/', '/responses/', '/responses/?phase=before&size=100']
+
+DRIVER = r"""
+import asyncio, json, os, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'san.settings')
+import django
+from django.conf import settings
+
+config = json.loads(sys.argv[1])
+django.setup()
+settings.ASYNC_VIEWS = config['mode'] == 'asgi'
+settings.SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+settings.DEBUG = False
+settings.ALLOWED_HOSTS = ['localhost']
+if config['database']:
+    from django.db import connections
+    connections['default'].close()
+    connections['default'].settings_dict['NAME'] = config['database']
+
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+
+user = User.objects.get(username=config['username'])
+session = SessionStore()
+session[SESSION_KEY] = str(user.pk)
+session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+session.save()
+COOKIE = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+def split(url):
+    path, _, query = url.partition('?')
+    return path, query
+
+def summary(latencies, errors, seconds, background):
+    latencies.sort()
+    return {
+        'mode': config['mode'], 'requests': len(latencies), 'errors': errors, 'seconds': seconds,
+        'rps': len(latencies) / seconds,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'background_requests': background,
+    }
+
+def run_wsgi():
+    from django.core.handlers.wsgi import WSGIHandler
+    handler = WSGIHandler()
+
+    def request(url):
+        path, query = split(url)
+        environ = {'PATH_INFO': path, 'QUERY_STRING': query, 'HTTP_COOKIE': COOKIE,
+                   'HTTP_HOST': 'localhost', 'wsgi.input': BytesIO()}
+        setup_testing_defaults(environ)
+        status = []
+        started = time.perf_counter()
+        body = handler(environ, lambda code, headers, exc_info=None: status.append(code))
+        b''.join(body)
+        if hasattr(body, 'close'):
+            body.close()
+        return time.perf_counter() - started, status[0].startswith('200')
+
+    def client(index):
+        results = []
+        for num in range(config['requests']):
+            results.append(request(config['paths'][(index + num) % len(config['paths'])]))
+        return results
+
+    stop, background = threading.Event(), [0]
+    def slow():
+        while not stop.is_set():
+            request(config['background'])
+            background[0] += 1
+
+    if config['background']:
+        request(config['background'])  # прогрев: первый отчет строится дольше
+        threading.Thread(target=slow, daemon=True).start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(config['concurrency']) as pool:
+        results = [item for chunk in pool.map(client, range(config['concurrency'])) for item in chunk]
+    seconds = time.perf_counter() - started
+    stop.set()
+    return summary([r[0] for r in results], sum(not r[1] for r in results), seconds, background[0])
+
+async def run_asgi():
+    from django.core.handlers.asgi import ASGIHandler
+    handler = ASGIHandler()
+
+    async def request(url):
+        path, query = split(url)
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                 'root_path': '', 'headers': [(b'host', b'localhost'), (b'cookie', COOKIE.encode())],
+                 'client': ('127.0.0.1', 50000), 'server': ('localhost', 80)}
+        sent, done = [], asyncio.Event()
+
+        async def receive():
+            if not sent:
+                sent.append(True)
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await done.wait()  # клиент не отключается, пока ответ не получен
+            return {'type': 'http.disconnect'}
+
+        status = []
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif not message.get('more_body'):
+                done.set()
+
+        started = time.perf_counter()
+        await handler(scope, receive, send)
+        return time.perf_counter() - started, status[0] == 200
+
+    async def client(index):
+        results = []
+        for num in range(config['requests']):
+            results.append(await request(config['paths'][(index + num) % len(config['paths'])]))
+        return results
+
+    background, stop = [0], asyncio.Event()
+    async def slow():
+        while not stop.is_set():
+            await request(config['background'])
+            background[0] += 1
+
+    task = None
+    if config['background']:
+        await request(config['background'])
+        task = asyncio.create_task(slow())
+    started = time.perf_counter()
+    chunks = await asyncio.gather(*(client(index) for index in range(config['concurrency'])))
+    seconds = time.perf_counter() - started
+    stop.set()
+    if task:
+        await task
+    results = [item for chunk in chunks for item in chunk]
+    return summary([r[0] for r in results], sum(not r[1] for r in results), seconds, background[0])
+
+result = run_wsgi() if config['mode'] == 'wsgi' else asyncio.run(run_asgi())
+print(json.dumps(result))
+"""
+
+
+def measure(mode, args):
+    config = {
+        'mode': mode, 'username': args.username, 'database': args.database, 'paths': args.paths,
+        'concurrency': args.concurrency, 'requests': args.requests, 'background': args.background,
+    }
+    result = subprocess.run([sys.executable, '-c', DRIVER, json.dumps(config)],
+                            cwd=BASE_DIR, capture_output=True, text=True)
+    if result.returncode:
+        sys.exit(f"Режим {mode} завершился с ошибкой:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--username', required=True, help="Администратор, от имени которого идут запросы")
+    parser.add_argument('--database', help="Путь к файлу SQLite вместо базы из настроек")
+    parser.add_argument('--concurrency', type=int, default=20, help="Число одновременных клиентов")
+    parser.add_argument('--requests', type=int, default=50, help="Запросов на одного клиента")
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS, help="Запрашиваемые страницы по кругу")
+    parser.add_argument('--background', help="Страница, которую все время запрашивает еще один клиент "
+                                             "(например, /report/)")
+    parser.add_argument('--runs', type=int, default=3, help="Число запусков на режим (берется медиана)")
+    parser.add_argument('--json', help="Сохранить результаты в JSON-файл")
+    args = parser.parse_args()
+
+    results = []
+    for mode in ('wsgi', 'asgi'):
+        runs = [measure(mode, args) for _ in range(args.runs)]
+        results.append({
+            'mode': mode,
+            'runs': runs,
+            'rps_median': statistics.median(r['rps'] for r in runs),
+            'p50_ms_median': statistics.median(r['p50_ms'] for r in runs),
+            'p95_ms_median': statistics.median(r['p95_ms'] for r in runs),
+            'errors': sum(r['errors'] for r in runs),
+        })
+
+    print(f"{'Режим':<6} {'Запр./с':>10} {'p50, мс':>10} {'p95, мс':>10} {'Ошибки':>8}")
+    for r in results:
+        print(f"{r['mode']:<6} {r['rps_median']:>10.1f} {r['p50_ms_median']:>10.1f} "
+              f"{r['p95_ms_median']:>10.1f} {r['errors']:>8}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version, 'concurrency': args.concurrency, 'requests': args.requests,
+                       'paths': args.paths, 'background': args.background, 'results': results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
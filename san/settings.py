@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым, чтобы время ответа включало все остальные middleware
+    'san_app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,13 +51,16 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Профилирование запросов сотрудников с ?profile=1 (нужен request.user)
+    'san_app.profiling.ProfilerMiddleware',
 ]
 
 ROOT_URLCONF = 'san.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # Движок Django с учетом времени отрисовки шаблонов в метриках (см. san_app/metrics.py)
+        'BACKEND': 'san_app.metrics.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -126,3 +132,87 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Отчеты
+# Максимальный суммарный размер отрисованных отчетов в кэше процесса (байт)
+REPORT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Число процессов для построения графиков в веб-процессе (0 - в текущем процессе, None - по числу ядер).
+# Пул процессов в каждом рабочем процессе веб-сервера держал бы в памяти по копии pandas/matplotlib
+# на ядро, поэтому параллельно графики строит только report_worker
+REPORT_CHART_WORKERS = 0
+# Число процессов для графиков в `python manage.py report_worker` (None - по числу ядер)
+REPORT_WORKER_CHART_WORKERS = None
+# Строить графики в фоновых заданиях `python manage.py report_worker`. Включать, только если обработчик
+# запущен: без него страница отчета для каждой новой версии данных ждет REPORT_JOBS_CLAIM_SECONDS
+REPORT_JOBS_ENABLED = False
+# Сколько завершенных заданий отчета хранить вместе с их графиками
+REPORT_JOBS_KEEP = 20
+# Через сколько секунд задание «в работе» считается брошенным и ставится заново
+REPORT_JOBS_STALE_SECONDS = 15 * 60
+# Если задание столько секунд никто не взял, страница отчета строит графики сама
+REPORT_JOBS_CLAIM_SECONDS = 10
+# Пары ответов «до / после»: максимальный интервал между ответами (часы)
+PAIRING_WINDOW_HOURS = 6
+# Число бутстреп-выборок для доверительных интервалов парных изменений
+PAIRING_BOOTSTRAP_RESAMPLES = 1000
+# То же при расчете прямо в запросе страницы отчета (без фонового задания): быстрее, интервалы грубее
+PAIRING_BOOTSTRAP_RESAMPLES_INTERACTIVE = 200
+
+# Список ответов: строк на странице по умолчанию и максимум для параметра size
+RESPONSES_PAGE_SIZE = 50
+RESPONSES_PAGE_SIZE_MAX = 500
+
+# Список участников: строк на странице
+PARTICIPANTS_PAGE_SIZE = 50
+
+# Панель администратора: сколько секунд хранить счетчики в кэше (сбрасываются и при изменениях)
+DASHBOARD_CACHE_TIMEOUT = 60
+
+# Выгрузка ответов: сколько строк читать из базы за один раз
+EXPORT_CHUNK_SIZE = 5000
+
+# Импорт бланков: каталог для файлов со строками, не прошедшими проверку
+IMPORT_ERRORS_DIR = Path(tempfile.gettempdir()) / 'san_import_errors'
+
+# Групповое занятие: сколько пустых строк-бланков показывать по умолчанию
+GROUP_SESSION_ROWS = 30
+
+# Буфер записи ответов опроса: пакетная запись из фонового потока вместо транзакции на каждый POST
+SURVEY_WRITE_BUFFER = False
+# Как часто записывать накопленные ответы (мс) и сколько строк максимум в одной пачке
+SURVEY_WRITE_BUFFER_INTERVAL_MS = 200
+SURVEY_WRITE_BUFFER_MAX_ROWS = 50
+# Файл для ответов, которые буфер не смог записать (записываются повторно при следующем запуске)
+SURVEY_WRITE_BUFFER_SPILL = BASE_DIR / 'survey_spill.jsonl'
+
+# Синхронизация бланков из очереди браузера: максимум бланков в одном запросе
+SURVEY_SYNC_MAX_BATCH = 100
+
+# Асинхронные view опроса, профиля, панели, списков и отчета (включать при запуске через ASGI, san.asgi)
+ASYNC_VIEWS = False
+# Асинхронные view: число потоков для построения отчетов вне цикла событий
+REPORT_ASYNC_THREADS = 2
+
+# Метрики запросов (/metrics): сбор в MetricsMiddleware
+METRICS_ENABLED = True
+# Писать в лог san_app.metrics запросы дольше стольких мс вместе с их SQL (None - не писать)
+METRICS_SLOW_REQUEST_MS = None
+# Сколько SQL-запросов медленного запроса сохранять для лога
+METRICS_SLOW_REQUEST_MAX_QUERIES = 50
+
+# Профилирование запросов сотрудников по ?profile=1 или заголовку X-Profile: 1
+PROFILING_ENABLED = True
+# Каталог для профилей и сколько последних профилей в нем хранить
+PROFILES_DIR = Path(tempfile.gettempdir()) / 'san_profiles'
+PROFILES_KEEP = 50
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'san_app': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
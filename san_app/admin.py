@@ -2,6 +2,50 @@
 from django.contrib import admin
 from .models import Participant, Response
 
+
+class ScoreLevelFilter(admin.SimpleListFilter):
+    """Фильтр по уровню балла шкалы: >5 благоприятный, 4-5 нормальный, <4 неблагоприятный"""
+    scale = 'overall'
+
+    def lookups(self, request, model_admin):
+        return [('good', 'Выше 5.0'), ('normal', '4.0 - 5.0'), ('bad', 'Ниже 4.0')]
+
+    def queryset(self, request, queryset):
+        level = self.value()
+        if level is None:
+            return queryset
+        queryset = queryset.with_scores()
+        if level == 'good':
+            return queryset.filter(**{f'{self.scale}__gt': 5.0})
+        if level == 'normal':
+            return queryset.filter(**{f'{self.scale}__gte': 4.0, f'{self.scale}__lte': 5.0})
+        return queryset.filter(**{f'{self.scale}__lt': 4.0})
+
+
+class WellbeingLevelFilter(ScoreLevelFilter):
+    title = 'Самочувствие'
+    parameter_name = 'wellbeing_level'
+    scale = 'wellbeing'
+
+
+class ActivityLevelFilter(ScoreLevelFilter):
+    title = 'Активность'
+    parameter_name = 'activity_level'
+    scale = 'activity'
+
+
+class MoodLevelFilter(ScoreLevelFilter):
+    title = 'Настроение'
+    parameter_name = 'mood_level'
+    scale = 'mood'
+
+
+class OverallLevelFilter(ScoreLevelFilter):
+    title = 'Общий балл'
+    parameter_name = 'overall_level'
+    scale = 'overall'
+
+
 @admin.register(Participant)
 class ParticipantAdmin(admin.ModelAdmin):
     list_display = ('name', 'gender', 'birth_date', 'user')
@@ -10,5 +54,8 @@ class ParticipantAdmin(admin.ModelAdmin):
 @admin.register(Response)
 class ResponseAdmin(admin.ModelAdmin):
     list_display = ('participant', 'phase', 'timestamp', 'wellbeing_score', 'activity_score', 'mood_score', 'overall_score')
-    list_filter = ('phase', 'participant__gender')
-    search_fields = ('participant__name',)
\ No newline at end of file
+    list_filter = ('phase', 'participant__gender', WellbeingLevelFilter, ActivityLevelFilter,
+                   MoodLevelFilter, OverallLevelFilter)
+    search_fields = ('participant__name',)
+    list_select_related = ('participant',)
+    readonly_fields = ('wellbeing_score', 'activity_score', 'mood_score', 'overall_score')
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""Асинхронные версии опроса, профиля, панели администратора, списков и отчета (для ASGI)
+
+Подключаются вместо views.py при ASYNC_VIEWS = True (см. urls.py). К базе эти
+view обращаются через асинхронный ORM (aget, acount, aiterator, acreate),
+поэтому запрос, ожидающий базу, не занимает поток сервера. Построение отчета и
+графиков (pandas, matplotlib, бутстреп) - тяжелая синхронная работа: она
+выполняется в отдельном пуле потоков REPORT_ASYNC_THREADS и не блокирует цикл
+событий. Шаблоны, контекст и проверки - общие с синхронными view.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required, user_passes_test
+from django.core.paginator import Paginator
+from django.db import close_old_connections
+from django.http import HttpResponseForbidden
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from . import dashboard, views, write_buffer
+from .forms import ParticipantForm, ReportFilterForm, ResponseForm
+from .models import Participant, Response
+from .pagination import akeyset_page
+from .views import is_admin
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def report_executor():
+    """Пул потоков для построения отчетов (создается при первом отчете)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.REPORT_ASYNC_THREADS,
+                                           thread_name_prefix='san-report')
+        return _executor
+
+
+async def run_in_report_executor(func, *args):
+    """Выполняет синхронную функцию в пуле отчетов и ждет результат, не блокируя цикл событий"""
+    def call():
+        try:
+            return func(*args)
+        finally:
+            # Потоки пула живут долго: соединения с базой закрываем так же, как после запроса
+            close_old_connections()
+
+    return await sync_to_async(call, thread_sensitive=False, executor=report_executor())()
+
+
+async def _user(request):
+    """Пользователь запроса, загруженный асинхронно
+
+    Подставляется и в request.user: шаблоны выводят request.user.username, а
+    ленивый объект пользователя обратился бы к базе синхронно из цикла событий.
+    """
+    request.user = await request.auser()
+    return request.user
+
+
+@login_required
+@user_passes_test(is_admin)
+async def admin_dashboard(request):
+    """Главная панель администратора (см. views.admin_dashboard)"""
+    await _user(request)
+    data = await dashboard.adashboard_data()
+    return render(request, 'admin_dashboard.html', views.dashboard_context(data))
+
+
+@login_required
+@user_passes_test(is_admin)
+async def participants_list(request):
+    """Список участников с поиском и постраничным выводом (см. views.participants_list)"""
+    await _user(request)
+    query = request.GET.get('q', '').strip()
+    participants = views.participants_queryset(query)
+    # Paginator считает строки синхронно, поэтому число строк получаем заранее через acount(),
+    # а строки нужной страницы читаем через aiterator()
+    size = settings.PARTICIPANTS_PAGE_SIZE
+    page = Paginator(range(await participants.acount()), size).get_page(request.GET.get('page'))
+    offset = (page.number - 1) * size
+    page.object_list = [participant async for participant in participants[offset:offset + size].aiterator()]
+    return render(request, 'participants_list.html', {'page': page, 'query': query})
+
+
+@login_required
+@user_passes_test(is_admin)
+async def responses_list(request):
+    """Список ответов по курсору (timestamp, id) (см. views.responses_list)"""
+    await _user(request)
+    filter_form = ReportFilterForm(request.GET)
+    responses = filter_form.filter_responses(Response.objects.select_related('participant'))
+    page = await akeyset_page(responses, request.GET.get('cursor'), views._page_size(request))
+    return views.responses_page_response(request, filter_form, page)
+
+
+@login_required
+async def profile(request):
+    """Страница профиля (см. views.profile)"""
+    user = await _user(request)
+    if user.is_staff:
+        return redirect('admin_dashboard')
+
+    participant = await Participant.objects.filter(user=user).afirst()
+    if not participant:
+        # Создаем участника с минимальными данными при первом входе
+        participant = await Participant.objects.acreate(
+            user=user,
+            name=user.username,
+            gender="M",
+            birth_date=datetime.now().date()
+        )
+
+    if request.method == 'POST':
+        form = ParticipantForm(request.POST, instance=participant)
+        if form.is_valid():
+            await participant.asave()
+            return redirect('take_survey', participant_id=participant.id)
+    else:
+        form = ParticipantForm(instance=participant)
+
+    return render(request, 'profile.html', {'form': form, 'participant': participant})
+
+
+@login_required
+async def take_survey(request, participant_id=None):
+    """Страница прохождения опроса САН (см. views.take_survey)"""
+    user = await _user(request)
+    if participant_id:
+        participant = await aget_object_or_404(Participant, id=participant_id)
+        # Проверка безопасности: участник должен принадлежать текущему пользователю
+        if participant.user_id != user.id and not user.is_staff:
+            return HttpResponseForbidden("У вас нет доступа к этому участнику.")
+    else:
+        participant = await Participant.objects.filter(user=user).afirst()
+        if not participant:
+            return redirect('profile')
+
+    if request.method == 'POST':
+        form = ResponseForm(request.POST)
+        if form.is_valid():
+            response = form.save(commit=False)
+            response.participant = participant
+            response.client_key = views._client_key(request.POST.get('client_key'))
+            previous = None
+            if response.client_key:
+                previous = await Response.objects.filter(client_key=response.client_key).afirst()
+            if previous and previous.participant_id != participant.id:
+                # Чужой ключ не должен мешать сохранению: просто сохраняем бланк без него
+                response.client_key = previous = None
+            if previous:
+                # Повторная отправка того же бланка: дубль не создаем
+                response = previous
+            elif settings.SURVEY_WRITE_BUFFER:
+                # submit() только кладет ответ в очередь и не ждет записи
+                response.compute_scores()
+                write_buffer.get_buffer().submit(response, participant.gender)
+            else:
+                response = await sync_to_async(views._save_survey_response)(response)
+            return views.survey_result(request, participant, response)
+    else:
+        form = ResponseForm()
+
+    return views.survey_page(request, participant, form)
+
+
+@login_required
+@user_passes_test(is_admin)
+async def report(request):
+    """Страница отчета: построение таблиц выполняется в пуле отчетов (см. views.report)"""
+    await _user(request)
+    return await run_in_report_executor(views.report_page, request)
+
+
+@login_required
+@user_passes_test(is_admin)
+async def report_chart(request, name, image_format):
+    """График отчета: проверка версии данных и отрисовка - в пуле отчетов (см. views.report_chart)"""
+    await _user(request)
+    return await run_in_report_executor(views.chart_response, request, name, image_format)
@@ -0,0 +1,44 @@
+"""Массовая запись ответов в обход save() и сигналов
+
+bulk_create не вызывает Response.save() и сигналы, поэтому баллы, сводная
+таблица ScoreRollup и кэши отчета и панели обновляются здесь явно.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+
+from . import dashboard, rollups
+from .models import Response
+from .report_cache import report_cache
+from .scoring import Q_FIELDS, SCALES, score_array
+
+
+def bulk_create_responses(responses, genders):
+    """Сохраняет ответы одним bulk_create в транзакции; genders - пол участника каждого ответа
+
+    Незаполненные баллы считаются одной матричной операцией. Размер пачки
+    INSERT Django подбирает сам по лимиту параметров базы.
+    """
+    missing = [response for response in responses if response.overall_score is None]
+    if missing:
+        scores = score_array([[getattr(response, field) for field in Q_FIELDS] for response in missing])
+        for response, row in zip(missing, scores.tolist()):
+            for scale, score in zip(SCALES, row):
+                setattr(response, f'{scale}_score', score)
+
+    by_gender = defaultdict(list)
+    for response, gender in zip(responses, genders):
+        by_gender[gender].append(response)
+
+    with transaction.atomic():
+        created = Response.objects.bulk_create(responses)
+        # Пол передается явно, чтобы не обращаться к participant каждого ответа
+        for gender, group in by_gender.items():
+            rollups.add_responses(group, gender=gender)
+        transaction.on_commit(invalidate_caches)
+    return created
+
+
+def invalidate_caches():
+    report_cache.clear()
+    dashboard.invalidate()
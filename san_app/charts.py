@@ -0,0 +1,168 @@
+"""Построение графиков отчета САН
+
+Каждый график - отдельная функция, которая принимает DataFrame отчета и
+возвращает matplotlib Figure (или None, если рисовать нечего). Используется
+только объектный API matplotlib без глобального состояния pyplot, поэтому
+графики можно строить параллельно в разных процессах. Модуль не зависит
+от Django и импортируется в рабочих процессах пула.
+"""
+from io import BytesIO
+
+import matplotlib
+
+matplotlib.use('Agg')  # Используем non-GUI backend
+from matplotlib.figure import Figure
+import seaborn as sns
+
+METRICS = ['wellbeing', 'activity', 'mood']
+METRIC_LABELS = {'wellbeing': 'Самочувствие', 'activity': 'Активность', 'mood': 'Настроение'}
+GENDER_LABELS = {'M': 'Мужской', 'F': 'Женский'}
+PHASE_LABELS = {'before': 'До занятия', 'after': 'После занятия'}
+
+
+def group_means(df):
+    """Средние баллы по (пол, фаза), если они не переданы готовыми"""
+    return df.groupby(['gender', 'phase'])[METRICS].mean()
+
+
+def means_bar_chart(df, means=None):
+    """1. Столбчатый график средних баллов по полу и фазе"""
+    grouped = group_means(df) if means is None else means
+    if grouped.empty:
+        return None
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    grouped.unstack().plot(kind='bar', ax=ax)
+    ax.set_title('Средние баллы САН до и после занятия по полу')
+    ax.set_ylabel('Балл')
+    ax.set_xlabel('Пол')
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.legend(title='Показатель / Фаза')
+    fig.tight_layout()
+    return fig
+
+
+def dynamics_chart(df, means=None):
+    """2. Линейный график изменений по фазам и полу"""
+    grouped = group_means(df) if means is None else means
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    for gender in ['M', 'F']:
+        if gender not in grouped.index.get_level_values('gender'):
+            continue
+        gender_data = grouped.xs(gender, level='gender').sort_index()
+        if not gender_data.empty:
+            for metric in METRICS:
+                ax.plot(gender_data.index, gender_data[metric],
+                        label=f'{METRIC_LABELS[metric]} ({GENDER_LABELS[gender]})', marker='o')
+    ax.set_title('Динамика баллов САН по фазам и полу')
+    ax.set_ylabel('Балл')
+    ax.set_xlabel('Фаза')
+    ax.legend()
+    fig.tight_layout()
+    return fig
+
+
+def wellbeing_pie_chart(df, gender, phase):
+    """3. Круговая диаграмма уровней самочувствия для пола и фазы"""
+    fig = Figure(figsize=(6, 6))
+    ax = fig.subplots()
+    subset = df[(df['gender'] == gender) & (df['phase'] == phase)]['wellbeing']
+    labels = ['>5', '4-5', '<4']
+    sizes = [
+        len(subset[subset > 5.0]),
+        len(subset[(subset >= 4.0) & (subset <= 5.0)]),
+        len(subset[subset < 4.0])
+    ]
+
+    if sum(sizes) > 0:
+        ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
+        ax.axis('equal')
+        ax.set_title(f'{GENDER_LABELS[gender]} - {PHASE_LABELS[phase]}\n(Самочувствие)')
+    else:
+        ax.text(0.5, 0.5, 'Нет данных', horizontalalignment='center',
+                verticalalignment='center', transform=ax.transAxes)
+        ax.axis('equal')
+        ax.set_title(f'{gender} - {phase} (Нет данных)')
+    fig.tight_layout()
+    return fig
+
+
+def age_scatter_chart(df):
+    """4. График рассеяния общего балла по возрасту"""
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    for phase in ['before', 'after']:
+        subset = df[df['phase'] == phase]
+        if not subset.empty:
+            ax.scatter(subset['age'], subset['overall'], label=PHASE_LABELS[phase], alpha=0.6, s=50)
+    ax.set_title('Общий балл vs Возраст по фазам')
+    ax.set_ylabel('Общий балл')
+    ax.set_xlabel('Возраст (лет)')
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    return fig
+
+
+def phase_boxplot_chart(df):
+    """5. Ящики с усами по каждому показателю в разрезе фаз"""
+    fig = Figure(figsize=(10, 6))
+    axes = fig.subplots(1, len(METRICS), sharey=True)
+    phases = sorted(df['phase'].unique())
+    for ax, metric in zip(axes, METRICS):
+        ax.boxplot([df.loc[df['phase'] == phase, metric] for phase in phases])
+        ax.set_xticks(range(1, len(phases) + 1))
+        ax.set_xticklabels(phases)
+        ax.set_title(metric)
+        ax.set_xlabel('Фаза')
+        ax.grid(True, alpha=0.3)
+    axes[0].set_ylabel('Балл')
+    fig.suptitle('Распределение баллов по фазам')
+    fig.tight_layout()
+    return fig
+
+
+def correlation_heatmap(df):
+    """6. Тепловая карта корреляции баллов и возраста"""
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    correlation_matrix = df[METRICS + ['age']].corr()
+    sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm',
+                vmin=-1, vmax=1, center=0, ax=ax, fmt='.2f')
+    ax.set_title('Корреляция между баллами и возрастом')
+    fig.tight_layout()
+    return fig
+
+
+# Графики, которым можно передать готовые средние по группам (например, из ScoreRollup)
+MEANS_CHARTS = {'means_bar', 'dynamics'}
+
+# Графики отчета в порядке вывода на странице: имя -> (функция, аргументы)
+CHARTS = {
+    'means_bar': (means_bar_chart, {}),
+    'dynamics': (dynamics_chart, {}),
+    'pie_M_before': (wellbeing_pie_chart, {'gender': 'M', 'phase': 'before'}),
+    'pie_M_after': (wellbeing_pie_chart, {'gender': 'M', 'phase': 'after'}),
+    'pie_F_before': (wellbeing_pie_chart, {'gender': 'F', 'phase': 'before'}),
+    'pie_F_after': (wellbeing_pie_chart, {'gender': 'F', 'phase': 'after'}),
+    'age_scatter': (age_scatter_chart, {}),
+    'boxplot': (phase_boxplot_chart, {}),
+    'correlation': (correlation_heatmap, {}),
+}
+
+
+def render_chart(name, df, image_format='png', means=None):
+    """Строит график по имени и возвращает изображение в байтах (или None)
+
+    means - средние по (пол, фаза); если не переданы, считаются по df.
+    """
+    builder, kwargs = CHARTS[name]
+    if name in MEANS_CHARTS and means is not None:
+        kwargs = dict(kwargs, means=means)
+    fig = builder(df, **kwargs)
+    if fig is None:
+        return None
+    buf = BytesIO()
+    fig.savefig(buf, format=image_format, bbox_inches='tight')
+    return buf.getvalue()
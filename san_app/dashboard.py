@@ -0,0 +1,81 @@
+"""Кэш данных панели администратора: счетчики и последние ответы
+
+Данные хранятся в кэше Django и сбрасываются сигналами при изменении
+ответов и участников (см. signals.py). DASHBOARD_CACHE_TIMEOUT ограничивает
+устаревание там, где сигналы не срабатывают: массовые update() и другие
+процессы при кэше в памяти процесса.
+"""
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import rollups
+from .models import Response
+
+CACHE_KEY = 'san_app:dashboard'
+RECENT_RESPONSES = 10
+
+
+class HitCounter:
+    """Число попаданий и промахов кэша в текущем процессе"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+stats = HitCounter()
+
+
+def _recent_responses():
+    return Response.objects.select_related('participant').order_by('-timestamp', '-id')[:RECENT_RESPONSES]
+
+
+def build_dashboard():
+    """Счетчики одним запросом и последние ответы (по индексу (timestamp, id))"""
+    return {'counts': rollups.dashboard_counts(), 'recent_responses': list(_recent_responses())}
+
+
+async def abuild_dashboard():
+    """Асинхронная версия build_dashboard() для ASGI"""
+    return {
+        'counts': await rollups.adashboard_counts(),
+        'recent_responses': [response async for response in _recent_responses().aiterator()],
+    }
+
+
+def dashboard_data():
+    data = cache.get(CACHE_KEY)
+    stats.record(data is not None)
+    if data is None:
+        data = build_dashboard()
+        cache.set(CACHE_KEY, data, settings.DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
+async def adashboard_data():
+    """Асинхронная версия dashboard_data(): кэш и база без блокировки цикла событий"""
+    data = await cache.aget(CACHE_KEY)
+    stats.record(data is not None)
+    if data is None:
+        data = await abuild_dashboard()
+        await cache.aset(CACHE_KEY, data, settings.DASHBOARD_CACHE_TIMEOUT)
+    return data
+
+
+def invalidate():
+    cache.delete(CACHE_KEY)
@@ -0,0 +1,133 @@
+"""Потоковая выгрузка ответов с данными участника и баллами шкал САН
+
+Строки читаются из базы порциями (iterator(chunk_size)) и сразу записываются
+в выходной формат, поэтому память не растет с числом ответов. CSV отдается
+по мере записи; XLSX и Parquet собираются во временном файле на диске и
+затем отдаются частями. openpyxl и pyarrow нужны только для своих форматов.
+"""
+import csv
+import tempfile
+from itertools import islice
+
+from django.utils import timezone
+
+from .scoring import Q_FIELDS, SCALES
+
+# Столбец выгрузки -> поле в запросе (баллы считаются в SQL, см. ResponseQuerySet.with_scores)
+EXPORT_COLUMNS = {
+    'response_id': 'id',
+    'participant_id': 'participant_id',
+    'participant': 'participant__name',
+    'gender': 'participant__gender',
+    'birth_date': 'participant__birth_date',
+    'phase': 'phase',
+    'timestamp': 'timestamp',
+    **{field: field for field in Q_FIELDS},
+    **{scale: scale for scale in SCALES},
+}
+
+FILE_CHUNK = 64 * 1024
+
+
+def export_chunks(queryset, chunk_size=5000):
+    """Порции строк выгрузки (списки кортежей в порядке EXPORT_COLUMNS)"""
+    rows = (queryset.with_scores().order_by('timestamp', 'id')
+            .values_list(*EXPORT_COLUMNS.values()).iterator(chunk_size=chunk_size))
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Echo:
+    """Файлоподобный объект для csv.writer: write() возвращает строку, а не пишет ее"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(queryset, chunk_size=5000):
+    """CSV в UTF-8 с BOM (чтобы Excel верно показал кириллицу), по одному куску на порцию строк"""
+    writer = csv.writer(_Echo())
+    yield ('\ufeff' + writer.writerow(EXPORT_COLUMNS)).encode()
+    timestamp_col = list(EXPORT_COLUMNS).index('timestamp')
+    for chunk in export_chunks(queryset, chunk_size):
+        lines = []
+        for row in chunk:
+            row = list(row)
+            row[timestamp_col] = timezone.localtime(row[timestamp_col]).isoformat()
+            lines.append(writer.writerow(row))
+        yield ''.join(lines).encode()
+
+
+def _spooled(write):
+    """Записывает файл функцией write(file) во временный файл и отдает его частями"""
+    with tempfile.TemporaryFile() as file:
+        write(file)
+        file.seek(0)
+        while data := file.read(FILE_CHUNK):
+            yield data
+
+
+def stream_xlsx(queryset, chunk_size=5000):
+    """XLSX, записанный openpyxl в режиме write_only (строки не держатся в памяти)"""
+    from openpyxl import Workbook
+
+    timestamp_col = list(EXPORT_COLUMNS).index('timestamp')
+
+    def write(file):
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Ответы')
+        sheet.append(list(EXPORT_COLUMNS))
+        for chunk in export_chunks(queryset, chunk_size):
+            for row in chunk:
+                row = list(row)
+                # Excel не хранит часовой пояс: пишем местное время
+                row[timestamp_col] = timezone.make_naive(row[timestamp_col])
+                sheet.append(row)
+        workbook.save(file)
+
+    return _spooled(write)
+
+
+def stream_parquet(queryset, chunk_size=5000):
+    """Parquet: каждая порция строк записывается отдельной группой строк (row group)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [('response_id', pa.int64()), ('participant_id', pa.int64()), ('participant', pa.string()),
+         ('gender', pa.string()), ('birth_date', pa.date32()), ('phase', pa.string()),
+         ('timestamp', pa.timestamp('us', tz='UTC'))]
+        + [(field, pa.int8()) for field in Q_FIELDS]
+        + [(scale, pa.float64()) for scale in SCALES]
+    )
+
+    def write(file):
+        with pq.ParquetWriter(file, schema) as writer:
+            for chunk in export_chunks(queryset, chunk_size):
+                columns = [pa.array(column, type=field.type) for column, field in zip(zip(*chunk), schema)]
+                writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+
+    return _spooled(write)
+
+
+# Формат -> (MIME-тип, функция выгрузки, необязательная зависимость)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', stream_csv, None),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', stream_xlsx, 'openpyxl'),
+    'parquet': ('application/vnd.apache.parquet', stream_parquet, 'pyarrow'),
+}
+
+
+def missing_dependency(export_format):
+    """Имя неустановленного пакета, нужного для формата, или None"""
+    module = EXPORT_FORMATS[export_format][2]
+    if module is None:
+        return None
+    try:
+        __import__(module)
+    except ImportError:
+        return module
+    return None
@@ -1,7 +1,13 @@
+from datetime import date, datetime, time, timedelta
+from urllib.parse import urlencode
+
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import Participant, Response
+from django.utils import timezone
+from . import rollups
+from .models import Participant, Response, ScoreRollup
+from .scoring import Q_FIELDS
 
 
 class ParticipantForm(forms.ModelForm):
@@ -64,4 +70,184 @@ class CustomUserCreationForm(UserCreationForm):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['password1'].label = "Пароль"
-        self.fields['password2'].label = "Подтверждение пароля"
\ No newline at end of file
+        self.fields['password2'].label = "Подтверждение пароля"
+
+
+class GroupSessionForm(forms.Form):
+    """Общие данные группового занятия: фаза для всех бланков"""
+    phase = forms.ChoiceField(choices=Response.phase.field.choices, label='Фаза тестирования')
+
+
+class GroupResponseForm(forms.Form):
+    """Один бланк в групповом вводе: участник и ответы q1..q30
+
+    Список участников передается в форму готовым (form_kwargs формсета), чтобы
+    формы не запрашивали его из базы каждая по отдельности.
+    """
+
+    def __init__(self, *args, participant_choices=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['participant'] = forms.TypedChoiceField(
+            choices=[('', '—')] + list(participant_choices), coerce=int, label='Участник')
+        for field in Q_FIELDS:
+            self.fields[field] = forms.IntegerField(
+                min_value=-3, max_value=3, label=field[1:],
+                widget=forms.NumberInput(attrs={'min': -3, 'max': 3, 'class': 'answer'}))
+
+
+class BaseGroupResponseFormSet(forms.BaseFormSet):
+    def clean(self):
+        if any(self.errors):
+            return
+        seen = set()
+        for form in self.forms:
+            participant = form.cleaned_data.get('participant')
+            if participant in seen:
+                raise forms.ValidationError('Один участник указан в нескольких строках.')
+            if participant:
+                seen.add(participant)
+        if not seen:
+            raise forms.ValidationError('Заполните хотя бы один бланк.')
+
+
+GroupResponseFormSet = forms.formset_factory(
+    GroupResponseForm, formset=BaseGroupResponseFormSet, extra=0, max_num=60, validate_max=True)
+
+
+class SyncResponseForm(forms.Form):
+    """Бланк из очереди браузера для пакетной синхронизации (см. sync.py)"""
+    client_key = forms.UUIDField()
+    participant = forms.IntegerField()
+    phase = forms.ChoiceField(choices=Response.phase.field.choices)
+    submitted_at = forms.DateTimeField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field in Q_FIELDS:
+            self.fields[field] = forms.IntegerField(min_value=-3, max_value=3)
+
+    def clean_submitted_at(self):
+        # Время заполнения берется с устройства, но не позже текущего момента
+        value = self.cleaned_data['submitted_at']
+        now = timezone.now()
+        return min(value, now) if value else now
+
+
+class ImportUploadForm(forms.Form):
+    file = forms.FileField(label='Файл CSV или XLSX')
+    dry_run = forms.BooleanField(required=False, label='Только проверить, не записывая')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if file.name.rsplit('.', 1)[-1].lower() not in ('csv', 'xlsx'):
+            raise forms.ValidationError('Поддерживаются только файлы CSV и XLSX.')
+        return file
+
+
+def years_ago(today, years):
+    """Дата, отстоящая от today на years лет назад (29 февраля -> 28 февраля)"""
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        return today.replace(year=today.year - years, day=28)
+
+
+class ReportFilterForm(forms.Form):
+    """Фильтры отчета: период, пол, возрастной диапазон, фаза и выбранные участники
+
+    Все фильтры переводятся в условия запроса к базе (см. filter_responses).
+    Некорректно заполненные поля просто не применяются.
+    """
+    date_from = forms.DateField(required=False, label='С даты',
+                                widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, label='По дату',
+                              widget=forms.DateInput(attrs={'type': 'date'}))
+    gender = forms.ChoiceField(required=False, label='Пол',
+                               choices=[('', 'Все')] + Participant.gender.field.choices)
+    age_min = forms.IntegerField(required=False, min_value=0, max_value=120, label='Возраст от')
+    age_max = forms.IntegerField(required=False, min_value=0, max_value=120, label='Возраст до')
+    phase = forms.ChoiceField(required=False, label='Фаза',
+                              choices=[('', 'Все')] + Response.phase.field.choices)
+    participants = forms.CharField(required=False, label='ID участников',
+                                   help_text='Через запятую, например: 3, 7, 12')
+
+    def __init__(self, data=None, **kwargs):
+        # Форма всегда связана с данными (пустые данные - отчет без фильтров) и
+        # проверяется сразу, чтобы cleaned_data был доступен для построения запроса
+        super().__init__(data or {}, **kwargs)
+        self.is_valid()
+
+    def clean_participants(self):
+        value = self.cleaned_data['participants']
+        try:
+            return sorted({int(part) for part in value.replace(' ', '').split(',') if part})
+        except ValueError:
+            raise forms.ValidationError('Укажите номера участников через запятую.')
+
+    def filter_responses(self, queryset):
+        """Применяет фильтры к queryset ответов (все условия выполняются в базе)"""
+        data = self.cleaned_data
+        if data.get('date_from'):
+            queryset = queryset.filter(timestamp__gte=self._day_start(data['date_from']))
+        if data.get('date_to'):
+            queryset = queryset.filter(timestamp__lt=self._day_start(data['date_to'] + timedelta(days=1)))
+        if data.get('gender'):
+            queryset = queryset.filter(participant__gender=data['gender'])
+        if data.get('phase'):
+            queryset = queryset.filter(phase=data['phase'])
+        # Возраст переводится в диапазон дат рождения, чтобы условие шло по столбцу
+        today = date.today()
+        if data.get('age_min') is not None:
+            queryset = queryset.filter(participant__birth_date__lte=years_ago(today, data['age_min']))
+        if data.get('age_max') is not None:
+            queryset = queryset.filter(participant__birth_date__gt=years_ago(today, data['age_max'] + 1))
+        if data.get('participants'):
+            queryset = queryset.filter(participant_id__in=data['participants'])
+        return queryset
+
+    def rollup_queryset(self):
+        """Строки ScoreRollup для выбранных фильтров или None, если по ним фильтры не выразить
+
+        Сводная таблица хранит суммы по полу, фазе и дню, поэтому подходит только
+        для фильтров по периоду, полу и фазе.
+        """
+        data = self.cleaned_data
+        if data.get('age_min') is not None or data.get('age_max') is not None or data.get('participants'):
+            return None
+        queryset = ScoreRollup.objects.all()
+        if data.get('date_from'):
+            queryset = queryset.filter(day__gte=data['date_from'])
+        if data.get('date_to'):
+            queryset = queryset.filter(day__lte=data['date_to'])
+        if data.get('gender'):
+            queryset = queryset.filter(gender=data['gender'])
+        if data.get('phase'):
+            queryset = queryset.filter(phase=data['phase'])
+        return queryset
+
+    def group_stats(self, responses):
+        """Средние и дисперсии по (пол, фаза) для выбранных фильтров
+
+        responses - уже отфильтрованная выборка ответов; она используется, только
+        если фильтры нельзя применить к сводной таблице ScoreRollup.
+        """
+        rollup_queryset = self.rollup_queryset()
+        if rollup_queryset is not None:
+            return rollups.group_stats(rollup_queryset)
+        return rollups.response_group_stats(responses)
+
+    def query_string(self):
+        """Примененные фильтры в каноническом виде (для ссылок, ключей кэша и заданий)"""
+        params = []
+        for name in self.fields:
+            value = self.cleaned_data.get(name)
+            if value in (None, '', []):
+                continue
+            if name == 'participants':
+                value = ','.join(str(pk) for pk in value)
+            params.append((name, value))
+        return urlencode(params)
+
+    @staticmethod
+    def _day_start(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
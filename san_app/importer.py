@@ -0,0 +1,267 @@
+"""Массовый импорт ответов САН из CSV и XLSX (оцифрованные бумажные бланки)
+
+Файл читается построчно и обрабатывается партиями: ответы q1..q30 всей
+партии проверяются одной матричной операцией, участники ищутся в словаре
+(имя, дата рождения) в памяти, ответы вставляются через bulk_create в одной
+транзакции на партию (см. bulk.py). Строки с ошибками пропускаются и записываются в файл
+ошибок вместе с номером строки и причиной.
+
+Столбцы: participant, gender, birth_date, phase, q1..q30 и необязательный
+timestamp - те же, что у выгрузки (export.py), поэтому выгрузку можно
+загрузить обратно.
+"""
+import csv
+import io
+import time
+import zipfile
+from dataclasses import dataclass
+from datetime import date, datetime
+from itertools import islice
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from .bulk import bulk_create_responses
+from .models import Participant, Response
+from .scoring import Q_FIELDS, SCALES, score_array
+
+REQUIRED_COLUMNS = ['participant', 'gender', 'birth_date', 'phase'] + Q_FIELDS
+
+# Допустимые написания пола и фазы на бумажных бланках
+GENDERS = {'m': 'M', 'f': 'F', 'м': 'M', 'ж': 'F'}
+PHASES = {'before': 'before', 'after': 'after', 'до': 'before', 'после': 'after'}
+
+DATE_FORMATS = ['%Y-%m-%d', '%d.%m.%Y']
+DATETIME_FORMATS = ['%d.%m.%Y %H:%M', '%d.%m.%Y %H:%M:%S']
+
+
+class ImportFormatError(ValueError):
+    """Файл нельзя импортировать целиком (например, нет обязательных столбцов)"""
+
+
+@dataclass
+class ImportResult:
+    rows: int = 0
+    imported: int = 0
+    failed: int = 0
+    participants_created: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def read_csv(file):
+    """Строки CSV-файла как словари; file - текстовый или двоичный файл (UTF-8, в т.ч. с BOM)
+
+    Файл в другой кодировке (например, cp1251 - обычный CSV из Excel) и
+    испорченный CSV дают ImportFormatError.
+    """
+    if not isinstance(file, io.TextIOBase):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    rows = csv.DictReader(file)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except UnicodeDecodeError:
+            raise ImportFormatError("Файл не в кодировке UTF-8: сохраните его в Excel как «CSV UTF-8»")
+        except csv.Error as e:
+            raise ImportFormatError(f"Некорректный CSV (строка {rows.line_num}): {e}")
+        yield row
+
+
+def read_xlsx(file):
+    """Строки первого листа XLSX как словари; лист читается потоково (read_only)"""
+    from openpyxl import load_workbook
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        sheet = load_workbook(file, read_only=True, data_only=True).worksheets[0]
+    except (zipfile.BadZipFile, InvalidFileException, KeyError, IndexError) as e:
+        raise ImportFormatError(f"Файл не является книгой XLSX или поврежден: {e}")
+    rows = sheet.iter_rows(values_only=True)
+    header = [str(value).strip() if value is not None else '' for value in next(rows, [])]
+    for values in rows:
+        yield dict(zip(header, values))
+
+
+READERS = {'csv': read_csv, 'xlsx': read_xlsx}
+
+
+def parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f"некорректная дата рождения: {text!r}")
+
+
+def parse_timestamp(value):
+    """Время ответа; пустое значение - текущее время, время без пояса - в поясе сайта"""
+    if value in (None, ''):
+        return timezone.now()
+    if not isinstance(value, datetime):
+        text = str(value).strip()
+        try:
+            value = datetime.fromisoformat(text)
+        except ValueError:
+            for fmt in DATETIME_FORMATS:
+                try:
+                    value = datetime.strptime(text, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"некорректное время ответа: {text!r}")
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value)
+    return value
+
+
+def answers_matrix(rows):
+    """Матрица ответов q1..q30 (n x 30) в float; нечисловые значения - NaN
+
+    Обычно вся партия преобразуется одним вызовом NumPy; построчный разбор
+    нужен только если в партии есть пустые или нечисловые значения.
+    """
+    raw = [[row.get(field) for field in Q_FIELDS] for row in rows]
+    try:
+        return np.array(raw, dtype=np.float64).reshape(-1, len(Q_FIELDS))
+    except (TypeError, ValueError):
+        pass
+
+    def number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return np.nan
+
+    return np.array([[number(value) for value in values] for values in raw],
+                    dtype=np.float64).reshape(-1, len(Q_FIELDS))
+
+
+def invalid_answers(matrix):
+    """Маска недопустимых ответов: не число, не целое или вне диапазона -3..+3"""
+    with np.errstate(invalid='ignore'):
+        return np.isnan(matrix) | (matrix != np.round(matrix)) | (np.abs(matrix) > 3)
+
+
+class ResponseImporter:
+    """Импорт ответов партиями; errors - текстовый файл для CSV с ошибочными строками"""
+
+    def __init__(self, batch_size=2000, errors=None, dry_run=False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.result = ImportResult()
+        self._errors = csv.writer(errors) if errors is not None else None
+        # (имя, дата рождения) -> (id, пол) для всех участников
+        self._participants = {
+            (name, birth_date): (pk, gender)
+            for pk, name, birth_date, gender in
+            Participant.objects.values_list('id', 'name', 'birth_date', 'gender').iterator()
+        }
+
+    def run(self, rows):
+        """Импортирует строки (словари столбец -> значение), возвращает ImportResult"""
+        started = time.perf_counter()
+        numbered = enumerate(rows, start=2)  # строка 1 - заголовок
+        header_checked = False
+        if self._errors:
+            self._errors.writerow(['line', 'error'] + REQUIRED_COLUMNS + ['timestamp'])
+        try:
+            while True:
+                batch = list(islice(numbered, self.batch_size))
+                if not batch:
+                    break
+                if not header_checked:
+                    missing = [column for column in REQUIRED_COLUMNS if column not in batch[0][1]]
+                    if missing:
+                        raise ImportFormatError(f"Нет обязательных столбцов: {', '.join(missing)}")
+                    header_checked = True
+                self._import_batch(batch)
+        except ImportFormatError as e:
+            # Партии до ошибки уже записаны (у каждой своя транзакция) - сообщаем, сколько строк
+            if self.result.imported and not self.dry_run:
+                raise ImportFormatError(f"{e}. Строк, импортированных до ошибки: {self.result.imported}") from e
+            raise
+        self.result.seconds = time.perf_counter() - started
+        return self.result
+
+    def _fail(self, line, row, message):
+        self.result.failed += 1
+        if self._errors:
+            self._errors.writerow([line, message] + [row.get(column, '') for column in REQUIRED_COLUMNS]
+                                  + [row.get('timestamp', '')])
+
+    def _import_batch(self, batch):
+        self.result.rows += len(batch)
+        rows = [row for _, row in batch]
+        answers = answers_matrix(rows)
+        invalid = invalid_answers(answers)
+        bad_rows = invalid.any(axis=1)
+
+        valid = []  # (индекс в партии, ключ участника, пол, фаза, время)
+        for index, (line, row) in enumerate(batch):
+            if bad_rows[index]:
+                fields = ', '.join(Q_FIELDS[col] for col in np.flatnonzero(invalid[index]))
+                self._fail(line, row, f"ответы вне диапазона -3..+3 или не целые: {fields}")
+                continue
+            try:
+                name = str(row['participant'] or '').strip()
+                if not name:
+                    raise ValueError("не указан участник")
+                gender = GENDERS.get(str(row['gender'] or '').strip().lower())
+                if gender is None:
+                    raise ValueError(f"некорректный пол: {row['gender']!r}")
+                phase = PHASES.get(str(row['phase'] or '').strip().lower())
+                if phase is None:
+                    raise ValueError(f"некорректная фаза: {row['phase']!r}")
+                key = (name, parse_date(row['birth_date']))
+                timestamp = parse_timestamp(row.get('timestamp'))
+            except ValueError as e:
+                self._fail(line, row, str(e))
+                continue
+            valid.append((index, key, gender, phase, timestamp))
+
+        if self.dry_run:
+            # Проверка без записи: считаем строки, которые были бы импортированы
+            self.result.imported += len(valid)
+            return
+        if not valid:
+            return
+
+        scores = score_array(answers[[index for index, *_ in valid]].astype(np.int64))
+        with transaction.atomic():
+            self._create_participants(valid)
+            responses, genders = [], []
+            for (index, key, _, phase, timestamp), row_scores in zip(valid, scores.tolist()):
+                participant_id, gender = self._participants[key]
+                responses.append(Response(
+                    participant_id=participant_id, phase=phase, timestamp=timestamp,
+                    **dict(zip(Q_FIELDS, answers[index].astype(int).tolist())),
+                    **{f'{scale}_score': score for scale, score in zip(SCALES, row_scores)}))
+                genders.append(gender)
+            bulk_create_responses(responses, genders)
+        self.result.imported += len(responses)
+
+    def _create_participants(self, valid):
+        """Создает участников, которых еще нет в словаре, одним bulk_create"""
+        new = {}
+        for _, key, gender, *_ in valid:
+            if key not in self._participants and key not in new:
+                new[key] = Participant(name=key[0], birth_date=key[1], gender=gender)
+        if new:
+            Participant.objects.bulk_create(new.values())
+            for key, participant in new.items():
+                self._participants[key] = (participant.pk, participant.gender)
+            self.result.participants_created += len(new)
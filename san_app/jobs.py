@@ -0,0 +1,170 @@
+"""Фоновые задания построения отчета
+
+Очередь хранится в таблице ReportJob, поэтому внешний брокер не нужен:
+страница отчета ставит задание для текущей версии данных (или переиспользует
+уже поставленное), команда report_worker забирает задания и строит графики
+и таблицу парных изменений (бутстреп - самая долгая часть таблиц отчета), а
+готовые изображения и HTML таблицы сохраняются в ReportArtifact.
+
+Задание, которое обработчик взял и не завершил за REPORT_JOBS_STALE_SECONDS
+(обработчик упал), помечается ошибкой и ставится заново. Если задание никто не
+взял за REPORT_JOBS_CLAIM_SECONDS (report_worker не запущен), страница отчета
+строит графики сама, как без фоновых заданий. Новое задание отменяет ждущие
+задания прежних версий данных и удаляет лишние завершенные (prune), так что и
+без обработчика таблица заданий не растет.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.http import QueryDict
+from django.utils import timezone
+
+from .forms import ReportFilterForm
+from .models import ReportArtifact, ReportJob, Response
+
+CHART_CONTENT_TYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+ACTIVE_STATUSES = ['queued', 'running', 'done']
+
+# Имя артефакта с HTML таблицы парных изменений (остальные артефакты - графики)
+PAIRS_ARTIFACT = 'pairs_table'
+
+
+def expire_stale():
+    """Задания «в работе» дольше REPORT_JOBS_STALE_SECONDS считаются брошенными (обработчик упал)
+
+    Они помечаются ошибкой, и enqueue() ставит вместо них новое задание.
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.REPORT_JOBS_STALE_SECONDS)
+    return (ReportJob.objects.filter(status='running', started_at__lt=deadline)
+            .update(status='failed', error='Задание не завершилось вовремя: обработчик остановлен?',
+                    finished_at=timezone.now()))
+
+
+def unclaimed(job):
+    """Задание дольше REPORT_JOBS_CLAIM_SECONDS в очереди: похоже, report_worker не запущен"""
+    deadline = timezone.now() - timedelta(seconds=settings.REPORT_JOBS_CLAIM_SECONDS)
+    return job.status == 'queued' and job.created_at < deadline
+
+
+def enqueue(version, image_format='png', filters=''):
+    """Задание для версии данных и фильтров: уже существующее (в очереди, в работе, готовое) или новое"""
+    expire_stale()
+    job = (ReportJob.objects
+           .filter(data_version=version, filters=filters, image_format=image_format,
+                   status__in=ACTIVE_STATUSES)
+           .order_by('-id').first())
+    if job is None:
+        job = ReportJob.objects.create(data_version=version, filters=filters, image_format=image_format)
+        # Ждущие задания прежних версий уже не нужны (как в claim_next), а завершенные чистятся
+        # здесь же: без report_worker их больше никто не удалит
+        (ReportJob.objects.filter(status='queued', id__lt=job.id)
+         .exclude(data_version=version)
+         .update(status='cancelled', finished_at=timezone.now()))
+        prune(getattr(settings, 'REPORT_JOBS_KEEP', 20))
+    return job
+
+
+def claim_next():
+    """Забирает самое свежее задание из очереди; задания для устаревших версий отменяются"""
+    expire_stale()
+    job = ReportJob.objects.filter(status='queued').order_by('-id').first()
+    if job is None:
+        return None
+    now = timezone.now()
+    (ReportJob.objects.filter(status='queued', id__lt=job.id)
+     .exclude(data_version=job.data_version)
+     .update(status='cancelled', finished_at=now))
+    # Условное обновление: если задание забрал другой обработчик, ничего не изменится
+    claimed = (ReportJob.objects.filter(pk=job.pk, status='queued')
+               .update(status='running', stage='load', started_at=now))
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run_job(job, workers=None):
+    """Строит графики задания и сохраняет их; по стадиям обновляет прогресс и длительность"""
+    timings = {}
+
+    def update(**fields):
+        ReportJob.objects.filter(pk=job.pk).update(**fields)
+
+    try:
+        # Модуль отчетов с pandas/matplotlib загружается только в обработчике заданий
+        from . import reporting
+
+        filter_form = ReportFilterForm(QueryDict(job.filters))
+        responses = filter_form.filter_responses(Response.objects.all())
+
+        start = time.perf_counter()
+        df = reporting.load_report_frame(responses)
+        timings['load'] = round(time.perf_counter() - start, 3)
+        update(stage='score', progress=10, timings=dict(timings))
+
+        start = time.perf_counter()
+        means = reporting.means_frame(filter_form.group_stats(responses))
+        timings['score'] = round(time.perf_counter() - start, 3)
+        update(stage='pairs', progress=20, timings=dict(timings))
+
+        start = time.perf_counter()
+        pairs_html = reporting.pairs_table_html(responses, timedelta(hours=settings.PAIRING_WINDOW_HOURS),
+                                                settings.PAIRING_BOOTSTRAP_RESAMPLES)
+        ReportArtifact.objects.create(job=job, name=PAIRS_ARTIFACT, data=pairs_html.encode(),
+                                      content_type='text/html; charset=utf-8')
+        timings['pairs'] = round(time.perf_counter() - start, 3)
+        update(stage='charts', progress=30, timings=dict(timings))
+
+        done = 0
+        start = time.perf_counter()
+
+        def on_chart(name, image, seconds):
+            nonlocal done
+            done += 1
+            timings[f'chart:{name}'] = round(seconds, 3)
+            if image:
+                ReportArtifact.objects.create(job=job, name=name, data=image,
+                                              content_type=CHART_CONTENT_TYPES[job.image_format])
+            update(progress=30 + 70 * done // len(reporting.CHARTS), timings=dict(timings))
+
+        reporting.render_charts(df, workers=workers, image_format=job.image_format, means=means,
+                                on_chart=on_chart)
+        timings['charts'] = round(time.perf_counter() - start, 3)
+        update(status='done', stage='', progress=100, timings=dict(timings), finished_at=timezone.now())
+    except Exception as e:
+        update(status='failed', error=str(e), timings=dict(timings), finished_at=timezone.now())
+        raise
+    finally:
+        job.refresh_from_db()
+    return job
+
+
+def job_charts(version, image_format='png', filters=''):
+    """Готовые графики для версии данных и фильтров из последнего выполненного задания (или None)"""
+    job = (ReportJob.objects
+           .filter(data_version=version, filters=filters, image_format=image_format, status='done')
+           .order_by('-id').first())
+    if job is None:
+        return None
+    return {artifact.name: bytes(artifact.data) for artifact in job.artifacts.exclude(name=PAIRS_ARTIFACT)}
+
+
+def job_pairs_table(job):
+    """HTML таблицы пар из выполненного задания или None (задание старше этой стадии)"""
+    artifact = job.artifacts.filter(name=PAIRS_ARTIFACT).first()
+    return bytes(artifact.data).decode() if artifact else None
+
+
+def prune(keep):
+    """Удаляет завершенные задания, кроме последних keep"""
+    finished = ReportJob.objects.exclude(status__in=['queued', 'running']).order_by('-id')
+    stale_ids = list(finished.values_list('id', flat=True)[keep:])
+    with transaction.atomic():
+        ReportJob.objects.filter(id__in=stale_ids).delete()
+    return len(stale_ids)
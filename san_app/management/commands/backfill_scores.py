@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from san_app import rollups
+from san_app.bulk import invalidate_caches
+from san_app.models import Response
+from san_app.scoring import score_matrix
+
+
+class Command(BaseCommand):
+    help = "Заполняет сохраненные баллы шкал САН для уже существующих ответов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Сколько ответов читать, считать и обновлять за одну транзакцию")
+        parser.add_argument('--all', action='store_true',
+                            help="Пересчитать все ответы, а не только незаполненные")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        responses = Response.objects.all()
+        if not options['all']:
+            responses = responses.filter(overall_score__isnull=True)
+
+        # Таблица обходится по id порциями batch_size: в памяти только одна порция,
+        # баллы порции считаются одной матричной операцией.
+        # updated_at меняется явно (bulk_update не трогает auto_now), чтобы сменилась версия данных отчета
+        now = timezone.now()
+        updated = last_id = 0
+        while True:
+            ids, scores = score_matrix(responses.filter(id__gt=last_id).order_by('id')[:batch_size],
+                                       with_ids=True, chunk_size=batch_size)
+            if not len(ids):
+                break
+            batch = [
+                Response(id=int(pk), wellbeing_score=row[0], activity_score=row[1],
+                         mood_score=row[2], overall_score=row[3], updated_at=now)
+                for pk, row in zip(ids.tolist(), scores.tolist())
+            ]
+            with transaction.atomic():
+                Response.objects.bulk_update(batch, Response.SCORE_FIELDS + ['updated_at'])
+            updated += len(batch)
+            last_id = batch[-1].id
+            if len(batch) < batch_size:
+                break
+
+        if updated:
+            # bulk_update не вызывает сигналы: сводная таблица (построенная миграцией еще по пустым
+            # баллам) и кэши отчета и панели обновляются здесь
+            with transaction.atomic():
+                groups = rollups.rebuild()
+                transaction.on_commit(invalidate_caches)
+            self.stdout.write(f"Сводная таблица пересобрана: {groups} групп")
+        self.stdout.write(self.style.SUCCESS(f"Обновлено ответов: {updated}"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from san_app.export import EXPORT_FORMATS, missing_dependency
+from san_app.forms import ReportFilterForm
+from san_app.models import Response
+
+
+class Command(BaseCommand):
+    help = "Выгружает ответы с данными участников и баллами шкал САН в CSV, XLSX или Parquet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv',
+                            help="Формат файла")
+        parser.add_argument('--output', '-o', default='-',
+                            help="Путь к файлу (по умолчанию CSV пишется в stdout)")
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help="Сколько строк читать из базы за один раз")
+        parser.add_argument('--date-from', help="С даты (ГГГГ-ММ-ДД)")
+        parser.add_argument('--date-to', help="По дату (ГГГГ-ММ-ДД)")
+        parser.add_argument('--gender', choices=['M', 'F'])
+        parser.add_argument('--phase', choices=['before', 'after'])
+        parser.add_argument('--participants', help="ID участников через запятую")
+
+    def handle(self, *args, **options):
+        export_format = options['format']
+        missing = missing_dependency(export_format)
+        if missing:
+            raise CommandError(f"Для формата {export_format} нужен пакет {missing}")
+        if options['output'] == '-' and export_format != 'csv':
+            raise CommandError("Двоичные форматы записываются только в файл: укажите --output")
+
+        # Фильтры те же, что у отчета и выгрузки с сайта
+        filters = {name: options[name] for name in ('date_from', 'date_to', 'gender', 'phase', 'participants')
+                   if options[name]}
+        filter_form = ReportFilterForm(filters)
+        if filter_form.errors:
+            raise CommandError(filter_form.errors.as_text())
+        responses = filter_form.filter_responses(Response.objects.all())
+
+        stream = EXPORT_FORMATS[export_format][1](responses, options['chunk_size'])
+        if options['output'] == '-':
+            for data in stream:
+                self.stdout.write(data.decode(), ending='')
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as file:
+            for data in stream:
+                file.write(data)
+                written += len(data)
+        self.stdout.write(self.style.SUCCESS(f"Записано {written} байт в {options['output']}"))
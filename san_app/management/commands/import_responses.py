@@ -0,0 +1,48 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from san_app.importer import READERS, ImportFormatError, ResponseImporter
+
+
+class Command(BaseCommand):
+    help = "Импортирует ответы САН из CSV или XLSX (столбцы как у export_responses)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к файлу CSV или XLSX")
+        parser.add_argument('--format', choices=list(READERS),
+                            help="Формат файла (по умолчанию - по расширению)")
+        parser.add_argument('--batch-size', type=int, default=2000,
+                            help="Сколько строк проверять и вставлять за одну транзакцию")
+        parser.add_argument('--errors', help="Файл для строк с ошибками (по умолчанию <path>.errors.csv)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Только проверить файл, ничего не записывая в базу")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f"Неизвестный формат файла: {file_format}")
+        errors_path = options['errors'] or f"{path}.errors.csv"
+
+        result = None
+        try:
+            with open(path, 'rb') as file, open(errors_path, 'w', newline='', encoding='utf-8') as errors:
+                importer = ResponseImporter(batch_size=options['batch_size'], errors=errors,
+                                            dry_run=options['dry_run'])
+                result = importer.run(READERS[file_format](file))
+        except (ImportFormatError, ImportError) as e:
+            raise CommandError(str(e))
+        finally:
+            if result is None and os.path.exists(errors_path):
+                os.remove(errors_path)
+
+        action = "Проверено (без записи)" if options['dry_run'] else "Импортировано"
+        self.stdout.write(self.style.SUCCESS(
+            f"{action}: {result.imported} из {result.rows} строк за {result.seconds:.2f} с "
+            f"({result.rows_per_second:.0f} строк/с), новых участников: {result.participants_created}"
+        ))
+        if result.failed:
+            self.stdout.write(self.style.WARNING(f"Строк с ошибками: {result.failed}, см. {errors_path}"))
+        else:
+            os.remove(errors_path)
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from san_app import rollups
+
+
+class Command(BaseCommand):
+    help = "Пересобирает сводную таблицу баллов по полу, фазе и дню (ScoreRollup)"
+
+    def handle(self, *args, **options):
+        groups = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Пересобрано групп: {groups}"))
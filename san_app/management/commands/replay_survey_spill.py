@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from san_app.write_buffer import WriteBuffer
+
+
+class Command(BaseCommand):
+    help = "Записывает в базу ответы, которые буфер записи не смог сохранить (SURVEY_WRITE_BUFFER_SPILL)"
+
+    def handle(self, *args, **options):
+        buffer = WriteBuffer(spill_path=settings.SURVEY_WRITE_BUFFER_SPILL)
+        written = buffer.replay_spill()
+        self.stdout.write(self.style.SUCCESS(f"Записано ответов: {written}"))
+        if buffer.failed_rows:
+            self.stderr.write(f"Снова не записано: {buffer.failed_rows} (оставлены в файле)")
@@ -0,0 +1,78 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from san_app import jobs
+
+
+class Command(BaseCommand):
+    help = "Выполняет фоновые задания построения отчета (ReportJob)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Выполнить задания, стоящие в очереди, и завершиться")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Сколько заданий выполнять одновременно (потоки)")
+        parser.add_argument('--poll', type=float, default=1.0,
+                            help="Интервал опроса очереди, с")
+        parser.add_argument('--chart-workers', type=int, default=settings.REPORT_WORKER_CHART_WORKERS,
+                            help="Размер пула процессов для графиков (по умолчанию REPORT_WORKER_CHART_WORKERS)")
+
+    def handle(self, *args, **options):
+        self.chart_workers = options['chart_workers']
+        self.keep = getattr(settings, 'REPORT_JOBS_KEEP', 20)
+        if options['concurrency'] <= 1:
+            self.serve_inline(options['once'], options['poll'])
+        else:
+            self.serve_pool(options['concurrency'], options['once'], options['poll'])
+
+    def serve_inline(self, once, poll):
+        """Задания по одному в текущем потоке"""
+        while True:
+            job = jobs.claim_next()
+            if job is not None:
+                self.run(job)
+            elif once:
+                break
+            else:
+                time.sleep(poll)
+
+    def serve_pool(self, concurrency, once, poll):
+        """Несколько заданий одновременно в пуле потоков"""
+        active = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                if len(active) >= concurrency:
+                    _, active = wait(active, return_when=FIRST_COMPLETED)
+                    continue
+
+                job = jobs.claim_next()
+                if job is not None:
+                    active.add(pool.submit(self.run_in_thread, job))
+                    continue
+
+                if once:
+                    wait(active)
+                    break
+                time.sleep(poll)
+                active = {future for future in active if not future.done()}
+
+    def run_in_thread(self, job):
+        try:
+            self.run(job)
+        finally:
+            # Каждый поток пула держит свое соединение с базой
+            connection.close()
+
+    def run(self, job):
+        try:
+            job = jobs.run_job(job, workers=self.chart_workers)
+        except Exception as e:
+            self.stderr.write(f"Задание {job.id} завершилось ошибкой: {e}")
+            return
+        total = sum(seconds for stage, seconds in job.timings.items() if not stage.startswith('chart:'))
+        self.stdout.write(f"Задание {job.id} ({job.data_version}) готово за {total:.2f} с: {job.timings}")
+        jobs.prune(self.keep)
@@ -0,0 +1,42 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from san_app import synthetic
+
+
+class Command(BaseCommand):
+    help = "Создает воспроизводимые синтетические данные: N участников по M ответов «до / после»"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=100, help="Число участников")
+        parser.add_argument('--responses', type=int, default=10, help="Ответов на одного участника")
+        parser.add_argument('--seed', type=int, default=0, help="Начальное значение генератора")
+        parser.add_argument('--until', help="Последний день ответов (ГГГГ-ММ-ДД, по умолчанию сегодня)")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Сколько ответов вставлять за одну транзакцию")
+        parser.add_argument('--clear', action='store_true',
+                            help="Сначала удалить ранее созданных синтетических участников")
+
+    def handle(self, *args, **options):
+        if not 1 <= options['responses'] <= 730:
+            raise CommandError("Ответов на участника - от 1 до 730 (одно занятие в день за год)")
+        try:
+            until = date.fromisoformat(options['until']) if options['until'] else None
+        except ValueError:
+            raise CommandError(f"Некорректная дата: {options['until']}")
+
+        if options['clear']:
+            deleted = synthetic.clear()
+            self.stdout.write(f"Удалено синтетических участников: {deleted}")
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {result.responses} ответов, {result.rows_per_second:.0f} строк/с")
+
+        result = synthetic.seed(options['participants'], options['responses'], seed=options['seed'],
+                                until=until, batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано участников: {result.participants}, ответов: {result.responses} за {result.seconds:.2f} с "
+            f"({result.rows_per_second:.0f} строк/с)"
+        ))
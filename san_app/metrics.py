@@ -0,0 +1,322 @@
+"""Метрики запросов в формате Prometheus: время ответа, SQL, шаблоны, размер ответа
+
+MetricsMiddleware собирает для каждого запроса число и время SQL-запросов
+(обертка выполнения запросов на каждом соединении с базой), время отрисовки
+шаблонов (шаблонный движок TimedDjangoTemplates) и размер ответа, и
+добавляет их в гистограммы и счетчики по имени view. Графики отчета
+добавляют время построения каждого графика (observe_chart).
+
+Метрики хранятся в памяти процесса: при нескольких рабочих процессах
+каждый отдает свои. С METRICS_SLOW_REQUEST_MS медленные запросы пишутся в
+лог san_app.metrics вместе с выполненным SQL.
+"""
+import contextvars
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+CHART_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Данные текущего запроса; контекст переходит и в потоки sync_to_async
+_current = contextvars.ContextVar('san_request_stats', default=None)
+
+
+class RequestStats:
+    """Счетчики одного запроса"""
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.sql = [] if capture_sql else None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{_labels(labels, le=_number(bound))} {cumulative}'
+        yield f'{name}_bucket{_labels(labels, le="+Inf")} {self.count}'
+        yield f'{name}_sum{_labels(labels)} {_number(self.sum)}'
+        yield f'{name}_count{_labels(labels)} {self.count}'
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.db_seconds = 0.0
+        self.template_seconds = 0.0
+        self.response_bytes = 0
+
+
+class Registry:
+    """Метрики процесса по имени view и по графикам отчета"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.views = defaultdict(ViewMetrics)
+        self.charts = defaultdict(lambda: Histogram(CHART_BUCKETS))
+
+    def observe_request(self, view, status, seconds, stats, size):
+        with self._lock:
+            metrics = self.views[view]
+            metrics.latency.observe(seconds)
+            metrics.queries.observe(stats.queries)
+            metrics.statuses[status] += 1
+            metrics.db_seconds += stats.db_seconds
+            metrics.template_seconds += stats.template_seconds
+            metrics.response_bytes += size
+
+    def observe_chart(self, name, seconds):
+        with self._lock:
+            self.charts[name].observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.views.clear()
+            self.charts.clear()
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus (версия 0.0.4)"""
+        from . import dashboard
+        from .report_cache import report_cache
+        from .write_buffer import buffer_stats
+
+        with self._lock:
+            views = sorted(self.views.items())
+            charts = sorted(self.charts.items())
+            lines = []
+            add = _family(lines)
+            add('san_http_requests_total', 'counter', 'Число запросов по view и коду ответа',
+                (f'san_http_requests_total{_labels({"view": view, "status": status})} {count}'
+                 for view, metrics in views for status, count in sorted(metrics.statuses.items())))
+            add('san_http_request_duration_seconds', 'histogram', 'Время ответа',
+                (line for view, metrics in views
+                 for line in metrics.latency.lines('san_http_request_duration_seconds', {'view': view})))
+            add('san_http_request_db_queries', 'histogram', 'Число SQL-запросов на запрос',
+                (line for view, metrics in views
+                 for line in metrics.queries.lines('san_http_request_db_queries', {'view': view})))
+            add('san_http_request_db_seconds_total', 'counter', 'Суммарное время SQL-запросов',
+                (f'san_http_request_db_seconds_total{_labels({"view": view})} {_number(metrics.db_seconds)}'
+                 for view, metrics in views))
+            add('san_http_request_template_seconds_total', 'counter', 'Суммарное время отрисовки шаблонов',
+                (f'san_http_request_template_seconds_total{_labels({"view": view})} '
+                 f'{_number(metrics.template_seconds)}' for view, metrics in views))
+            add('san_http_response_bytes_total', 'counter', 'Суммарный размер ответов (без потоковых)',
+                (f'san_http_response_bytes_total{_labels({"view": view})} {metrics.response_bytes}'
+                 for view, metrics in views))
+            add('san_report_chart_render_seconds', 'histogram', 'Время построения графика отчета',
+                (line for name, histogram in charts
+                 for line in histogram.lines('san_report_chart_render_seconds', {'chart': name})))
+
+        add('san_dashboard_cache_requests_total', 'counter', 'Обращения к кэшу панели администратора',
+            [f'san_dashboard_cache_requests_total{{result="hit"}} {dashboard.stats.hits}',
+             f'san_dashboard_cache_requests_total{{result="miss"}} {dashboard.stats.misses}'])
+        add('san_report_cache_requests_total', 'counter', 'Обращения к кэшу отрисованных отчетов',
+            [f'san_report_cache_requests_total{{result="hit"}} {report_cache.hits}',
+             f'san_report_cache_requests_total{{result="miss"}} {report_cache.misses}'])
+
+        buffer = buffer_stats()
+        if buffer is not None:
+            # Растущие failed_rows и spill_rows - ответы, которые не удалось записать в базу
+            for name, kind, help_text, value in [
+                ('queue_depth', 'gauge', 'Ответов в очереди буфера записи', buffer['queue_depth']),
+                ('flushed_rows_total', 'counter', 'Ответов, записанных буфером', buffer['flushed_rows']),
+                ('batches_total', 'counter', 'Пачек, записанных буфером', buffer['batches']),
+                ('failed_rows_total', 'counter', 'Ответов, не записанных после повторов',
+                 buffer['failed_rows']),
+                ('replayed_rows_total', 'counter', 'Ответов, записанных повторно из файла незаписанных',
+                 buffer['replayed_rows']),
+                ('spill_rows', 'gauge', 'Ответов в файле незаписанных', buffer['spilled_rows']),
+                ('flush_seconds_total', 'counter', 'Суммарное время записи пачек',
+                 buffer['total_flush_ms'] / 1000),
+                ('flush_seconds_max', 'gauge', 'Самая долгая запись пачки', buffer['max_flush_ms'] / 1000),
+                ('last_flush_seconds', 'gauge', 'Время записи последней пачки', buffer['last_flush_ms'] / 1000),
+            ]:
+                add(f'san_write_buffer_{name}', kind, help_text, [f'san_write_buffer_{name} {_number(value)}'])
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def observe_chart(name, seconds):
+    registry.observe_chart(name, seconds)
+
+
+@contextmanager
+def request_stats():
+    """Счетчики текущего запроса; если MetricsMiddleware их не собирает - новые на время блока"""
+    stats = _current.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def _family(lines):
+    def add(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+    return add
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(labels, **extra):
+    labels = {**labels, **extra}
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def record_queries(execute, sql, params, many, context):
+    """Обертка выполнения SQL (connection.execute_wrappers): учитывает запрос в данных текущего запроса"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_seconds += elapsed
+        if stats.sql is not None and len(stats.sql) < settings.METRICS_SLOW_REQUEST_MAX_QUERIES:
+            stats.sql.append((elapsed, sql))
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Сигнал connection_created: обертка ставится на каждое соединение, в том числе в потоках"""
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+connection_created.connect(install_query_wrapper)
+
+
+class TimedTemplate:
+    """Шаблон, время отрисовки которого учитывается в данных текущего запроса"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None:
+            return self.template.render(context, request)
+        started = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            stats.template_seconds += time.perf_counter() - started
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблонный движок Django с учетом времени отрисовки (см. TEMPLATES в settings.py)"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
+
+
+class MetricsMiddleware:
+    """Собирает метрики каждого запроса; работает и под WSGI, и под ASGI"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        stats, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self._finish(request, response, stats, started)
+        return response
+
+    @staticmethod
+    def _start():
+        stats = RequestStats(capture_sql=settings.METRICS_SLOW_REQUEST_MS is not None)
+        return stats, _current.set(stats), time.perf_counter()
+
+    @staticmethod
+    def _finish(request, response, stats, started):
+        seconds = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else 'unresolved'
+        size = 0 if response.streaming else len(response.content)
+        registry.observe_request(view, response.status_code, seconds, stats, size)
+
+        slow_ms = settings.METRICS_SLOW_REQUEST_MS
+        if slow_ms is not None and seconds * 1000 >= slow_ms:
+            sql = '\n'.join(f'  {elapsed * 1000:.1f} мс: {query}' for elapsed, query in stats.sql)
+            logger.warning(
+                "Медленный запрос %s %s (%s): %.0f мс, SQL: %d запросов за %.0f мс, шаблоны: %.0f мс\n%s",
+                request.method, request.get_full_path(), view, seconds * 1000, stats.queries,
+                stats.db_seconds * 1000, stats.template_seconds * 1000, sql,
+            )
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+from san_app.scoring import SCALES, compute_scores
+
+BATCH_SIZE = 2000
+
+
+def backfill_scores(apps, schema_editor):
+    """Заполняет новые столбцы баллов для уже сохраненных ответов (порциями по id)
+
+    Без этого после migrate у старых ответов баллы пустые, и отчет, сводная
+    таблица (0005) и панель показывают нули до ручного backfill_scores.
+    Считаются только незаполненные строки, поэтому функцию можно вызвать
+    повторно (это делает 0005 для баз, где 0003 применена раньше).
+    """
+    Response = apps.get_model('san_app', 'Response')
+    q_fields = [f'q{num}' for num in range(1, 31)]
+    score_fields = [f'{scale}_score' for scale in SCALES]
+    missing = Response.objects.filter(overall_score__isnull=True).order_by('id')
+    last_id = 0
+    while True:
+        batch = list(missing.filter(id__gt=last_id).only('id', *q_fields)[:BATCH_SIZE])
+        if not batch:
+            break
+        for response in batch:
+            scores = compute_scores([getattr(response, field) for field in q_fields])
+            for field, score in zip(score_fields, scores):
+                setattr(response, field, score)
+        Response.objects.bulk_update(batch, score_fields)
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0002_participant_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='activity_score',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Активность'),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='mood_score',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Настроение'),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='overall_score',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Общий балл'),
+        ),
+        migrations.AddField(
+            model_name='response',
+            name='wellbeing_score',
+            field=models.FloatField(blank=True, editable=False, null=True, verbose_name='Самочувствие'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:34
+
+from importlib import import_module
+
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+SCALES = ['wellbeing', 'activity', 'mood', 'overall']
+
+
+def build_rollups(apps, schema_editor):
+    # Баллы, которые остались пустыми (0003 применена до того, как в нее добавили заполнение),
+    # заполняются перед сборкой: иначе сводная таблица считала бы их нулями
+    import_module('san_app.migrations.0003_response_scores').backfill_scores(apps, schema_editor)
+    Response = apps.get_model('san_app', 'Response')
+    ScoreRollup = apps.get_model('san_app', 'ScoreRollup')
+    annotations = {'count': Count('id')}
+    for scale in SCALES:
+        annotations[f'{scale}_sum'] = Sum(f'{scale}_score')
+        annotations[f'{scale}_sumsq'] = Sum(F(f'{scale}_score') * F(f'{scale}_score'))
+    rows = (Response.objects.annotate(day=TruncDate('timestamp'))
+            .values('participant__gender', 'phase', 'day')
+            .annotate(**annotations)
+            .order_by())
+    ScoreRollup.objects.bulk_create([
+        ScoreRollup(gender=row.pop('participant__gender'), **{key: value or 0 for key, value in row.items()})
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0004_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gender', models.CharField(max_length=1, verbose_name='Пол')),
+                ('phase', models.CharField(max_length=10, verbose_name='Фаза')),
+                ('day', models.DateField(verbose_name='День')),
+                ('count', models.IntegerField(default=0, verbose_name='Число ответов')),
+                ('wellbeing_sum', models.FloatField(default=0)),
+                ('wellbeing_sumsq', models.FloatField(default=0)),
+                ('activity_sum', models.FloatField(default=0)),
+                ('activity_sumsq', models.FloatField(default=0)),
+                ('mood_sum', models.FloatField(default=0)),
+                ('mood_sumsq', models.FloatField(default=0)),
+                ('overall_sum', models.FloatField(default=0)),
+                ('overall_sumsq', models.FloatField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('gender', 'phase', 'day'), name='unique_score_rollup')],
+            },
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0005_score_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.CharField(db_index=True, max_length=64, verbose_name='Версия данных')),
+                ('image_format', models.CharField(default='png', max_length=3, verbose_name='Формат графиков')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка'), ('cancelled', 'Отменено')], db_index=True, default='queued', max_length=10, verbose_name='Статус')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='Прогресс, %')),
+                ('stage', models.CharField(blank=True, max_length=50, verbose_name='Текущая стадия')),
+                ('timings', models.JSONField(blank=True, default=dict, verbose_name='Длительность стадий, с')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начато')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReportArtifact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='График')),
+                ('content_type', models.CharField(max_length=50, verbose_name='Тип содержимого')),
+                ('data', models.BinaryField(verbose_name='Данные')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='artifacts', to='san_app.reportjob')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'name'), name='unique_report_artifact')],
+            },
+        ),
+    ]
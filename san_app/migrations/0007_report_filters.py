@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0006_report_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='filters',
+            field=models.CharField(blank=True, default='', max_length=500, verbose_name='Фильтры (query string)'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['timestamp'], name='response_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['phase', 'timestamp'], name='response_phase_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['participant', 'timestamp'], name='response_participant_ts_idx'),
+        ),
+    ]
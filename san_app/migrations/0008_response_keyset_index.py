@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0007_report_filters'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='response',
+            name='response_timestamp_idx',
+        ),
+        migrations.AddIndex(
+            model_name='response',
+            index=models.Index(fields=['timestamp', 'id'], name='response_ts_id_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0008_response_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='response',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('san_app', '0009_response_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='response',
+            name='client_key',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Ключ клиента'),
+        ),
+    ]
@@ -1,13 +1,23 @@
 # models.py (полный код с изменениями)
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
+from django.db.models.functions import Cast
 from datetime import date  # Добавьте импорт
 
+from . import scoring
+
 class Participant(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="participants", null=True, blank=True)
     name = models.CharField(max_length=100, verbose_name="Фамилия, инициалы")
     gender = models.CharField(max_length=1, choices=[('M', 'Мужской'), ('F', 'Женский')], verbose_name="Пол")
     birth_date = models.DateField(verbose_name="Дата рождения")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменен")
+
+    def save(self, *args, **kwargs):
+        # Смена пола переносит ответы в сводной таблице (post_save) в той же транзакции
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.gender})"
@@ -19,10 +29,39 @@ class Participant(models.Model):
 
 # Остальной код модели Response без изменений...
 
+class ResponseQuerySet(models.QuerySet):
+    def with_scores(self):
+        """Добавляет баллы шкал wellbeing/activity/mood/overall, вычисленные в SQL
+
+        После этого по ним можно фильтровать, сортировать и агрегировать:
+        Response.objects.with_scores().filter(wellbeing__lt=4).aggregate(Avg('mood'))
+        """
+        return self.annotate(**score_expressions())
+
+
+def score_expressions():
+    """SQL-выражения баллов шкал по полям q1..q30 и таблице полярностей"""
+    expressions = {}
+    for scale, items in zip(scoring.SCALES, scoring.SCALE_ITEMS):
+        # Сумма баллов пунктов: 4 + q для прямых и 4 - q для обратных
+        total = models.Value(4 * len(items))
+        for num in items:
+            if scoring.POLARITIES[num - 1]:
+                total = total + models.F(f'q{num}')
+            else:
+                total = total - models.F(f'q{num}')
+        expressions[scale] = Cast(total, models.FloatField()) / models.Value(float(len(items)))
+    return expressions
+
+
 class Response(models.Model):
     participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name="responses")
-    timestamp = models.DateTimeField(auto_now_add=True, verbose_name="Дата и время")
+    # Не auto_now_add: при импорте бумажных бланков (bulk_create) время задается явно
+    timestamp = models.DateTimeField(default=timezone.now, verbose_name="Дата и время")
     phase = models.CharField(max_length=10, choices=[('before', 'До занятия'), ('after', 'После занятия')], verbose_name="Фаза")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Изменен")
+    # Ключ идемпотентности, сгенерированный браузером: повторная отправка того же бланка не создает дубль
+    client_key = models.UUIDField(null=True, blank=True, unique=True, editable=False, verbose_name="Ключ клиента")
 
     # Поля для 30 вопросов (-3 до +3)
     q1 = models.IntegerField(default=0, verbose_name="1. Самочувствие хорошее / плохое")
@@ -56,45 +95,132 @@ class Response(models.Model):
     q29 = models.IntegerField(default=0, verbose_name="29. Полный надежд / разочарованный")
     q30 = models.IntegerField(default=0, verbose_name="30. Довольный / недовольный")
 
-    # Константы для расчёта (True - левый полюс положительный)
+    # Таблицы ключей методики (см. scoring.py)
+    POLARITIES = scoring.POLARITIES
+    WELLBEING_ITEMS = scoring.WELLBEING_ITEMS
+    ACTIVITY_ITEMS = scoring.ACTIVITY_ITEMS
+    MOOD_ITEMS = scoring.MOOD_ITEMS
 
-    POLARITIES = [
-        True, True, False, False, True, True, True, True, False, False,
-        True, True, False, True, False, False, True, True, True, True,
-        False, False, True, True, True, True, False, False, True, True
-    ]
+    # Баллы по шкалам САН, хранятся в таблице и пересчитываются при сохранении
+    wellbeing_score = models.FloatField(null=True, blank=True, editable=False, verbose_name="Самочувствие")
+    activity_score = models.FloatField(null=True, blank=True, editable=False, verbose_name="Активность")
+    mood_score = models.FloatField(null=True, blank=True, editable=False, verbose_name="Настроение")
+    overall_score = models.FloatField(null=True, blank=True, editable=False, verbose_name="Общий балл")
 
-    WELLBEING_ITEMS = [1, 2, 7, 8, 13, 14, 19, 20, 25, 26]
-    ACTIVITY_ITEMS = [3, 4, 9, 10, 15, 16, 21, 22, 27, 28]
-    MOOD_ITEMS = [5, 6, 11, 12, 17, 18, 23, 24, 29, 30]
+    SCORE_FIELDS = ['wellbeing_score', 'activity_score', 'mood_score', 'overall_score']
+
+    objects = ResponseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['timestamp', 'id'], name='response_ts_id_idx'),
+            models.Index(fields=['phase', 'timestamp'], name='response_phase_ts_idx'),
+            models.Index(fields=['participant', 'timestamp'], name='response_participant_ts_idx'),
+        ]
 
     def get_score(self, q_num):
-        value = getattr(self, f'q{q_num}')
-        is_left_pos = self.POLARITIES[q_num - 1]
-        if is_left_pos:
-            return 4 + value  # +3 -> 7, -3 -> 1
-        else:
-            return 4 - value  # +3 -> 1, -3 -> 7
+        return scoring.item_score(q_num, getattr(self, f'q{q_num}'))
 
-    @property
-    def wellbeing_score(self):
-        scores = [self.get_score(i) for i in self.WELLBEING_ITEMS]
-        return sum(scores) / 10
+    def compute_scores(self):
+        """Пересчитывает баллы шкал по текущим ответам q1..q30"""
+        answers = [getattr(self, field) for field in scoring.Q_FIELDS]
+        (self.wellbeing_score, self.activity_score,
+         self.mood_score, self.overall_score) = scoring.compute_scores(answers)
 
-    @property
-    def activity_score(self):
-        scores = [self.get_score(i) for i in self.ACTIVITY_ITEMS]
-        return sum(scores) / 10
+    def save(self, *args, **kwargs):
+        self.compute_scores()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            # Если меняются ответы, вместе с ними сохраняем и баллы
+            update_fields = set(update_fields)
+            if update_fields.intersection(scoring.Q_FIELDS):
+                update_fields.update(self.SCORE_FIELDS)
+            kwargs['update_fields'] = update_fields
+        # Сводная таблица обновляется в post_save/post_delete (signals.py) - в той же
+        # транзакции, что и сама строка: если запись сводной таблицы упадет, откатится и ответ
+        with transaction.atomic():
+            super().save(*args, **kwargs)
 
-    @property
-    def mood_score(self):
-        scores = [self.get_score(i) for i in self.MOOD_ITEMS]
-        return sum(scores) / 10
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
-    @property
-    def overall_score(self):
-        scores = [self.get_score(i) for i in range(1, 31)]
-        return sum(scores) / 30
+    def __str__(self):
+        return f"{self.participant} - {self.phase} - {self.timestamp}"
+
+class ScoreRollup(models.Model):
+    """Накопленные суммы баллов САН по полу, фазе и дню
+
+    Хранит число ответов, сумму и сумму квадратов каждой шкалы, чтобы средние
+    и дисперсии по группам читались из нескольких строк, а не из всей таблицы
+    ответов. Поддерживается сигналами (см. rollups.py), восстанавливается
+    командой rebuild_rollups.
+    """
+    gender = models.CharField(max_length=1, verbose_name="Пол")
+    phase = models.CharField(max_length=10, verbose_name="Фаза")
+    day = models.DateField(verbose_name="День")
+    count = models.IntegerField(default=0, verbose_name="Число ответов")
+
+    wellbeing_sum = models.FloatField(default=0)
+    wellbeing_sumsq = models.FloatField(default=0)
+    activity_sum = models.FloatField(default=0)
+    activity_sumsq = models.FloatField(default=0)
+    mood_sum = models.FloatField(default=0)
+    mood_sumsq = models.FloatField(default=0)
+    overall_sum = models.FloatField(default=0)
+    overall_sumsq = models.FloatField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['gender', 'phase', 'day'], name='unique_score_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.gender} - {self.phase} - {self.day}: {self.count}"
+
+
+class ReportJob(models.Model):
+    """Фоновое построение графиков отчета для одной версии данных
+
+    Задания ставит в очередь страница отчета, выполняет команда report_worker.
+    В timings записывается длительность каждой стадии (загрузка, баллы, графики) в секундах.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+        ('cancelled', 'Отменено'),
+    ]
+
+    data_version = models.CharField(max_length=64, db_index=True, verbose_name="Версия данных")
+    filters = models.CharField(max_length=500, blank=True, default='', verbose_name="Фильтры (query string)")
+    image_format = models.CharField(max_length=3, default='png', verbose_name="Формат графиков")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued', db_index=True,
+                              verbose_name="Статус")
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="Прогресс, %")
+    stage = models.CharField(max_length=50, blank=True, verbose_name="Текущая стадия")
+    timings = models.JSONField(default=dict, blank=True, verbose_name="Длительность стадий, с")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начато")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    def __str__(self):
+        return f"Отчет {self.data_version} ({self.get_status_display()})"
+
+
+class ReportArtifact(models.Model):
+    """Готовый график (или HTML таблицы парных изменений), построенный заданием ReportJob"""
+    job = models.ForeignKey(ReportJob, on_delete=models.CASCADE, related_name="artifacts")
+    name = models.CharField(max_length=50, verbose_name="График")
+    content_type = models.CharField(max_length=50, verbose_name="Тип содержимого")
+    data = models.BinaryField(verbose_name="Данные")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'name'], name='unique_report_artifact'),
+        ]
 
     def __str__(self):
-        return f"{self.participant} - {self.phase} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.job_id}: {self.name}"
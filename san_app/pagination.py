@@ -0,0 +1,68 @@
+"""Постраничный вывод по ключу (keyset): следующая страница начинается после последней строки предыдущей
+
+В отличие от OFFSET база не перебирает пропущенные строки: условие
+(timestamp, id) < (курсор) идет по индексу, поэтому любая страница стоит
+столько же, сколько первая.
+"""
+import base64
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Q
+
+
+@dataclass
+class KeysetPage:
+    """Строки страницы и курсор следующей страницы (None - это последняя страница)"""
+    items: list
+    next_cursor: str = None
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(timestamp, pk):
+    """Курсор для позиции (timestamp, id) в виде строки для URL"""
+    raw = f'{timestamp.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Позиция (timestamp, id) из курсора или None, если курсор некорректен"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor=None, size=50):
+    """Страница queryset по убыванию (timestamp, id), начиная после позиции cursor
+
+    Запрашивается на одну строку больше размера страницы, чтобы без COUNT
+    узнать, есть ли следующая страница.
+    """
+    return _make_page(list(_page_queryset(queryset, cursor, size)), size)
+
+
+async def akeyset_page(queryset, cursor=None, size=50):
+    """Асинхронная версия keyset_page() (строки читаются через aiterator)"""
+    rows = [row async for row in _page_queryset(queryset, cursor, size).aiterator()]
+    return _make_page(rows, size)
+
+
+def _page_queryset(queryset, cursor, size):
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        timestamp, pk = position
+        queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+    return queryset.order_by('-timestamp', '-id')[:size + 1]
+
+
+def _make_page(rows, size):
+    if len(rows) <= size:
+        return KeysetPage(rows)
+    last = rows[size - 1]
+    return KeysetPage(rows[:size], encode_cursor(last.timestamp, last.id))
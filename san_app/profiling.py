@@ -0,0 +1,175 @@
+"""Профилирование отдельных запросов сотрудников по требованию (cProfile)
+
+Запрос сотрудника с параметром ?profile=1 или заголовком X-Profile: 1
+выполняется под cProfile. Профиль (файл .prof для pstats и snakeviz) и
+сведения о запросе - view, время, число и время SQL-запросов - сохраняются в
+PROFILES_DIR; хранятся последние PROFILES_KEEP профилей. Список профилей -
+на странице /profiles/, идентификатор профиля - в заголовке X-Profile-Id.
+
+В процессе одновременно профилируется один запрос: пока он выполняется,
+остальные запросы с ?profile=1 обслуживаются без профилирования. Под ASGI
+профилируется только поток цикла событий (работа в sync_to_async и в пуле
+отчетов в профиль не попадает), поэтому отчеты удобнее профилировать под WSGI.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics
+
+SORT_KEYS = {'cumulative': 'Суммарное время', 'tottime': 'Собственное время', 'ncalls': 'Число вызовов'}
+
+_lock = threading.Lock()
+
+
+def requested(request):
+    """Просит ли запрос профилирование (проверка прав - отдельно)"""
+    return request.GET.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+
+
+class ProfilerMiddleware:
+    """Выполняет запрос сотрудника под cProfile и сохраняет профиль (ставить после AuthenticationMiddleware)"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self._acquire(request, request.user):
+            return self.get_response(request)
+        try:
+            with metrics.request_stats() as stats:
+                run = ProfileRun(stats, request.user)
+                try:
+                    response = self.get_response(request)
+                finally:
+                    run.stop()
+                return run.save(request, response)
+        finally:
+            _lock.release()
+
+    async def __acall__(self, request):
+        # Пользователя загружаем, только если профилирование запрошено
+        wanted = settings.PROFILING_ENABLED and requested(request)
+        user = await request.auser() if wanted else None
+        if not wanted or not self._acquire(request, user):
+            return await self.get_response(request)
+        try:
+            with metrics.request_stats() as stats:
+                run = ProfileRun(stats, user)
+                try:
+                    response = await self.get_response(request)
+                finally:
+                    run.stop()
+                return run.save(request, response)
+        finally:
+            _lock.release()
+
+    @staticmethod
+    def _acquire(request, user):
+        """True, если запрос нужно профилировать; тогда блокировка профилировщика захвачена"""
+        return (settings.PROFILING_ENABLED and requested(request) and user.is_staff
+                and _lock.acquire(blocking=False))
+
+
+class ProfileRun:
+    """Один профилируемый запрос: cProfile и счетчики SQL на момент начала"""
+
+    def __init__(self, stats, user):
+        self.stats = stats
+        self.user = user
+        self.queries = stats.queries
+        self.db_seconds = stats.db_seconds
+        self.profiler = cProfile.Profile()
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.seconds = time.perf_counter() - self.started
+
+    def save(self, request, response):
+        match = getattr(request, 'resolver_match', None)
+        profile_id = save_profile(self.profiler, {
+            'view': (match.view_name or match._func_path) if match else 'unresolved',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'user': self.user.username,
+            'seconds': round(self.seconds, 4),
+            'queries': self.stats.queries - self.queries,
+            'db_seconds': round(self.stats.db_seconds - self.db_seconds, 4),
+            'created': timezone.now().isoformat(),
+        })
+        response['X-Profile-Id'] = profile_id
+        response['X-Profile-Url'] = reverse('profile_detail', args=[profile_id])
+        return response
+
+
+def save_profile(profiler, meta):
+    """Сохраняет профиль и его сведения, удаляет самые старые сверх PROFILES_KEEP; возвращает id"""
+    os.makedirs(settings.PROFILES_DIR, exist_ok=True)
+    profile_id = uuid.uuid4().hex
+    profiler.dump_stats(os.path.join(settings.PROFILES_DIR, f'{profile_id}.prof'))
+    with open(os.path.join(settings.PROFILES_DIR, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'id': profile_id, **meta}, f, ensure_ascii=False)
+    for old in list_profiles()[settings.PROFILES_KEEP:]:
+        for suffix in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(settings.PROFILES_DIR, f"{old['id']}.{suffix}"))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def list_profiles():
+    """Сведения о сохраненных профилях, от новых к старым"""
+    try:
+        names = [name for name in os.listdir(settings.PROFILES_DIR) if name.endswith('.json')]
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        try:
+            with open(os.path.join(settings.PROFILES_DIR, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return sorted(profiles, key=lambda meta: meta['created'], reverse=True)
+
+
+def load_profile(profile_id):
+    """Сведения о профиле или None, если его нет (или он уже удален)"""
+    try:
+        with open(os.path.join(settings.PROFILES_DIR, f'{profile_id}.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def profile_path(profile_id):
+    return os.path.join(settings.PROFILES_DIR, f'{profile_id}.prof')
+
+
+def profile_text(profile_id, sort='cumulative', limit=60):
+    """Таблица pstats: limit самых затратных функций в порядке sort"""
+    stream = io.StringIO()
+    pstats.Stats(profile_path(profile_id), stream=stream).sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
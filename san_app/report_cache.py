@@ -0,0 +1,101 @@
+"""Кэш отрисованного отчета, привязанный к версии данных"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import Participant, Response
+
+
+def data_state():
+    """Версия данных отчета и время последнего изменения ответов и участников
+
+    Версия меняется при добавлении, изменении или удалении ответов и участников.
+    Массовые изменения в обход save() (bulk_update, update) должны сами
+    обновлять updated_at, как это делает backfill_scores.
+    """
+    responses = Response.objects.aggregate(last_id=Max('id'), count=Count('id'), changed=Max('updated_at'))
+    participants = Participant.objects.aggregate(changed=Max('updated_at'))
+    raw = (f"{responses['last_id']}:{responses['count']}:{responses['changed']}:"
+           f"{participants['changed']}")
+    changes = [changed for changed in (responses['changed'], participants['changed']) if changed]
+    return hashlib.sha1(raw.encode()).hexdigest()[:16], max(changes, default=None)
+
+
+def data_version():
+    """Версия данных отчета (см. data_state)"""
+    return data_state()[0]
+
+
+class ReportCache:
+    """LRU-кэш с ограничением по суммарному размеру записей в байтах
+
+    get_or_build() гарантирует, что одновременные запросы одной и той же версии
+    в процессе строят отчет один раз: остальные ждут и получают готовый результат.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # ключ -> (значение, размер)
+        self._size = 0
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_or_build(self, key, build, sizeof):
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            # Пока ждали блокировку, отчет мог построить другой поток
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is not None:
+                return entry[0]
+            value = build()
+            self.set(key, value, sizeof(value))
+        with self._lock:
+            self._build_locks.pop(key, None)
+        return value
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+
+report_cache = ReportCache(getattr(settings, 'REPORT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
@@ -0,0 +1,262 @@
+"""Данные для отчета и параллельное построение графиков
+
+Загрузка: один JOIN-запрос, чтение порциями, сборка DataFrame по столбцам.
+Графики строятся в пуле процессов; DataFrame передается рабочим процессам
+через блок разделяемой памяти, а не копируется в каждую задачу.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from itertools import islice
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+from . import metrics
+from .charts import CHARTS, render_chart
+from .pairing import load_pairs, paired_summary
+
+logger = logging.getLogger(__name__)
+
+# Столбец DataFrame -> поле в запросе (участник подтягивается тем же запросом через JOIN)
+REPORT_COLUMNS = {
+    'participant': 'participant__name',
+    'gender': 'participant__gender',
+    'birth_date': 'participant__birth_date',
+    'phase': 'phase',
+    'wellbeing': 'wellbeing_score',
+    'activity': 'activity_score',
+    'mood': 'mood_score',
+    'overall': 'overall_score',
+    'timestamp': 'timestamp',
+}
+
+SCORE_COLUMNS = ['wellbeing', 'activity', 'mood', 'overall']
+
+# Типы массивов для столбцов; остальные хранятся как object
+COLUMN_DTYPES = {
+    'birth_date': 'datetime64[D]',
+    'wellbeing': np.float64,
+    'activity': np.float64,
+    'mood': np.float64,
+    'overall': np.float64,
+}
+
+
+def load_report_frame(queryset, chunk_size=10000):
+    """DataFrame с ответами, данными участника и возрастом для построения отчета"""
+    names = list(REPORT_COLUMNS)
+    parts = {name: [] for name in names}
+
+    rows = queryset.values_list(*REPORT_COLUMNS.values()).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        # Транспонируем порцию строк в столбцы и сразу переводим их в массивы
+        for name, values in zip(names, zip(*chunk)):
+            parts[name].append(np.array(values, dtype=COLUMN_DTYPES.get(name, object)))
+
+    columns = {
+        name: np.concatenate(arrays) if arrays else np.array([], dtype=COLUMN_DTYPES.get(name, object))
+        for name, arrays in parts.items()
+    }
+
+    # Незаполненные баллы (до backfill_scores) считаем нулевыми, как и раньше
+    for name in SCORE_COLUMNS:
+        columns[name] = np.nan_to_num(columns[name], nan=0.0)
+
+    # Возраст в годах считается одной векторной операцией
+    today = np.datetime64(datetime.now().date(), 'D')
+    columns['age'] = (today - columns['birth_date']).astype(np.float64) / 365.25
+    columns['age'] = np.nan_to_num(columns['age'], nan=0.0)
+
+    df = pd.DataFrame(columns)
+    df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
+    return df
+
+
+def means_frame(stats):
+    """DataFrame средних по (пол, фаза) из результатов rollups.group_stats()"""
+    frame = pd.DataFrame(stats, columns=['gender', 'phase', 'count'] + SCORE_COLUMNS)
+    return frame.set_index(['gender', 'phase'])[['wellbeing', 'activity', 'mood']]
+
+
+# Подписи столбцов таблицы парных изменений
+PAIR_LABELS = {
+    'pairs': 'Пар',
+    'mean_delta': 'Среднее изменение',
+    'ci_low': '95% ДИ, от',
+    'ci_high': '95% ДИ, до',
+    't': 't',
+    't_p': 'p (t-тест)',
+    'wilcoxon_p': 'p (Уилкоксон)',
+}
+
+
+def pairs_frame(summary):
+    """DataFrame парных изменений по шкалам из pairing.paired_summary()"""
+    frame = pd.DataFrame(summary).set_index('scale')
+    return frame[list(PAIR_LABELS)].rename(columns=PAIR_LABELS)
+
+
+def pairs_table_html(responses, window, resamples):
+    """Таблица изменений «после - до» по парам ответов с парными тестами в HTML"""
+    try:
+        pairs = load_pairs(responses, window)
+        if not len(pairs):
+            return '<p>Нет пар ответов «до» и «после» занятия.</p>'
+        return pairs_frame(paired_summary(pairs, resamples=resamples)).to_html(float_format='%.3f')
+    except Exception as e:
+        return f'<p>Ошибка при расчете парных изменений: {e}</p>'
+
+
+# Столбцы, которые нужны графикам и передаются в рабочие процессы
+SHARED_NUMERIC = ['wellbeing', 'activity', 'mood', 'overall', 'age']
+SHARED_CATEGORICAL = ['gender', 'phase']
+
+
+def share_frame(df):
+    """Копирует столбцы для графиков в блок разделяемой памяти
+
+    Категориальные столбцы хранятся кодами, их значения - в описании блока.
+    Возвращает (блок, описание); блок закрывает и удаляет вызывающий код.
+    """
+    categories = {}
+    columns = [df[name].to_numpy(dtype=np.float64) for name in SHARED_NUMERIC]
+    for name in SHARED_CATEGORICAL:
+        codes, uniques = pd.factorize(df[name])
+        categories[name] = list(uniques)
+        columns.append(codes.astype(np.float64))
+
+    shape = (len(columns), len(df))
+    shm = SharedMemory(create=True, size=max(np.prod(shape) * 8, 1))
+    block = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    for row, values in enumerate(columns):
+        block[row] = values
+    return shm, {'name': shm.name, 'shape': shape, 'categories': categories}
+
+
+def attach_frame(spec):
+    """Восстанавливает DataFrame для графиков из блока разделяемой памяти"""
+    # Рабочие процессы используют resource_tracker родителя, а удаляет блок
+    # только родитель (см. render_charts)
+    shm = SharedMemory(name=spec['name'])
+    try:
+        block = np.ndarray(spec['shape'], dtype=np.float64, buffer=shm.buf)
+        data = {name: block[row].copy() for row, name in enumerate(SHARED_NUMERIC)}
+        for offset, name in enumerate(SHARED_CATEGORICAL, start=len(SHARED_NUMERIC)):
+            uniques = np.array(spec['categories'][name], dtype=object)
+            data[name] = uniques[block[offset].astype(np.intp)] if len(uniques) else np.array([], dtype=object)
+        del block
+    finally:
+        shm.close()
+    return pd.DataFrame(data)
+
+
+def _timed_render(name, df, image_format, means):
+    start = time.perf_counter()
+    image = render_chart(name, df, image_format, means)
+    return image, time.perf_counter() - start
+
+
+def _render_shared_chart(spec, name, image_format, means):
+    """Задача рабочего процесса: построить один график по общему блоку данных
+
+    Возвращает (изображение, секунды построения).
+    """
+    return _timed_render(name, attach_frame(spec), image_format, means)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def chart_executor(workers):
+    """Общий для процесса пул рабочих процессов для графиков (создается при первом вызове)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: рабочие процессы не наследуют соединения с БД и потоки Django
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'))
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def render_charts(df, workers=None, image_format='png', means=None, on_chart=None):
+    """Строит все графики отчета, возвращает словарь имя -> байты изображения (или None)
+
+    workers - размер пула процессов; по умолчанию по числу ядер машины.
+    При workers <= 1 графики строятся последовательно в текущем процессе.
+    means - готовые средние по (пол, фаза), см. means_frame().
+    on_chart(name, image, seconds) вызывается по готовности каждого графика.
+    Время построения каждого графика попадает в метрики и в лог (DEBUG).
+    """
+    on_chart = _observed(on_chart)
+    if workers is None:
+        workers = min(len(CHARTS), os.cpu_count() or 1)
+    if workers <= 1:
+        return _render_serial(df, image_format, means, on_chart)
+
+    shm, spec = share_frame(df)
+    try:
+        executor = chart_executor(workers)
+        futures = {
+            executor.submit(_render_shared_chart, spec, name, image_format, means): name
+            for name in CHARTS
+        }
+        images = {}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                images[name], seconds = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception:
+                logger.exception("Ошибка при создании графика %s", name)
+                images[name], seconds = None, 0.0
+            on_chart(name, images[name], seconds)
+        return {name: images[name] for name in CHARTS}
+    except BrokenProcessPool:
+        # Пул мог упасть (например, рабочий процесс убит) - пересоздадим его в следующий раз
+        _reset_executor()
+        return _render_serial(df, image_format, means, on_chart)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _render_serial(df, image_format, means, on_chart):
+    images = {}
+    for name in CHARTS:
+        try:
+            images[name], seconds = _timed_render(name, df, image_format, means)
+        except Exception:
+            logger.exception("Ошибка при создании графика %s", name)
+            images[name], seconds = None, 0.0
+        on_chart(name, images[name], seconds)
+    return images
+
+
+def _observed(on_chart):
+    """Обертка on_chart: время построения графика - в метрики и в лог"""
+    def observe(name, image, seconds):
+        if image is not None:
+            metrics.observe_chart(name, seconds)
+            logger.debug("График %s построен за %.3f с", name, seconds)
+        if on_chart is not None:
+            on_chart(name, image, seconds)
+    return observe
@@ -0,0 +1,216 @@
+"""Инкрементальное обновление сводной таблицы ScoreRollup (пол x фаза x день)
+
+Каждый ответ добавляет в строку своей группы единицу к count, свои баллы к
+суммам и квадраты баллов к суммам квадратов. Средние и дисперсии по группам
+вычисляются из этих сумм без чтения таблицы ответов.
+"""
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, F, IntegerField, Max, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Participant, Response, ScoreRollup
+from .scoring import SCALES
+
+# Поле суммы, поле суммы квадратов и поле балла в Response для каждой шкалы
+SCALE_COLUMNS = [(f'{scale}_sum', f'{scale}_sumsq', f'{scale}_score') for scale in SCALES]
+VALUE_FIELDS = ['count'] + [column for sum_field, sumsq_field, _ in SCALE_COLUMNS
+                            for column in (sum_field, sumsq_field)]
+
+# С какого числа групп apply() пишет суммы пакетно, а не запросом UPDATE на группу
+BULK_APPLY_MIN_GROUPS = 20
+
+
+def rollup_day(timestamp):
+    """День группы для времени ответа (в текущем часовом поясе, как TruncDate)"""
+    if timezone.is_aware(timestamp):
+        timestamp = timezone.localtime(timestamp)
+    return timestamp.date()
+
+
+def response_values(response):
+    """Вклад одного ответа: [count, сумма, сумма квадратов, ...] в порядке VALUE_FIELDS"""
+    values = [1]
+    for _, _, score_field in SCALE_COLUMNS:
+        score = getattr(response, score_field) or 0.0
+        values += [score, score * score]
+    return values
+
+
+def collect(responses, gender=None):
+    """Суммирует вклад ответов по ключам (пол, фаза, день)
+
+    Пол берется из response.participant, если не передан явно.
+    """
+    deltas = defaultdict(lambda: [0] * len(VALUE_FIELDS))
+    for response in responses:
+        key = (gender or response.participant.gender, response.phase, rollup_day(response.timestamp))
+        for i, value in enumerate(response_values(response)):
+            deltas[key][i] += value
+    return deltas
+
+
+def apply(deltas, sign=1):
+    """Прибавляет (sign=1) или вычитает (sign=-1) суммы к строкам ScoreRollup"""
+    if len(deltas) >= BULK_APPLY_MIN_GROUPS:
+        return _apply_bulk(deltas, sign)
+    with transaction.atomic():
+        for (gender, phase, day), values in deltas.items():
+            rollup, _ = ScoreRollup.objects.get_or_create(gender=gender, phase=phase, day=day)
+            ScoreRollup.objects.filter(pk=rollup.pk).update(**{
+                field: F(field) + sign * value for field, value in zip(VALUE_FIELDS, values)
+            })
+
+
+def _apply_bulk(deltas, sign):
+    """apply() для множества групп (массовая запись за много дней)
+
+    Недостающие строки создаются одним INSERT, а прибавление сумм выполняется
+    одним подготовленным UPDATE через executemany - вместо get_or_create и
+    UPDATE на каждую группу. bulk_update здесь не подходит: он прочитал бы
+    строки заранее и записал готовые значения, а не прибавил бы к текущим.
+    """
+    table = connection.ops.quote_name(ScoreRollup._meta.db_table)
+    assignments = ', '.join(f'{name} = {name} + %s' for name in map(connection.ops.quote_name, VALUE_FIELDS))
+    key = ' AND '.join(f'{connection.ops.quote_name(name)} = %s' for name in ('gender', 'phase', 'day'))
+    with transaction.atomic():
+        ScoreRollup.objects.bulk_create(
+            [ScoreRollup(gender=gender, phase=phase, day=day) for gender, phase, day in deltas],
+            ignore_conflicts=True)
+        with connection.cursor() as cursor:
+            cursor.executemany(f'UPDATE {table} SET {assignments} WHERE {key}', [
+                [sign * value for value in values] + [gender, phase, connection.ops.adapt_datefield_value(day)]
+                for (gender, phase, day), values in deltas.items()
+            ])
+
+
+def add_responses(responses, gender=None):
+    """Учитывает новые ответы (для путей записи без сигналов, например bulk_create)"""
+    apply(collect(responses, gender))
+
+
+def remove_responses(responses, gender=None):
+    apply(collect(responses, gender), sign=-1)
+
+
+def aggregate(queryset):
+    """Суммы по (пол, фаза, день), посчитанные в базе по ответам queryset"""
+    annotations = {'count': Count('id')}
+    for sum_field, sumsq_field, score_field in SCALE_COLUMNS:
+        annotations[sum_field] = Sum(score_field)
+        annotations[sumsq_field] = Sum(F(score_field) * F(score_field))
+    rows = (queryset.annotate(day=TruncDate('timestamp'))
+            .values('participant__gender', 'phase', 'day')
+            .annotate(**annotations)
+            .order_by())
+    return {
+        (row['participant__gender'], row['phase'], row['day']): [row[field] or 0 for field in VALUE_FIELDS]
+        for row in rows
+    }
+
+
+def move_participant(participant, old_gender):
+    """Переносит вклад ответов участника из группы старого пола в группу нового"""
+    deltas = aggregate(Response.objects.filter(participant=participant))
+    with transaction.atomic():
+        apply({(old_gender, phase, day): values for (_, phase, day), values in deltas.items()}, sign=-1)
+        apply({(participant.gender, phase, day): values for (_, phase, day), values in deltas.items()})
+
+
+def rebuild():
+    """Пересобирает ScoreRollup с нуля по всей таблице ответов"""
+    deltas = aggregate(Response.objects.all())
+    with transaction.atomic():
+        ScoreRollup.objects.all().delete()
+        ScoreRollup.objects.bulk_create([
+            ScoreRollup(gender=gender, phase=phase, day=day, **dict(zip(VALUE_FIELDS, values)))
+            for (gender, phase, day), values in deltas.items()
+        ])
+    return len(deltas)
+
+
+def group_stats(rollups=None):
+    """Число ответов, средние и дисперсии шкал по (пол, фаза) из ScoreRollup
+
+    rollups - queryset ScoreRollup (например, отфильтрованный по дням).
+    Возвращает список словарей с ключами gender, phase, count, <шкала>,
+    <шкала>_var, отсортированный по полу и фазе.
+    """
+    if rollups is None:
+        rollups = ScoreRollup.objects.all()
+    totals = (rollups.values('gender', 'phase')
+              .annotate(**{field: Sum(field) for field in VALUE_FIELDS})
+              .filter(count__gt=0)
+              .order_by('gender', 'phase'))
+    return _stats(totals)
+
+
+def response_group_stats(queryset):
+    """То же, что group_stats(), но по произвольной выборке ответов (суммы считаются в базе)"""
+    annotations = {'count': Count('id')}
+    for sum_field, sumsq_field, score_field in SCALE_COLUMNS:
+        annotations[sum_field] = Sum(score_field)
+        annotations[sumsq_field] = Sum(F(score_field) * F(score_field))
+    totals = (queryset.values('phase', gender=F('participant__gender'))
+              .annotate(**annotations)
+              .order_by('gender', 'phase'))
+    return _stats(totals)
+
+
+def _stats(totals):
+    stats = []
+    for row in totals:
+        n = row['count']
+        item = {'gender': row['gender'], 'phase': row['phase'], 'count': n}
+        for scale, (sum_field, sumsq_field, _) in zip(SCALES, SCALE_COLUMNS):
+            total, total_sq = row[sum_field] or 0.0, row[sumsq_field] or 0.0
+            item[scale] = total / n
+            # Несмещенная дисперсия по сумме и сумме квадратов
+            item[f'{scale}_var'] = max(total_sq - total * total / n, 0.0) / (n - 1) if n > 1 else 0.0
+        stats.append(item)
+    return stats
+
+
+def phase_counts():
+    """Число ответов всего и по фазам одним запросом к ScoreRollup"""
+    counts = ScoreRollup.objects.aggregate(
+        total=Sum('count'),
+        before=Sum('count', filter=Q(phase='before')),
+        after=Sum('count', filter=Q(phase='after')),
+    )
+    return {key: value or 0 for key, value in counts.items()}
+
+
+def _rollup_total(**filters):
+    """Скалярный подзапрос: сумма count по строкам ScoreRollup (0, если строк нет)"""
+    rows = (ScoreRollup.objects.filter(**filters).order_by()
+            .annotate(group=Value(1)).values('group')
+            .annotate(total=Sum('count')).values('total'))
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def dashboard_counts():
+    """Число участников и ответов (всего и по фазам) одним запросом
+
+    Участники считаются по своей таблице, ответы - подзапросами к ScoreRollup.
+    Подзапросы не зависят от строки участника, поэтому MAX просто возвращает их значение.
+    """
+    counts = Participant.objects.aggregate(**_dashboard_aggregates())
+    return {key: value or 0 for key, value in counts.items()}
+
+
+async def adashboard_counts():
+    """Асинхронная версия dashboard_counts() (тот же запрос через aaggregate)"""
+    counts = await Participant.objects.aaggregate(**_dashboard_aggregates())
+    return {key: value or 0 for key, value in counts.items()}
+
+
+def _dashboard_aggregates():
+    return {
+        'participants': Count('id'),
+        'total': Max(_rollup_total()),
+        'before': Max(_rollup_total(phase='before')),
+        'after': Max(_rollup_total(phase='after')),
+    }
@@ -0,0 +1,84 @@
+"""Расчет баллов шкал САН: общие таблицы ключей и пакетный расчет на NumPy
+
+NumPy импортируется только при пакетном расчете, чтобы модели (и весь
+веб-процесс) не загружали его при старте.
+"""
+from functools import lru_cache
+
+# Номера полей с ответами q1..q30
+Q_FIELDS = [f'q{i}' for i in range(1, 31)]
+
+# Константы для расчёта (True - левый полюс положительный)
+POLARITIES = [
+    True, True, False, False, True, True, True, True, False, False,
+    True, True, False, True, False, False, True, True, True, True,
+    False, False, True, True, True, True, False, False, True, True
+]
+
+WELLBEING_ITEMS = [1, 2, 7, 8, 13, 14, 19, 20, 25, 26]
+ACTIVITY_ITEMS = [3, 4, 9, 10, 15, 16, 21, 22, 27, 28]
+MOOD_ITEMS = [5, 6, 11, 12, 17, 18, 23, 24, 29, 30]
+ALL_ITEMS = list(range(1, 31))
+
+# Порядок шкал в результатах: самочувствие, активность, настроение, общий балл
+SCALES = ['wellbeing', 'activity', 'mood', 'overall']
+SCALE_ITEMS = [WELLBEING_ITEMS, ACTIVITY_ITEMS, MOOD_ITEMS, ALL_ITEMS]
+
+
+@lru_cache(maxsize=None)
+def numpy_tables():
+    """Вектор знаков (+1 / -1), матрица принадлежности пунктов шкалам (30 x 4) и число пунктов шкал"""
+    import numpy as np
+
+    signs = np.where(POLARITIES, 1, -1).astype(np.int64)
+    masks = np.zeros((30, len(SCALES)), dtype=np.int64)
+    for col, items in enumerate(SCALE_ITEMS):
+        masks[np.array(items) - 1, col] = 1
+    return signs, masks, masks.sum(axis=0)
+
+
+def item_score(q_num, value):
+    """Балл пункта от 1 до 7 с учетом полярности"""
+    if POLARITIES[q_num - 1]:
+        return 4 + value  # +3 -> 7, -3 -> 1
+    return 4 - value  # +3 -> 1, -3 -> 7
+
+
+def compute_scores(answers):
+    """Баллы четырех шкал для одного набора ответов q1..q30"""
+    scores = [item_score(num, value) for num, value in enumerate(answers, start=1)]
+    return tuple(
+        sum(scores[i - 1] for i in items) / len(items)
+        for items in SCALE_ITEMS
+    )
+
+
+def score_array(answers):
+    """Баллы шкал для матрицы ответов (n x 30), результат n x 4
+
+    Суммы по пунктам считаются в целых числах и делятся на число пунктов так же,
+    как в compute_scores(), поэтому оба пути дают одинаковые значения.
+    """
+    import numpy as np
+
+    signs, masks, counts = numpy_tables()
+    answers = np.asarray(answers, dtype=np.int64).reshape(-1, 30)
+    item_scores = 4 + answers * signs
+    return (item_scores @ masks) / counts
+
+
+def score_matrix(queryset, with_ids=False, chunk_size=5000):
+    """Баллы шкал для всех ответов queryset за один проход
+
+    Возвращает матрицу n x 4 (wellbeing, activity, mood, overall), а при
+    with_ids=True - пару (ids, матрица). Все строки queryset загружаются в
+    память, поэтому большие таблицы передаются порциями (см. backfill_scores).
+    """
+    import numpy as np
+
+    rows = queryset.values_list('id', *Q_FIELDS).iterator(chunk_size=chunk_size)
+    data = np.array(list(rows), dtype=np.int64).reshape(-1, 31)
+    scores = score_array(data[:, 1:])
+    if with_ids:
+        return data[:, 0], scores
+    return scores
@@ -0,0 +1,63 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import rollups
+from .bulk import invalidate_caches
+from .models import Participant, Response
+
+
+@receiver([post_save, post_delete], sender=Response)
+@receiver([post_save, post_delete], sender=Participant)
+def invalidate_report_cache(sender, **kwargs):
+    """Любое изменение ответов или участников делает устаревшими отчет и счетчики панели
+
+    Кэши очищаются после фиксации транзакции: иначе параллельный запрос успел бы
+    снова закэшировать данные, прочитанные до нее.
+    """
+    transaction.on_commit(invalidate_caches)
+
+
+@receiver(pre_save, sender=Response)
+def remember_response_rollup(sender, instance, **kwargs):
+    """Запоминает прежний вклад изменяемого ответа, чтобы вычесть его из сводной таблицы"""
+    instance._rollup_previous = None
+    if instance.pk is not None:
+        previous = (Response.objects.select_related('participant')
+                    .filter(pk=instance.pk).first())
+        if previous is not None:
+            instance._rollup_previous = rollups.collect([previous])
+
+
+@receiver(post_save, sender=Response)
+def update_response_rollup(sender, instance, **kwargs):
+    """Переносит вклад ответа в сводную таблицу
+
+    Выполняется в транзакции Response.save(), поэтому ответ и сводная
+    таблица записываются (или откатываются) вместе; так же и при удалении.
+    """
+    previous = getattr(instance, '_rollup_previous', None)
+    if previous:
+        rollups.apply(previous, sign=-1)
+    rollups.add_responses([instance])
+
+
+@receiver(post_delete, sender=Response)
+def remove_response_rollup(sender, instance, **kwargs):
+    rollups.remove_responses([instance])
+
+
+@receiver(pre_save, sender=Participant)
+def remember_participant_gender(sender, instance, **kwargs):
+    instance._rollup_old_gender = None
+    if instance.pk is not None:
+        instance._rollup_old_gender = (Participant.objects.filter(pk=instance.pk)
+                                       .values_list('gender', flat=True).first())
+
+
+@receiver(post_save, sender=Participant)
+def move_participant_rollup(sender, instance, **kwargs):
+    """Смена пола переносит все ответы участника в другую группу сводной таблицы"""
+    old_gender = getattr(instance, '_rollup_old_gender', None)
+    if old_gender and old_gender != instance.gender:
+        rollups.move_participant(instance, old_gender)
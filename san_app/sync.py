@@ -0,0 +1,90 @@
+"""Пакетная синхронизация бланков, накопленных браузером без связи
+
+Каждый бланк несет client_key - UUID, созданный на устройстве. Ключ хранится
+в Response с уникальным индексом, поэтому повторная отправка после обрыва
+связи находит уже сохраненный ответ одним запросом по индексу и не создает
+дубль.
+"""
+from django.db import IntegrityError
+
+from .bulk import bulk_create_responses
+from .forms import SyncResponseForm
+from .models import Participant, Response
+from .scoring import Q_FIELDS, SCALES
+
+SCORE_FIELDS = [f'{scale}_score' for scale in SCALES]
+
+
+def _scores(values):
+    return dict(zip(SCALES, values))
+
+
+def existing_scores(keys):
+    """Уже сохраненные ответы по client_key: {key: (id участника, {шкала: балл})}"""
+    rows = Response.objects.filter(client_key__in=keys).values_list('client_key', 'participant_id', *SCORE_FIELDS)
+    return {key: (participant_id, _scores(values)) for key, participant_id, *values in rows}
+
+
+def sync_responses(items, user):
+    """Сохраняет новые бланки из items и возвращает результат по каждому в том же порядке
+
+    Результат: {'client_key', 'status': created | duplicate | invalid | forbidden,
+    'scores' или 'errors'}. Участник должен принадлежать пользователю (персонал - любой).
+    Ключ, под которым уже сохранен бланк другого участника, - тоже forbidden:
+    баллы чужого ответа не возвращаются.
+    """
+    forms = [SyncResponseForm(item if isinstance(item, dict) else {}) for item in items]
+    results = [None] * len(forms)
+    valid = {}
+    for index, form in enumerate(forms):
+        if form.is_valid():
+            valid[index] = form.cleaned_data
+        else:
+            results[index] = {'client_key': str(form.data.get('client_key', '')), 'status': 'invalid',
+                              'errors': form.errors.get_json_data()}
+
+    participants = Participant.objects.in_bulk({data['participant'] for data in valid.values()})
+    for index, data in list(valid.items()):
+        participant = participants.get(data['participant'])
+        if participant is None or (participant.user_id != user.id and not user.is_staff):
+            results[index] = {'client_key': str(data['client_key']), 'status': 'forbidden'}
+            del valid[index]
+
+    for attempt in range(2):
+        known = existing_scores([data['client_key'] for data in valid.values()])
+        new, seen = [], {}
+        for index, data in list(valid.items()):
+            key = data['client_key']
+            owner = known[key][0] if key in known else seen.get(key, data['participant'])
+            if owner != data['participant']:
+                results[index] = {'client_key': str(key), 'status': 'forbidden'}
+                del valid[index]
+                continue
+            if key in known or key in seen:
+                continue
+            seen[key] = data['participant']
+            new.append((index, Response(
+                participant_id=data['participant'], phase=data['phase'], timestamp=data['submitted_at'],
+                client_key=key, **{field: data[field] for field in Q_FIELDS})))
+        if not new:
+            break
+        try:
+            bulk_create_responses([response for _, response in new],
+                                  [participants[response.participant_id].gender for _, response in new])
+            break
+        except IntegrityError:
+            # Тот же бланк одновременно пришел другим запросом: перечитываем сохраненные ключи
+            if attempt:
+                raise
+
+    created = dict(new)
+    by_key = {response.client_key: response for _, response in new}
+    for index, data in valid.items():
+        key = data['client_key']
+        if key in by_key:
+            scores = _scores([getattr(by_key[key], field) for field in SCORE_FIELDS])
+        else:
+            scores = known[key][1]
+        status = 'created' if index in created else 'duplicate'
+        results[index] = {'client_key': str(key), 'status': status, 'scores': scores}
+    return results
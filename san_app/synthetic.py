@@ -0,0 +1,151 @@
+"""Воспроизводимые синтетические данные для нагрузочных замеров
+
+Участники получают пол (примерно 45% мужчин) и возраст из смеси «студенты
+18-25» и «взрослые 25-65». У каждого участника есть свой уровень
+самочувствия, активности и настроения; ответы идут парами «до / после»
+занятия с интервалом 45-120 минут, а после занятия шкалы в среднем растут
+(сильнее всего активность). Ответы q1..q30 получаются из этих уровней с
+шумом и с учетом полярности пунктов, поэтому баллы шкал ведут себя как у
+настоящих бланков.
+
+Одинаковые аргументы (число участников, ответов, seed, until, batch_size) дают
+одинаковые данные. Запись - через bulk_create партиями (см. bulk.py), так что
+ScoreRollup и кэши обновляются как при импорте.
+"""
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import rollups
+from .bulk import bulk_create_responses, invalidate_caches
+from .models import Participant, Response
+from .scoring import ACTIVITY_ITEMS, MOOD_ITEMS, Q_FIELDS, SCALES, WELLBEING_ITEMS, numpy_tables, score_array
+
+# Префикс имен синтетических участников (по нему они удаляются)
+NAME_PREFIX = 'Синтетический участник'
+
+# Среднее и разброс изменения уровней самочувствия, активности и настроения после занятия
+SESSION_EFFECT = np.array([0.35, 0.6, 0.3])
+SESSION_EFFECT_SD = 0.4
+
+
+@dataclass
+class SeedResult:
+    participants: int = 0
+    responses: int = 0
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.responses / self.seconds if self.seconds else 0.0
+
+
+def _item_scales():
+    """Номер шкалы (0 - самочувствие, 1 - активность, 2 - настроение) для каждого пункта q1..q30"""
+    scales = np.empty(30, dtype=np.int64)
+    for index, items in enumerate([WELLBEING_ITEMS, ACTIVITY_ITEMS, MOOD_ITEMS]):
+        scales[np.array(items) - 1] = index
+    return scales
+
+
+def answers_from_levels(rng, levels):
+    """Ответы q1..q30 (n x 30, -3..+3) для уровней шкал (n x 3): балл пункта 1..7 с шумом и полярностью"""
+    signs = numpy_tables()[0]
+    item_levels = levels[:, _item_scales()]
+    item_scores = np.clip(np.rint(4 + 1.1 * item_levels + rng.normal(0, 0.8, item_levels.shape)), 1, 7)
+    # item_score = 4 + answer * sign, отсюда answer = (балл - 4) * sign
+    return ((item_scores - 4) * signs).astype(np.int64)
+
+
+def generate_participants(rng, count, start, until):
+    """Участники с номерами start..start+count-1: имя, пол, дата рождения"""
+    genders = np.where(rng.random(count) < 0.45, 'M', 'F')
+    students = rng.random(count) < 0.6
+    ages = np.where(students, rng.uniform(18, 25, count), rng.uniform(25, 65, count))
+    return [
+        Participant(name=f'{NAME_PREFIX} {start + index + 1}', gender=gender,
+                    birth_date=until - timedelta(days=int(age * 365.25)))
+        for index, (gender, age) in enumerate(zip(genders.tolist(), ages.tolist()))
+    ]
+
+
+def generate_responses(rng, participants, per_participant, until, days=365):
+    """Ответы участников: пары «до / после» по дням за последние days дней; возвращает (ответы, полы)"""
+    count = len(participants)
+    sessions = (per_participant + 1) // 2
+    ages = np.array([(until - participant.birth_date).days / 365.25 for participant in participants])
+    # Собственные уровни участника; у старших участников активность немного ниже
+    traits = rng.normal(0, 0.7, (count, 3))
+    traits[:, 1] -= np.clip(ages - 30, 0, None) * 0.01
+
+    before = traits[:, None, :] + rng.normal(0, 0.5, (count, sessions, 3))
+    after = before + SESSION_EFFECT + rng.normal(0, SESSION_EFFECT_SD, (count, sessions, 3))
+    # Порядок ответов участника: до, после, до, после, ...
+    levels = np.stack([before, after], axis=2).reshape(count, sessions * 2, 3)[:, :per_participant]
+    answers = answers_from_levels(rng, levels.reshape(-1, 3))
+    scores = score_array(answers)
+
+    # Дни занятий без повторов у одного участника, начало - с 8 до 20 часов
+    day_offsets = np.sort(np.argsort(rng.random((count, days)), axis=1)[:, :sessions], axis=1)[:, ::-1]
+    starts = rng.integers(8 * 60, 20 * 60, (count, sessions))
+    gaps = rng.integers(45, 121, (count, sessions))
+    end = timezone.make_aware(datetime.combine(until, datetime.min.time()))
+
+    responses, genders = [], []
+    rows = zip(answers.tolist(), scores.tolist())
+    for index, participant in enumerate(participants):
+        for num in range(per_participant):
+            session, is_after = divmod(num, 2)
+            minutes = int(starts[index, session]) + (int(gaps[index, session]) if is_after else 0)
+            timestamp = end - timedelta(days=int(day_offsets[index, session])) + timedelta(minutes=minutes)
+            values, row_scores = next(rows)
+            responses.append(Response(
+                participant_id=participant.pk, phase='after' if is_after else 'before', timestamp=timestamp,
+                **dict(zip(Q_FIELDS, values)),
+                **{f'{scale}_score': score for scale, score in zip(SCALES, row_scores)}))
+            genders.append(participant.gender)
+    return responses, genders
+
+
+def seed(participants, per_participant, seed=0, until=None, batch_size=5000, progress=None):
+    """Создает participants участников по per_participant ответов; progress(result) - после каждой партии"""
+    until = until or date.today()
+    result = SeedResult()
+    started = time.perf_counter()
+    chunk = max(1, batch_size // max(per_participant, 1))
+    # Номера участников продолжают уже созданных, чтобы повторный запуск добавлял новых
+    offset = Participant.objects.filter(name__startswith=NAME_PREFIX).count()
+    for index, start in enumerate(range(0, participants, chunk)):
+        rng = np.random.default_rng([seed, index])
+        with transaction.atomic():
+            created = Participant.objects.bulk_create(
+                generate_participants(rng, min(chunk, participants - start), offset + start, until))
+            responses, genders = generate_responses(rng, created, per_participant, until)
+            bulk_create_responses(responses, genders)
+        result.participants += len(created)
+        result.responses += len(responses)
+        result.seconds = time.perf_counter() - started
+        if progress is not None:
+            progress(result)
+    return result
+
+
+def clear():
+    """Удаляет синтетических участников с их ответами и пересобирает ScoreRollup; возвращает число участников"""
+    participants = Participant.objects.filter(name__startswith=NAME_PREFIX)
+    # Ответы удаляются одним DELETE в обход сигналов (delete() вызвал бы их для каждого ответа):
+    # ScoreRollup все равно пересобирается ниже
+    ids_sql, params = participants.values('id').query.sql_with_params()
+    quote = connection.ops.quote_name
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {quote(Response._meta.db_table)} '
+                           f'WHERE {quote("participant_id")} IN ({ids_sql})', params)
+        deleted, _ = participants.delete()
+        rollups.rebuild()
+        transaction.on_commit(invalidate_caches)
+    return deleted
@@ -1,3 +1,1352 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import uuid
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Avg, Sum
+from django.http import StreamingHttpResponse
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (async_views, dashboard, export, importer, jobs, metrics, pairing, profiling, rollups, scoring,
+               synthetic, views)
+from .bulk import bulk_create_responses
+from .charts import CHARTS
+from .forms import ReportFilterForm
+from .models import Participant, ReportJob, Response, ScoreRollup
+from .pagination import akeyset_page, keyset_page
+from .report_cache import ReportCache, data_version, report_cache
+from .reporting import attach_frame, load_report_frame, render_charts, share_frame
+from .write_buffer import WriteBuffer
+
+
+def make_answers(seed):
+    """Детерминированный набор ответов q1..q30 в диапазоне -3..+3"""
+    rng = np.random.default_rng(seed)
+    return {field: int(value) for field, value in zip(scoring.Q_FIELDS, rng.integers(-3, 4, size=30))}
+
+
+class ScoringTests(TestCase):
+    def setUp(self):
+        self.participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+
+    def test_extreme_answers(self):
+        best = {field: (3 if left else -3) for field, left in zip(scoring.Q_FIELDS, scoring.POLARITIES)}
+        response = Response.objects.create(participant=self.participant, phase='before', **best)
+        self.assertEqual(
+            (response.wellbeing_score, response.activity_score, response.mood_score, response.overall_score),
+            (7.0, 7.0, 7.0, 7.0),
+        )
+
+    def test_matrix_matches_instance_scores(self):
+        for seed in range(20):
+            Response.objects.create(participant=self.participant, phase='before', **make_answers(seed))
+        ids, matrix = scoring.score_matrix(Response.objects.order_by('id'), with_ids=True)
+        expected = [
+            (r.id, r.wellbeing_score, r.activity_score, r.mood_score, r.overall_score)
+            for r in Response.objects.order_by('id')
+        ]
+        self.assertEqual([(int(pk), *row) for pk, row in zip(ids, matrix.tolist())], expected)
+
+    def test_backfill_scores(self):
+        for seed in range(7):
+            Response.objects.create(participant=self.participant, phase='after', **make_answers(seed))
+        stored = list(Response.objects.order_by('id').values_list('overall_score', flat=True))
+        Response.objects.update(wellbeing_score=None, activity_score=None, mood_score=None, overall_score=None)
+        # Таблица читается порциями по --batch-size, а не целиком
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_scores', '--batch-size', '3', stdout=StringIO())
+        chunks = [q for q in queries.captured_queries if q['sql'].startswith('SELECT') and 'LIMIT 3' in q['sql']]
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(list(Response.objects.order_by('id').values_list('overall_score', flat=True)), stored)
+
+
+class ScoreMigrationTests(TransactionTestCase):
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('san_app', target)])
+        return executor.loader.project_state([('san_app', target)]).apps
+
+    def test_existing_responses_get_scores_and_rollups(self):
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('san_app')[0][1]
+        self.addCleanup(self.migrate, latest)
+        apps = self.migrate('0002_participant_user')
+        participant = apps.get_model('san_app', 'Participant').objects.create(
+            name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        for seed in range(5):
+            apps.get_model('san_app', 'Response').objects.create(participant=participant, phase='before',
+                                                                 **make_answers(seed))
+        expected = [scoring.compute_scores([answers[field] for field in scoring.Q_FIELDS])[3]
+                    for answers in map(make_answers, range(5))]
+
+        apps = self.migrate('0004_updated_at')
+        historical = apps.get_model('san_app', 'Response')
+        self.assertEqual(list(historical.objects.order_by('id').values_list('overall_score', flat=True)), expected)
+
+        # База, где 0003 применена без заполнения: баллы заполнит 0005 перед сборкой сводной таблицы
+        historical.objects.filter(id__in=historical.objects.order_by('id').values('id')[:2]).update(overall_score=None)
+        apps = self.migrate('0005_score_rollup')
+        rollup = apps.get_model('san_app', 'ScoreRollup').objects.get()
+        self.assertEqual(rollup.count, 5)
+        self.assertAlmostEqual(rollup.overall_sum, sum(expected))
+
+
+class ScoreExpressionTests(TestCase):
+    def setUp(self):
+        male = Participant.objects.create(name='Петров П.П.', gender='M', birth_date=date(1985, 3, 2))
+        female = Participant.objects.create(name='Сидорова А.А.', gender='F', birth_date=date(1995, 7, 9))
+        for seed in range(12):
+            Response.objects.create(participant=male if seed % 2 else female,
+                                    phase='before' if seed % 3 else 'after', **make_answers(seed))
+
+    def test_sql_scores_match_stored_scores(self):
+        rows = Response.objects.with_scores().values_list(
+            'wellbeing', 'activity', 'mood', 'overall',
+            'wellbeing_score', 'activity_score', 'mood_score', 'overall_score',
+        )
+        for row in rows:
+            self.assertEqual(row[:4], row[4:])
+
+    def test_filter_order_and_aggregate(self):
+        responses = list(Response.objects.all())
+        low = Response.objects.with_scores().filter(wellbeing__lt=4, phase='before')
+        self.assertEqual(
+            set(low.values_list('id', flat=True)),
+            {r.id for r in responses if r.wellbeing_score < 4 and r.phase == 'before'},
+        )
+        ordered = Response.objects.with_scores().order_by('-overall', 'id').values_list('overall', flat=True)
+        self.assertEqual(list(ordered), sorted((r.overall_score for r in responses), reverse=True))
+
+        by_gender = dict(
+            Response.objects.with_scores().values_list('participant__gender').annotate(Avg('mood'))
+        )
+        for gender in ('M', 'F'):
+            moods = [r.mood_score for r in responses if r.participant.gender == gender]
+            self.assertAlmostEqual(by_gender[gender], sum(moods) / len(moods))
+
+
+class ReportQueryCountTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(self.admin)
+
+    def add_responses(self, count):
+        for i in range(count):
+            participant = Participant.objects.create(
+                name=f'Участник {i}', gender='MF'[i % 2], birth_date=date(1980 + i % 20, 1, 1))
+            Response.objects.create(participant=participant, phase='before', **make_answers(i))
+            Response.objects.create(participant=participant, phase='after', **make_answers(i + 100))
+
+    def count_report_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('report'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_report_query_count_does_not_grow_with_rows(self):
+        self.add_responses(2)
+        small = self.count_report_queries()
+        self.add_responses(20)
+        self.assertEqual(self.count_report_queries(), small)
+
+    def test_report_frame_columns(self):
+        self.add_responses(3)
+        df = load_report_frame(Response.objects.order_by('id'))
+        self.assertEqual(len(df), 6)
+        first = Response.objects.select_related('participant').order_by('id').first()
+        self.assertEqual(df.loc[0, 'participant'], first.participant.name)
+        self.assertEqual(df.loc[0, 'overall'], first.overall_score)
+        self.assertAlmostEqual(df.loc[0, 'age'], first.participant.age, delta=1)
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        report_cache.clear()
+        self.participant = Participant.objects.create(name='Кузнецов К.К.', gender='M', birth_date=date(1992, 2, 2))
+        Response.objects.create(participant=self.participant, phase='before', **make_answers(7))
+
+    def test_lru_eviction_by_size(self):
+        cache = ReportCache(max_bytes=10)
+        cache.set('a', 'a', 4)
+        cache.set('b', 'b', 4)
+        cache.get('a')
+        cache.set('c', 'c', 4)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 'a')
+        self.assertEqual(cache.size, 8)
+
+    def test_data_version_changes_on_writes(self):
+        version = data_version()
+        self.assertEqual(data_version(), version)
+        response = Response.objects.create(participant=self.participant, phase='after', **make_answers(8))
+        self.assertNotEqual(data_version(), version)
+        version = data_version()
+        response.delete()
+        self.assertNotEqual(data_version(), version)
+        # Пересчет баллов через bulk_update тоже меняет версию
+        version = data_version()
+        call_command('backfill_scores', '--all', stdout=StringIO())
+        self.assertNotEqual(data_version(), version)
+
+    def test_signals_clear_cache_after_commit(self):
+        report_cache.set('table', '<table></table>', 15)
+        with self.captureOnCommitCallbacks(execute=True):
+            Response.objects.create(participant=self.participant, phase='after', **make_answers(9))
+            # До фиксации параллельные запросы видят старые данные - кэш еще не очищен
+            self.assertEqual(report_cache.get('table'), '<table></table>')
+        self.assertIsNone(report_cache.get('table'))
+
+    def test_report_rendered_once_per_version(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            return '<table></table>'
+
+        for _ in range(3):
+            report_cache.get_or_build(data_version(), build, len)
+        self.assertEqual(len(builds), 1)
+        self.participant.gender = 'F'
+        self.participant.save()
+        report_cache.get_or_build(data_version(), build, len)
+        self.assertEqual(len(builds), 2)
+
+
+class ChartRenderingTests(TestCase):
+    def setUp(self):
+        for i in range(6):
+            participant = Participant.objects.create(
+                name=f'Участник {i}', gender='MF'[i % 2], birth_date=date(1970 + 5 * i, 6, 1))
+            for phase in ('before', 'after'):
+                Response.objects.create(participant=participant, phase=phase, **make_answers(i * 2 + len(phase)))
+        self.df = load_report_frame(Response.objects.all())
+
+    def test_shared_frame_round_trip(self):
+        shm, spec = share_frame(self.df)
+        try:
+            restored = attach_frame(spec)
+        finally:
+            shm.close()
+            shm.unlink()
+        for column in restored.columns:
+            self.assertEqual(list(restored[column]), list(self.df[column]))
+
+    def test_parallel_render_matches_serial(self):
+        serial = render_charts(self.df, workers=0)
+        parallel = render_charts(self.df, workers=2)
+        self.assertEqual(list(parallel), list(CHARTS))
+        self.assertEqual(list(serial), list(CHARTS))
+        for name in CHARTS:
+            self.assertTrue(parallel[name].startswith(b'\x89PNG'), name)
+            self.assertTrue(serial[name].startswith(b'\x89PNG'), name)
+
+    def test_chart_timings_in_metrics(self):
+        metrics.registry.reset()
+        render_charts(self.df, workers=0)
+        self.assertIn('san_report_chart_render_seconds_count{chart="means_bar"} 1', metrics.registry.render())
+
+
+@override_settings(REPORT_CHART_WORKERS=0, REPORT_JOBS_ENABLED=False)
+class ReportChartEndpointTests(TestCase):
+    def setUp(self):
+        report_cache.clear()
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        participant = Participant.objects.create(name='Орлова О.О.', gender='F', birth_date=date(1999, 9, 9))
+        for seed, phase in enumerate(['before', 'after']):
+            Response.objects.create(participant=participant, phase=phase, **make_answers(seed))
+
+    def test_report_page_links_charts(self):
+        response = self.client.get(reverse('report'))
+        self.assertContains(response, reverse('report_chart', args=['means_bar', 'png']))
+        self.assertNotContains(response, 'base64')
+
+    def test_chart_is_revalidated_with_etag(self):
+        url = reverse('report_chart', args=['correlation', 'png'])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('must-revalidate', response['Cache-Control'])
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        Response.objects.create(participant=Participant.objects.get(), phase='after', **make_answers(5))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_svg_and_unknown_chart(self):
+        response = self.client.get(reverse('report_chart', args=['boxplot', 'svg']))
+        self.assertEqual(response['Content-Type'], 'image/svg+xml')
+        self.assertEqual(self.client.get(reverse('report_chart', args=['missing', 'png'])).status_code, 404)
+
+
+class ScoreRollupTests(TestCase):
+    def setUp(self):
+        self.male = Participant.objects.create(name='Волков В.В.', gender='M', birth_date=date(1980, 1, 1))
+        self.female = Participant.objects.create(name='Зайцева З.З.', gender='F', birth_date=date(1990, 1, 1))
+        for seed in range(8):
+            Response.objects.create(participant=self.male if seed % 2 else self.female,
+                                    phase='before' if seed < 4 else 'after', **make_answers(seed))
+
+    def assertRollupsConsistent(self):
+        stored = {
+            (r.gender, r.phase, r.day): [getattr(r, field) for field in rollups.VALUE_FIELDS]
+            for r in ScoreRollup.objects.exclude(count=0)
+        }
+        expected = rollups.aggregate(Response.objects.all())
+        self.assertEqual(stored.keys(), expected.keys())
+        for key, values in expected.items():
+            for got, want in zip(stored[key], values):
+                self.assertAlmostEqual(got, want)
+
+    def test_signals_keep_rollups_current(self):
+        self.assertRollupsConsistent()
+        response = Response.objects.filter(participant=self.male).first()
+        response.q1 = -response.q1 or 3
+        response.phase = 'after'
+        response.save()
+        self.assertRollupsConsistent()
+        response.delete()
+        self.assertRollupsConsistent()
+        self.male.gender = 'F'
+        self.male.save()
+        self.assertRollupsConsistent()
+        self.female.delete()
+        self.assertRollupsConsistent()
+
+    def test_failed_rollup_write_rolls_back_response(self):
+        with mock.patch('san_app.rollups.apply', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                Response.objects.create(participant=self.male, phase='after', **make_answers(20))
+            response = Response.objects.filter(participant=self.male).first()
+            original = response.q1
+            response.q1 = -original or 3
+            with self.assertRaises(OperationalError):
+                response.save()
+            with self.assertRaises(OperationalError):
+                response.delete()
+            self.male.gender = 'F'
+            with self.assertRaises(OperationalError):
+                self.male.save()
+        self.assertEqual(Response.objects.count(), 8)
+        self.assertEqual(Response.objects.get(pk=response.pk).q1, original)
+        self.assertEqual(Participant.objects.get(pk=self.male.pk).gender, 'M')
+        self.assertRollupsConsistent()
+
+    def test_group_stats_match_pandas(self):
+        df = load_report_frame(Response.objects.all())
+        grouped = df.groupby(['gender', 'phase'])['mood'].agg(['count', 'mean', 'var'])
+        for row in rollups.group_stats():
+            expected = grouped.loc[(row['gender'], row['phase'])]
+            self.assertEqual(row['count'], expected['count'])
+            self.assertAlmostEqual(row['mood'], expected['mean'])
+            self.assertAlmostEqual(row['mood_var'], expected['var'])
+
+    def test_backfill_rebuilds_rollups(self):
+        # Как после миграции 0005: баллы еще пустые, и сводная таблица построена по нулям
+        Response.objects.update(**{field: None for field in Response.SCORE_FIELDS})
+        rollups.rebuild()
+        call_command('backfill_scores', stdout=StringIO())
+        self.assertRollupsConsistent()
+        self.assertGreater(ScoreRollup.objects.aggregate(total=Sum('overall_sum'))['total'], 0)
+
+    def test_bulk_apply_matches_rebuild(self):
+        stored = lambda: {(r.gender, r.phase, r.day): [getattr(r, field) for field in rollups.VALUE_FIELDS]
+                          for r in ScoreRollup.objects.exclude(count=0)}
+        before = stored()
+        # Ответы за месяц: групп больше порога, часть из них уже есть в сводной таблице
+        now = timezone.now()
+        responses = [Response(participant=self.male if seed % 2 else self.female,
+                              phase='before' if seed % 3 else 'after',
+                              timestamp=now - timedelta(days=seed % 29), **make_answers(seed))
+                     for seed in range(120)]
+        self.assertGreaterEqual(len(rollups.collect(responses)), rollups.BULK_APPLY_MIN_GROUPS)
+        with mock.patch('san_app.rollups._apply_bulk', wraps=rollups._apply_bulk) as apply_bulk:
+            bulk_create_responses(responses, [response.participant.gender for response in responses])
+        self.assertEqual(apply_bulk.call_count, 2)
+        self.assertRollupsConsistent()
+        bulk = stored()
+        rollups.rebuild()
+        self.assertEqual(stored().keys(), bulk.keys())
+        for key, values in stored().items():
+            for got, want in zip(bulk[key], values):
+                self.assertAlmostEqual(got, want)
+
+        # Вычитание тем же путем возвращает таблицу к исходным суммам
+        rollups.apply(rollups.collect(responses), sign=-1)
+        self.assertEqual(stored().keys(), before.keys())
+        for key, values in before.items():
+            for got, want in zip(stored()[key], values):
+                self.assertAlmostEqual(got, want)
+
+    def test_rebuild_and_dashboard_counts(self):
+        ScoreRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertRollupsConsistent()
+        self.assertEqual(rollups.phase_counts(), {'total': 8, 'before': 4, 'after': 4})
+
+
+@override_settings(REPORT_CHART_WORKERS=0, REPORT_JOBS_ENABLED=True)
+class ReportJobTests(TestCase):
+    def setUp(self):
+        report_cache.clear()
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        self.participant = Participant.objects.create(name='Лебедев Л.Л.', gender='M', birth_date=date(1975, 4, 4))
+        for seed, phase in enumerate(['before', 'after']):
+            Response.objects.create(participant=self.participant, phase=phase, **make_answers(seed))
+
+    def test_report_page_enqueues_and_reuses_job(self):
+        response = self.client.get(reverse('report'))
+        job = ReportJob.objects.get()
+        self.assertContains(response, reverse('report_job_status', args=[job.id]))
+        self.assertNotContains(response, reverse('report_chart', args=['means_bar', 'png']))
+        self.client.get(reverse('report'))
+        self.assertEqual(ReportJob.objects.count(), 1)
+
+    def test_worker_builds_artifacts_with_timings(self):
+        self.client.get(reverse('report'))
+        call_command('report_worker', '--once', '--chart-workers', '0', stdout=StringIO())
+        job = ReportJob.objects.get()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(job.progress, 100)
+        self.assertEqual(set(job.artifacts.values_list('name', flat=True)), set(CHARTS) | {jobs.PAIRS_ARTIFACT})
+        for stage in ['load', 'score', 'pairs', 'charts'] + [f'chart:{name}' for name in CHARTS]:
+            self.assertIn(stage, job.timings)
+
+        status = self.client.get(reverse('report_job_status', args=[job.id])).json()
+        self.assertEqual(status['status'], 'done')
+
+        # Таблица пар на странице - из задания, бутстреп в запросе не выполняется
+        with mock.patch('san_app.pairing.bootstrap_ci') as bootstrap:
+            page = self.client.get(reverse('report'))
+        bootstrap.assert_not_called()
+        self.assertContains(page, reverse('report_chart', args=['means_bar', 'png']))
+        self.assertContains(page, 'p (Уилкоксон)')
+        chart = self.client.get(reverse('report_chart', args=['means_bar', 'png']))
+        self.assertEqual(chart.content, bytes(job.artifacts.get(name='means_bar').data))
+
+    @override_settings(REPORT_WORKER_CHART_WORKERS=3)
+    def test_only_worker_uses_chart_pool(self):
+        self.client.get(reverse('report'))
+        with mock.patch('san_app.jobs.run_job', side_effect=lambda job, workers: job) as run_job:
+            call_command('report_worker', '--once', stdout=StringIO())
+        self.assertEqual(run_job.call_args.kwargs['workers'], 3)
+        # Веб-процессы по умолчанию строят графики без пула процессов
+        from san import settings as project_settings
+        self.assertEqual(project_settings.REPORT_CHART_WORKERS, 0)
+
+    def test_page_waits_for_job_pairs_table(self):
+        with mock.patch('san_app.pairing.bootstrap_ci') as bootstrap:
+            page = self.client.get(reverse('report'))
+        bootstrap.assert_not_called()
+        self.assertContains(page, 'рассчитываются вместе с графиками')
+
+    def test_crashed_job_is_requeued(self):
+        job = jobs.enqueue('version')
+        self.assertEqual(jobs.claim_next(), job)
+        self.assertEqual(jobs.enqueue('version'), job)
+        # Обработчик упал, не завершив задание
+        ReportJob.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        retry = jobs.enqueue('version')
+        self.assertNotEqual(retry, job)
+        self.assertEqual(retry.status, 'queued')
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+
+    def test_page_renders_charts_without_worker(self):
+        self.client.get(reverse('report'))
+        job = ReportJob.objects.get()
+        self.assertFalse(self.client.get(reverse('report_job_status', args=[job.id])).json()['unclaimed'])
+        ReportJob.objects.filter(pk=job.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(self.client.get(reverse('report_job_status', args=[job.id])).json()['unclaimed'])
+        page = self.client.get(reverse('report'))
+        self.assertContains(page, reverse('report_chart', args=['means_bar', 'png']))
+        chart = self.client.get(reverse('report_chart', args=['means_bar', 'png']))
+        self.assertEqual(chart.status_code, 200)
+
+    @override_settings(REPORT_JOBS_KEEP=3)
+    def test_no_worker_keeps_job_table_small(self):
+        # По умолчанию задания выключены: страница сразу строит графики и ничего не ставит в очередь
+        from san import settings as project_settings
+        with override_settings(REPORT_JOBS_ENABLED=project_settings.REPORT_JOBS_ENABLED):
+            page = self.client.get(reverse('report'))
+        self.assertContains(page, reverse('report_chart', args=['means_bar', 'png']))
+        self.assertFalse(ReportJob.objects.exists())
+
+        # С заданиями, но без report_worker: каждая новая версия данных ставит задание
+        for seed in range(8):
+            Response.objects.create(participant=self.participant, phase='before', **make_answers(seed + 10))
+            self.client.get(reverse('report'))
+        self.assertEqual(ReportJob.objects.filter(status='queued').count(), 1)
+        self.assertLessEqual(ReportJob.objects.count(), 4)
+
+    def test_stale_queued_jobs_are_cancelled(self):
+        old = jobs.enqueue('old-version')
+        new = jobs.enqueue('new-version')
+        self.assertEqual(jobs.claim_next(), new)
+        old.refresh_from_db()
+        self.assertEqual(old.status, 'cancelled')
+        self.assertIsNone(jobs.claim_next())
+
+
+@override_settings(REPORT_CHART_WORKERS=0, REPORT_JOBS_ENABLED=False)
+class ReportFilterTests(TestCase):
+    def setUp(self):
+        report_cache.clear()
+        self.young = Participant.objects.create(name='Молодой М.М.', gender='M', birth_date=date(2004, 1, 1))
+        self.old = Participant.objects.create(name='Старшая С.С.', gender='F', birth_date=date(1960, 1, 1))
+        for seed in range(6):
+            for participant in (self.young, self.old):
+                Response.objects.create(participant=participant, phase='before' if seed % 2 else 'after',
+                                        **make_answers(seed))
+        # Половину ответов переносим на месяц назад
+        month_ago = timezone.now() - timedelta(days=30)
+        Response.objects.filter(id__in=Response.objects.order_by('id').values('id')[:6]).update(timestamp=month_ago)
+        rollups.rebuild()
+
+    def filtered_ids(self, **params):
+        form = ReportFilterForm(params)
+        return set(form.filter_responses(Response.objects.all()).values_list('id', flat=True))
+
+    def test_filters_are_pushed_into_queryset(self):
+        today = timezone.localdate()
+        recent = {r.id for r in Response.objects.all() if timezone.localdate(r.timestamp) >= today - timedelta(days=1)}
+        self.assertEqual(self.filtered_ids(date_from=str(today - timedelta(days=1))), recent)
+        self.assertEqual(self.filtered_ids(gender='F'), set(self.old.responses.values_list('id', flat=True)))
+        self.assertEqual(self.filtered_ids(age_max='30'), set(self.young.responses.values_list('id', flat=True)))
+        self.assertEqual(self.filtered_ids(age_min='30', phase='after'),
+                         set(self.old.responses.filter(phase='after').values_list('id', flat=True)))
+        self.assertEqual(self.filtered_ids(participants=f'{self.young.id}'),
+                         set(self.young.responses.values_list('id', flat=True)))
+        # Некорректные значения не применяются
+        self.assertEqual(len(self.filtered_ids(age_min='abc')), 12)
+
+    def test_rollup_stats_match_response_stats(self):
+        params = {'date_from': str(timezone.localdate()), 'gender': 'M'}
+        form = ReportFilterForm(params)
+        responses = form.filter_responses(Response.objects.all())
+        self.assertIsNotNone(form.rollup_queryset())
+        from_rollups = form.group_stats(responses)
+        from_responses = rollups.response_group_stats(responses)
+        self.assertEqual(len(from_rollups), len(from_responses))
+        for a, b in zip(from_rollups, from_responses):
+            self.assertEqual(a['count'], b['count'])
+            self.assertAlmostEqual(a['wellbeing'], b['wellbeing'])
+        self.assertIsNone(ReportFilterForm({'age_min': '20'}).rollup_queryset())
+
+    def test_report_page_with_filters(self):
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        response = self.client.get(reverse('report'), {'gender': 'F', 'phase': 'before'})
+        self.assertContains(response, reverse('report_chart', args=['means_bar', 'png']) + '?gender=F&amp;phase=before')
+        chart = self.client.get(reverse('report_chart', args=['means_bar', 'png']), {'gender': 'F'})
+        self.assertEqual(chart.status_code, 200)
+        unfiltered = self.client.get(reverse('report_chart', args=['means_bar', 'png']))
+        self.assertNotEqual(chart['ETag'], unfiltered['ETag'])
+        empty = self.client.get(reverse('report'), {'participants': '999999'})
+        self.assertContains(empty, 'Нет доступных данных')
+
+
+class PairingTests(TestCase):
+    def setUp(self):
+        self.anna = Participant.objects.create(name='Анна А.А.', gender='F', birth_date=date(1995, 1, 1))
+        self.boris = Participant.objects.create(name='Борис Б.Б.', gender='M', birth_date=date(1985, 1, 1))
+        start = timezone.now() - timedelta(days=10)
+
+        def answer(participant, phase, hours, seed):
+            response = Response.objects.create(participant=participant, phase=phase, **make_answers(seed))
+            Response.objects.filter(id=response.id).update(timestamp=start + timedelta(hours=hours))
+            return response
+
+        self.pair1 = (answer(self.anna, 'before', 0, 1), answer(self.anna, 'after', 1, 2))
+        # Два 'before' подряд: в пару попадает только последний
+        answer(self.anna, 'before', 24, 3)
+        self.pair2 = (answer(self.anna, 'before', 25, 4), answer(self.anna, 'after', 26, 5))
+        # 'after' за пределами окна
+        answer(self.boris, 'before', 0, 6)
+        answer(self.boris, 'after', 30, 7)
+        self.pair3 = (answer(self.boris, 'before', 48, 8), answer(self.boris, 'after', 49, 9))
+
+    def test_pairs_in_single_pass(self):
+        with self.assertNumQueries(1):
+            pairs = pairing.load_pairs(Response.objects.all(), timedelta(hours=6))
+        expected = [self.pair1, self.pair2, self.pair3]
+        self.assertEqual(list(pairs.before_ids), [before.id for before, _ in expected])
+        self.assertEqual(list(pairs.after_ids), [after.id for _, after in expected])
+        for row, (before, after) in zip(pairs.deltas, expected):
+            scores = [scoring.compute_scores([getattr(r, f) for f in scoring.Q_FIELDS]) for r in (after, before)]
+            np.testing.assert_allclose(row, np.subtract(*scores))
+        self.assertEqual(len(pairing.load_pairs(Response.objects.all(), timedelta(hours=48))), 4)
+        self.assertEqual(len(pairing.load_pairs(Response.objects.none(), timedelta(hours=6))), 0)
+
+    def test_paired_tests_match_scipy(self):
+        from scipy import stats
+
+        rng = np.random.default_rng(0)
+        deltas = np.round(rng.normal(0.1, 1, size=(500, 4)), 1)
+        t, t_p = pairing.paired_t_test(deltas)
+        _, _, w_p = pairing.wilcoxon_test(deltas)
+        low, high = pairing.bootstrap_ci(deltas, resamples=500, chunk_elements=10000)
+        for col in range(4):
+            expected = stats.ttest_1samp(deltas[:, col], 0)
+            self.assertAlmostEqual(t[col], expected.statistic)
+            self.assertAlmostEqual(t_p[col], expected.pvalue)
+            self.assertAlmostEqual(w_p[col], stats.wilcoxon(deltas[:, col], method='approx',
+                                                            correction=False).pvalue)
+            self.assertLess(low[col], deltas[:, col].mean())
+            self.assertGreater(high[col], deltas[:, col].mean())
+
+    def test_report_shows_pairs(self):
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        with override_settings(REPORT_JOBS_ENABLED=False, PAIRING_BOOTSTRAP_RESAMPLES_INTERACTIVE=50), \
+                mock.patch('san_app.pairing.bootstrap_ci', wraps=pairing.bootstrap_ci) as bootstrap:
+            response = self.client.get(reverse('report'), {'gender': 'F'})
+        self.assertContains(response, 'p (Уилкоксон)')
+        # Без фонового задания - укороченный бутстреп
+        self.assertEqual(bootstrap.call_args.kwargs['resamples'], 50)
+
+
+class ResponsesListPaginationTests(TestCase):
+    def setUp(self):
+        participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        for seed in range(25):
+            Response.objects.create(participant=participant, phase='before' if seed % 2 else 'after',
+                                    **make_answers(seed))
+        # Одинаковое время у части ответов: порядок должен определяться id
+        Response.objects.filter(id__in=Response.objects.order_by('id').values('id')[:10]).update(
+            timestamp=timezone.now() - timedelta(days=1))
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+
+    def test_cursor_walks_all_rows_once(self):
+        expected = list(Response.objects.order_by('-timestamp', '-id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            page = keyset_page(Response.objects.all(), cursor, size=7)
+            seen += [response.id for response in page.items]
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(keyset_page(Response.objects.all(), 'broken', size=7).items), 7)
+
+    def test_later_pages_cost_the_same(self):
+        url = reverse('responses_list')
+        with CaptureQueriesContext(connection) as first:
+            response = self.client.get(url, {'size': 5})
+        self.assertContains(response, 'Показать еще')
+        cursor = keyset_page(Response.objects.all(), None, size=20).next_cursor
+        with CaptureQueriesContext(connection) as later:
+            self.client.get(url, {'size': 5, 'cursor': cursor})
+        self.assertEqual(len(first), len(later))
+
+    def test_fragment_with_filters(self):
+        response = self.client.get(reverse('responses_list'), {'phase': 'before', 'size': 5, 'fragment': 1})
+        self.assertNotContains(response, '<html')
+        self.assertEqual(response.content.decode().count('<tr>'), 5)
+        self.assertNotContains(response, 'После')
+        self.assertIn('phase=before', response['X-Next-Url'])
+        last = self.client.get(reverse('responses_list'),
+                               {'phase': 'before', 'size': 20, 'fragment': 1, 'cursor': response['X-Next-Cursor']})
+        self.assertEqual(last.content.decode().count('<tr>'), 7)
+        self.assertFalse(last.has_header('X-Next-Cursor'))
+
+
+class ParticipantsListTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+
+    def add_participants(self, count, start=0):
+        for num in range(start, start + count):
+            user = User.objects.create_user(f'user{num}', password='secret')
+            participant = Participant.objects.create(user=user, name=f'Участник {num}', gender='F',
+                                                     birth_date=date(1990, 1, 1))
+            for seed in range(2):
+                Response.objects.create(participant=participant, phase='before' if seed else 'after',
+                                        **make_answers(num * 10 + seed))
+
+    def test_query_count_does_not_grow(self):
+        self.add_participants(3)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('participants_list'))
+        self.add_participants(30, start=3)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('participants_list'))
+        self.assertEqual(len(few), len(many))
+
+        latest = Response.objects.filter(participant__name='Участник 32').order_by('-timestamp', '-id').first()
+        row = next(p for p in response.context['page'].object_list if p.name == 'Участник 32')
+        self.assertEqual(row.responses_count, 2)
+        self.assertEqual(row.last_timestamp, latest.timestamp)
+        self.assertEqual(row.last_phase, latest.phase)
+        self.assertAlmostEqual(row.last_overall, latest.overall_score)
+
+    @override_settings(PARTICIPANTS_PAGE_SIZE=10)
+    def test_search_and_pages(self):
+        self.add_participants(25)
+        response = self.client.get(reverse('participants_list'), {'page': 3})
+        self.assertEqual(len(response.context['page'].object_list), 5)
+        response = self.client.get(reverse('participants_list'), {'q': 'user1'})
+        # user1, user10..user19
+        self.assertEqual(response.context['page'].paginator.count, 11)
+        self.assertContains(response, 'q=user1&amp;page=2')
+        response = self.client.get(reverse('participants_list'), {'q': 'Участник 7'})
+        self.assertEqual([p.name for p in response.context['page'].object_list], ['Участник 7'])
+
+
+class DashboardCacheTests(TestCase):
+    def setUp(self):
+        dashboard.invalidate()
+        self.participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        Participant.objects.create(name='Петрова П.П.', gender='F', birth_date=date(1992, 1, 1))
+        for seed in range(3):
+            Response.objects.create(participant=self.participant, phase='before' if seed else 'after',
+                                    **make_answers(seed))
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(1):
+            counts = rollups.dashboard_counts()
+        self.assertEqual(counts, {'participants': 2, 'total': 3, 'before': 2, 'after': 1})
+        Participant.objects.all().delete()
+        self.assertEqual(rollups.dashboard_counts(), {'participants': 0, 'total': 0, 'before': 0, 'after': 0})
+
+    def test_cached_until_data_changes(self):
+        url = reverse('admin_dashboard')
+        self.client.get(url)
+        hits = dashboard.stats.hits
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(url)
+        self.assertEqual(dashboard.stats.hits, hits + 1)
+        # Остаются только запросы сессии и пользователя
+        self.assertFalse(any('san_app_' in query['sql'] for query in cached.captured_queries))
+        self.assertEqual(response.context['total_responses'], 3)
+        self.assertContains(response, 'попаданий')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Response.objects.create(participant=self.participant, phase='after', **make_answers(5))
+        response = self.client.get(url)
+        self.assertEqual(response.context['total_responses'], 4)
+        self.assertEqual(response.context['responses_after'], 2)
+        self.assertEqual(len(response.context['recent_responses']), 4)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        self.ivan = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        self.olga = Participant.objects.create(name='Ольга О.О.', gender='F', birth_date=date(1985, 3, 2))
+        for seed in range(7):
+            Response.objects.create(participant=self.ivan if seed % 2 else self.olga,
+                                    phase='before' if seed % 3 else 'after', **make_answers(seed))
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+
+    def test_csv_streams_in_chunks(self):
+        chunks = list(export.stream_csv(Response.objects.all(), chunk_size=3))
+        # Заголовок и по куску на каждую порцию из 3 строк
+        self.assertEqual(len(chunks), 4)
+        rows = list(csv.reader(StringIO(b''.join(chunks).decode('utf-8-sig'))))
+        self.assertEqual(rows[0], list(export.EXPORT_COLUMNS))
+        first = Response.objects.order_by('timestamp', 'id').first()
+        expected = scoring.compute_scores([getattr(first, field) for field in scoring.Q_FIELDS])
+        self.assertEqual(rows[1][0], str(first.id))
+        self.assertEqual([float(value) for value in rows[1][-4:]], list(expected))
+
+    def test_web_export_uses_report_filters(self):
+        response = self.client.get(reverse('export_responses', args=['csv']), {'gender': 'F', 'phase': 'before'})
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))[1:]
+        expected = Response.objects.filter(participant=self.olga, phase='before').count()
+        self.assertEqual(len(rows), expected)
+        self.assertTrue(all(row[3] == 'F' and row[5] == 'before' for row in rows))
+
+    @skipIf(export.missing_dependency('parquet') or export.missing_dependency('xlsx'),
+            "нужны pyarrow и openpyxl")
+    def test_binary_formats(self):
+        import pyarrow.parquet as pq
+        from openpyxl import load_workbook
+
+        data = b''.join(self.client.get(reverse('export_responses', args=['parquet'])).streaming_content)
+        table = pq.read_table(BytesIO(data))
+        self.assertEqual(table.num_rows, 7)
+        self.assertEqual(table.column_names, list(export.EXPORT_COLUMNS))
+
+        data = b''.join(self.client.get(reverse('export_responses', args=['xlsx'])).streaming_content)
+        sheet = load_workbook(BytesIO(data), read_only=True).active
+        self.assertEqual(sum(1 for _ in sheet.iter_rows()), 8)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_responses', gender='M', stdout=out)
+        rows = list(csv.reader(StringIO(out.getvalue().lstrip('\ufeff'))))
+        self.assertEqual(len(rows) - 1, self.ivan.responses.count())
+
+
+class ImportTests(TestCase):
+    def make_csv(self, rows):
+        out = StringIO()
+        writer = csv.DictWriter(out, fieldnames=importer.REQUIRED_COLUMNS + ['timestamp'])
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+
+    def row(self, seed, name='Иванов И.И.', **overrides):
+        row = {'participant': name, 'gender': 'M', 'birth_date': '01.05.1990', 'phase': 'до',
+               'timestamp': '2020-03-01T10:00:00+00:00', **make_answers(seed)}
+        row.update(overrides)
+        return row
+
+    def test_batches_errors_and_rollups(self):
+        existing = Participant.objects.create(name='Петрова П.П.', gender='F', birth_date=date(1985, 1, 2))
+        rows = [self.row(seed) for seed in range(5)]
+        rows += [self.row(5, name='Петрова П.П.', gender='Ж', birth_date='1985-01-02', phase='после')]
+        rows += [self.row(6, q3='4'), self.row(7, q5=''), self.row(8, phase='?'), self.row(9, birth_date='x')]
+        errors = StringIO()
+        result = importer.ResponseImporter(batch_size=3, errors=errors).run(
+            importer.read_csv(StringIO(self.make_csv(rows))))
+
+        self.assertEqual((result.rows, result.imported, result.failed, result.participants_created), (10, 6, 4, 1))
+        self.assertGreater(result.rows_per_second, 0)
+        error_rows = list(csv.reader(StringIO(errors.getvalue())))[1:]
+        self.assertEqual([row[0] for row in error_rows], ['8', '9', '10', '11'])
+        self.assertIn('q3', error_rows[0][1])
+
+        self.assertEqual(Participant.objects.count(), 2)
+        self.assertEqual(existing.responses.get().phase, 'after')
+        response = Response.objects.filter(participant__name='Иванов И.И.').order_by('id').first()
+        self.assertEqual(response.timestamp.year, 2020)
+        expected = scoring.compute_scores([getattr(response, field) for field in scoring.Q_FIELDS])
+        self.assertEqual((response.wellbeing_score, response.activity_score, response.mood_score,
+                          response.overall_score), expected)
+
+        imported = {(r.gender, r.phase, r.day): r.count for r in ScoreRollup.objects.all()}
+        rollups.rebuild()
+        self.assertEqual(imported, {(r.gender, r.phase, r.day): r.count for r in ScoreRollup.objects.all()})
+
+    def test_missing_columns(self):
+        with self.assertRaises(importer.ImportFormatError):
+            importer.ResponseImporter().run(importer.read_csv(StringIO('participant,gender\nИванов,M\n')))
+
+    def test_export_round_trip_via_command(self):
+        participant = Participant.objects.create(name='Сидоров С.С.', gender='M', birth_date=date(1970, 7, 7))
+        for seed in range(4):
+            Response.objects.create(participant=participant, phase='before', **make_answers(seed))
+        data = b''.join(export.stream_csv(Response.objects.all()))
+        Response.objects.all().delete()
+
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'forms.csv')
+        with open(path, 'wb') as file:
+            file.write(data)
+        out = StringIO()
+        call_command('import_responses', path, stdout=out)
+        self.assertIn('строк/с', out.getvalue())
+        self.assertEqual(participant.responses.count(), 4)
+        self.assertEqual(Participant.objects.count(), 1)
+        self.assertFalse(os.path.exists(path + '.errors.csv'))
+
+    def test_upload_view(self):
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        upload = SimpleUploadedFile('forms.csv', self.make_csv([self.row(1), self.row(2, q1='9')]).encode())
+        with override_settings(IMPORT_ERRORS_DIR=self.enterContext(tempfile.TemporaryDirectory())):
+            response = self.client.post(reverse('import_responses'), {'file': upload})
+            self.assertEqual(response.context['result'].imported, 1)
+            errors = self.client.get(reverse('import_errors', args=[response.context['errors_name']]))
+            self.assertIn('q1', b''.join(errors.streaming_content).decode())
+
+
+    def test_bad_files_are_format_errors(self):
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+        errors_dir = self.enterContext(tempfile.TemporaryDirectory())
+        uploads = [SimpleUploadedFile('forms.csv', self.make_csv([self.row(1)]).encode('cp1251')),
+                   SimpleUploadedFile('forms.xlsx', b'PK\x03\x04 not a workbook')]
+        with override_settings(IMPORT_ERRORS_DIR=errors_dir):
+            for upload in uploads:
+                response = self.client.post(reverse('import_responses'), {'file': upload})
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['form'].errors['file'])
+        self.assertEqual(os.listdir(errors_dir), [])
+        self.assertFalse(Response.objects.exists())
+
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'forms.xlsx')
+        with open(path, 'wb') as file:
+            file.write(b'not a workbook')
+        with self.assertRaises(CommandError):
+            call_command('import_responses', path, stdout=StringIO())
+        self.assertFalse(os.path.exists(path + '.errors.csv'))
+
+    def test_decode_error_reports_imported_rows(self):
+        # Строка в cp1251 после нескольких уже записанных партий
+        data = self.make_csv([self.row(seed) for seed in range(300)]).encode()
+        data += self.make_csv([self.row(1)]).split('\n', 1)[1].encode('cp1251')
+        with self.assertRaisesMessage(importer.ImportFormatError, 'импортированных до ошибки: 250'):
+            importer.ResponseImporter(batch_size=50).run(importer.read_csv(BytesIO(data)))
+        self.assertEqual(Response.objects.count(), 250)
+
+
+class GroupSessionTests(TestCase):
+    def setUp(self):
+        self.participants = [
+            Participant.objects.create(name=f'Участник {num}', gender='MF'[num % 2], birth_date=date(1990, 1, 1))
+            for num in range(25)
+        ]
+        admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(admin)
+
+    def post_data(self, rows, total=30):
+        data = {'phase': 'after', 'form-TOTAL_FORMS': str(total), 'form-INITIAL_FORMS': '0',
+                'form-MIN_NUM_FORMS': '0', 'form-MAX_NUM_FORMS': '60'}
+        for index, (participant, answers) in enumerate(rows):
+            data[f'form-{index}-participant'] = str(participant.id)
+            for field, value in answers.items():
+                data[f'form-{index}-{field}'] = str(value)
+        return data
+
+    def test_whole_group_in_one_insert(self):
+        rows = [(participant, make_answers(num)) for num, participant in enumerate(self.participants)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('group_session'), self.post_data(rows))
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "san_app_response"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(response.context['results']), 25)
+        self.assertEqual(Response.objects.filter(phase='after').count(), 25)
+
+        saved = Response.objects.get(participant=self.participants[3])
+        expected = scoring.compute_scores([getattr(saved, field) for field in scoring.Q_FIELDS])
+        self.assertAlmostEqual(saved.overall_score, expected[3])
+        self.assertEqual(rollups.phase_counts(), {'total': 25, 'before': 0, 'after': 25})
+
+    def test_invalid_rows_save_nothing(self):
+        bad = dict(make_answers(1), q7=5)
+        rows = [(self.participants[0], make_answers(0)), (self.participants[1], bad),
+                (self.participants[0], make_answers(2))]
+        response = self.client.post(reverse('group_session'), self.post_data(rows))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['formset'].errors[1])
+        self.assertFalse(Response.objects.exists())
+
+        rows = [(self.participants[0], make_answers(0)), (self.participants[0], make_answers(2))]
+        response = self.client.post(reverse('group_session'), self.post_data(rows))
+        self.assertTrue(response.context['formset'].non_form_errors())
+        self.assertFalse(Response.objects.exists())
+
+    def test_blank_form_renders_with_few_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('group_session'), {'rows': 40})
+        self.assertEqual(response.context['formset'].total_form_count(), 40)
+        self.assertLess(len(queries), 5)
+
+
+class WriteBufferTests(TransactionTestCase):
+    def setUp(self):
+        self.participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        self.buffer = WriteBuffer(interval_ms=50, max_rows=4)
+        self.addCleanup(self.buffer.stop, 5)
+
+    def test_batches_and_flush(self):
+        for seed in range(10):
+            response = Response(participant=self.participant, phase='before', **make_answers(seed))
+            response.compute_scores()
+            self.buffer.submit(response, 'M')
+        self.assertTrue(self.buffer.flush(timeout=10))
+        self.assertEqual(Response.objects.count(), 10)
+        stats = self.buffer.stats()
+        self.assertEqual((stats['queue_depth'], stats['flushed_rows'], stats['failed_rows']), (0, 10, 0))
+        # Не больше max_rows строк в пачке
+        self.assertGreaterEqual(stats['batches'], 3)
+        self.assertEqual(rollups.phase_counts()['before'], 10)
+
+    def test_stop_writes_pending(self):
+        response = Response(participant=self.participant, phase='after', **make_answers(1))
+        response.compute_scores()
+        self.buffer.submit(response, 'M')
+        self.buffer.stop(5)
+        self.assertEqual(Response.objects.filter(phase='after').count(), 1)
+
+    def test_failed_batch_is_spilled_and_replayed(self):
+        spill = os.path.join(tempfile.mkdtemp(), 'spill.jsonl')
+        buffer = WriteBuffer(interval_ms=10, max_rows=4, retries=2, spill_path=spill)
+        self.addCleanup(buffer.stop, 5)
+        responses = []
+        for seed in range(3):
+            response = Response(participant=self.participant, phase='after', client_key=uuid.uuid4(),
+                                **make_answers(seed))
+            response.compute_scores()
+            responses.append(response)
+        with mock.patch('san_app.write_buffer.bulk_create_responses',
+                        side_effect=OperationalError('database is locked')), \
+                self.assertLogs('san_app.write_buffer', 'ERROR') as logs:
+            for response in responses:
+                buffer.submit(response, 'M')
+            self.assertTrue(buffer.flush(timeout=10))
+        self.assertEqual(buffer.stats()['failed_rows'], 3)
+        self.assertFalse(Response.objects.exists())
+        # Каждый незаписанный ответ - в логе
+        self.assertEqual(sum('Ответ не записан' in line for line in logs.output), 3)
+        # и в метриках Prometheus, чтобы на рост незаписанных можно было настроить оповещение
+        with mock.patch('san_app.write_buffer._buffer', buffer):
+            text = metrics.registry.render()
+        self.assertIn('# TYPE san_write_buffer_failed_rows_total counter', text)
+        self.assertIn('san_write_buffer_failed_rows_total 3\n', text)
+        self.assertIn('san_write_buffer_spill_rows 3\n', text)
+        self.assertIn('san_write_buffer_queue_depth 0\n', text)
+
+        out = StringIO()
+        with override_settings(SURVEY_WRITE_BUFFER_SPILL=spill), self.assertLogs('san_app.write_buffer', 'INFO'):
+            call_command('replay_survey_spill', stdout=out)
+            self.assertIn('Записано ответов: 3', out.getvalue())
+            self.assertFalse(os.path.exists(spill))
+            self.assertEqual(set(Response.objects.values_list('client_key', flat=True)),
+                             {response.client_key for response in responses})
+            self.assertEqual(Response.objects.get(client_key=responses[0].client_key).overall_score,
+                             responses[0].overall_score)
+            self.assertEqual(rollups.phase_counts()['after'], 3)
+
+    def test_take_survey_returns_scores_before_write(self):
+        user = User.objects.create_user('ivan', password='secret')
+        self.participant.user = user
+        self.participant.save()
+        self.client.force_login(user)
+        answers = make_answers(3)
+        with override_settings(SURVEY_WRITE_BUFFER=True), \
+                mock.patch('san_app.write_buffer.get_buffer', return_value=self.buffer):
+            page = self.client.post(reverse('take_survey', args=[self.participant.id]),
+                                    {'phase': 'before', **answers})
+        expected = scoring.compute_scores([answers[field] for field in scoring.Q_FIELDS])
+        self.assertAlmostEqual(page.context['overall'], expected[3])
+        self.assertTrue(self.buffer.flush(timeout=10))
+        self.assertEqual(self.participant.responses.get().overall_score, expected[3])
+
+
+class SurveySyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('ivan', password='secret')
+        self.participant = Participant.objects.create(user=self.user, name='Иванов И.И.', gender='M',
+                                                      birth_date=date(1990, 5, 1))
+        self.other = Participant.objects.create(name='Чужой Ч.Ч.', gender='F', birth_date=date(1991, 1, 1))
+        self.client.force_login(self.user)
+
+    def item(self, seed, participant=None, **overrides):
+        return {'client_key': str(uuid.UUID(int=seed + 1)), 'participant': (participant or self.participant).id,
+                'phase': 'before', 'submitted_at': '2024-05-01T10:00:00Z', **make_answers(seed), **overrides}
+
+    def sync(self, items):
+        return self.client.post(reverse('survey_sync'), json.dumps({'responses': items}),
+                                content_type='application/json').json()['results']
+
+    @override_settings(SURVEY_SYNC_MAX_BATCH=7)
+    def test_page_scopes_queue_to_user_and_batch_limit(self):
+        page = self.client.get(reverse('take_survey', args=[self.participant.id]))
+        self.assertContains(page, f'data-user="{self.user.id}"')
+        self.assertContains(page, 'data-sync-batch="7"')
+        self.assertContains(page, "'san-survey-queue-' + form.dataset.user")
+        # Отклоненные бланки не отправляются повторно; повтор - только с растущей паузой
+        self.assertContains(page, "'san-survey-rejected-' + form.dataset.user")
+        self.assertContains(page, 'scheduleRetry()')
+        self.assertNotContains(page, 'setInterval')
+
+    def test_batch_is_idempotent(self):
+        items = [self.item(seed) for seed in range(5)]
+        results = self.sync(items)
+        self.assertEqual([result['status'] for result in results], ['created'] * 5)
+        saved = Response.objects.get(client_key=items[2]['client_key'])
+        self.assertEqual(saved.timestamp.year, 2024)
+        self.assertAlmostEqual(results[2]['scores']['overall'], saved.overall_score)
+
+        # Повтор после обрыва связи вместе с новым бланком и дублем внутри пачки
+        with CaptureQueriesContext(connection) as queries:
+            results = self.sync(items + [self.item(9), self.item(9)])
+        self.assertEqual([result['status'] for result in results], ['duplicate'] * 5 + ['created', 'duplicate'])
+        self.assertEqual(results[0]['scores'], self.sync([items[0]])[0]['scores'])
+        self.assertEqual(Response.objects.count(), 6)
+        self.assertEqual(rollups.phase_counts()['before'], 6)
+        self.assertLess(len(queries), 15)
+
+    def test_invalid_and_foreign_items(self):
+        results = self.sync([self.item(1, q4=7), self.item(2, participant=self.other), self.item(3)])
+        self.assertEqual([result['status'] for result in results], ['invalid', 'forbidden', 'created'])
+        self.assertIn('q4', results[0]['errors'])
+        bad = self.client.post(reverse('survey_sync'), 'not json', content_type='application/json')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_form_resubmit_does_not_duplicate(self):
+        data = {'phase': 'after', 'client_key': str(uuid.uuid4()), **make_answers(4)}
+        url = reverse('take_survey', args=[self.participant.id])
+        first = self.client.post(url, data)
+        second = self.client.post(url, data)
+        self.assertEqual(self.participant.responses.count(), 1)
+        self.assertEqual(first.context['overall'], second.context['overall'])
+
+
+    def test_concurrent_resubmit_returns_saved_response(self):
+        # Второй из двух одновременных повторов прошел проверку ключа до записи первого
+        key = uuid.uuid4()
+        saved = Response.objects.create(participant=self.participant, phase='after', client_key=key,
+                                        **make_answers(4))
+        again = Response(participant=self.participant, phase='after', client_key=key, **make_answers(4))
+        self.assertEqual(views._save_survey_response(again).pk, saved.pk)
+        foreign = Response(participant=self.other, phase='after', client_key=key, **make_answers(5))
+        foreign = views._save_survey_response(foreign)
+        self.assertIsNone(foreign.client_key)
+        self.assertEqual(Response.objects.count(), 2)
+
+    def test_foreign_key_does_not_leak_scores(self):
+        taken = Response.objects.create(participant=self.other, phase='before', client_key=uuid.UUID(int=2),
+                                        **make_answers(1))
+        results = self.sync([self.item(1), self.item(7, client_key=str(uuid.UUID(int=8)))])
+        self.assertEqual(results[0], {'client_key': str(taken.client_key), 'status': 'forbidden'})
+        self.assertEqual(results[1]['status'], 'created')
+        # Один ключ в пачке у двух участников: второй бланк не получает баллы первого
+        self.user.is_staff = True
+        self.user.save()
+        results = self.sync([self.item(20), self.item(21, participant=self.other, client_key=str(uuid.UUID(int=21)))])
+        self.assertEqual([result['status'] for result in results], ['created', 'forbidden'])
+
+
+def async_request(method, path, user, data=None):
+    """Запрос для асинхронной view без middleware: пользователь подставляется как после AuthenticationMiddleware"""
+    request = getattr(AsyncRequestFactory(), method)(path, data or {})
+    request.user = user
+
+    async def auser():
+        return user
+
+    request.auser = auser
+    return request
+
+
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.user = User.objects.create_user('ivan', password='secret')
+        self.participant = Participant.objects.create(user=self.user, name='Иванов И.И.', gender='M',
+                                                      birth_date=date(1990, 5, 1))
+        for seed in range(6):
+            Response.objects.create(participant=self.participant, phase='before' if seed % 2 else 'after',
+                                    **make_answers(seed))
+        dashboard.invalidate()
+
+    async def test_dashboard_and_lists(self):
+        response = await async_views.admin_dashboard(async_request('get', '/admin-dashboard/', self.admin))
+        self.assertContains(response, 'Иванов И.И.')
+        self.assertEqual(await rollups.adashboard_counts(), await sync_to_async(rollups.dashboard_counts)())
+
+        response = await async_views.participants_list(async_request('get', '/participants/', self.admin, {'q': 'ivan'}))
+        self.assertContains(response, 'Иванов И.И.')
+
+        request = async_request('get', '/responses/', self.admin, {'size': 4, 'fragment': 1})
+        response = await async_views.responses_list(request)
+        self.assertEqual(response.content.decode().count('<tr>'), 4)
+        first = await sync_to_async(keyset_page)(Response.objects.all(), None, size=4)
+        self.assertEqual(response['X-Next-Cursor'], first.next_cursor)
+        page = await akeyset_page(Response.objects.all(), response['X-Next-Cursor'], size=4)
+        self.assertEqual(len(page.items), 2)
+        self.assertFalse(page.has_next)
+
+        # Не администратор перенаправляется на вход
+        response = await async_views.admin_dashboard(async_request('get', '/admin-dashboard/', self.user))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_take_survey_and_profile(self):
+        key = str(uuid.uuid4())
+        data = {'phase': 'before', 'client_key': key, **make_answers(42)}
+        for _ in range(2):
+            response = await async_views.take_survey(
+                async_request('post', '/survey/', self.user, data), participant_id=self.participant.id)
+            self.assertEqual(response.status_code, 200)
+        saved = await Response.objects.aget(client_key=key)
+        self.assertAlmostEqual(saved.overall_score, scoring.compute_scores(list(make_answers(42).values()))[3])
+        self.assertEqual(await Response.objects.acount(), 7)
+
+        stranger = await User.objects.acreate_user('petr', password='secret')
+        response = await async_views.take_survey(
+            async_request('get', '/survey/', stranger), participant_id=self.participant.id)
+        self.assertEqual(response.status_code, 403)
+        # Первый вход: профиль создает участника
+        response = await async_views.profile(async_request('get', '/profile/', stranger))
+        self.assertContains(response, 'petr')
+        self.assertTrue(await Participant.objects.filter(user=stranger).aexists())
+
+
+class AsyncReportTests(TransactionTestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        for seed in range(4):
+            Response.objects.create(participant=participant, phase='before' if seed % 2 else 'after',
+                                    **make_answers(seed))
+
+    @override_settings(REPORT_JOBS_ENABLED=False)
+    async def test_report_is_built_in_executor(self):
+        threads, original = [], views.report_page
+
+        def report_page(request):
+            threads.append(threading.current_thread().name)
+            return original(request)
+
+        with mock.patch.object(views, 'report_page', report_page):
+            response = await async_views.report(async_request('get', '/report/', self.admin))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'report/chart/')
+        self.assertTrue(threads[0].startswith('san-report'))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        for seed in range(3):
+            Response.objects.create(participant=participant, phase='before', **make_answers(seed))
+        self.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(self.admin)
+        metrics.registry.reset()
+
+    def sample(self, text, name):
+        line = next(line for line in text.splitlines() if line.startswith(name + ' '))
+        return float(line.split()[-1])
+
+    def test_request_metrics_exposed(self):
+        self.client.get(reverse('responses_list'))
+        self.client.get(reverse('responses_list'))
+        self.client.get(reverse('participants_list'))
+        response = self.client.get(reverse('metrics'))
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE san_http_request_duration_seconds histogram', text)
+        self.assertEqual(self.sample(text, 'san_http_request_duration_seconds_count{view="responses_list"}'), 2)
+        self.assertEqual(self.sample(text, 'san_http_requests_total{view="responses_list",status="200"}'), 2)
+        # Сессия, пользователь, COUNT и страница участников
+        self.assertEqual(self.sample(text, 'san_http_request_db_queries_sum{view="participants_list"}'), 4)
+        self.assertGreater(self.sample(text, 'san_http_request_template_seconds_total{view="participants_list"}'), 0)
+        self.assertGreater(self.sample(text, 'san_http_response_bytes_total{view="participants_list"}'), 1000)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create_user('ivan', password='secret'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_request_log_has_sql(self):
+        with self.assertLogs('san_app.metrics', 'WARNING') as logs:
+            self.client.get(reverse('responses_list'))
+        self.assertIn('responses_list', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        participant = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        Response.objects.create(participant=participant, phase='before', **make_answers(1))
+        self.admin = User.objects.create_user('admin', password='secret', is_staff=True)
+        self.client.force_login(self.admin)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILES_DIR=directory.name, PROFILES_KEEP=2)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_profile_saved_and_browsable(self):
+        response = self.client.get(reverse('participants_list'), {'profile': 1})
+        profile_id = response['X-Profile-Id']
+        meta = profiling.load_profile(profile_id)
+        self.assertEqual(meta['view'], 'participants_list')
+        self.assertEqual(meta['user'], 'admin')
+        self.assertEqual(meta['status'], 200)
+        self.assertGreater(meta['queries'], 0)
+
+        listing = self.client.get(reverse('profiles_list'))
+        self.assertContains(listing, reverse('profile_detail', args=[profile_id]))
+        detail = self.client.get(response['X-Profile-Url'], {'sort': 'tottime'})
+        self.assertContains(detail, 'participants_queryset')
+        download = self.client.get(reverse('profile_download', args=[profile_id]))
+        self.assertEqual(download.status_code, 200)
+
+    def test_store_is_bounded(self):
+        ids = [self.client.get(reverse('responses_list'), HTTP_X_PROFILE='1')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual([meta['id'] for meta in profiling.list_profiles()], ids[:0:-1])
+        self.assertEqual(self.client.get(reverse('profile_detail', args=[ids[0]])).status_code, 404)
+
+    def test_only_staff_can_profile(self):
+        self.client.force_login(User.objects.create_user('ivan', password='secret'))
+        response = self.client.get(reverse('profile'), {'profile': 1})
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(profiling.list_profiles(), [])
+
+
+class SyntheticDataTests(TestCase):
+    def seed(self, **kwargs):
+        return synthetic.seed(30, 6, until=date(2025, 1, 1), batch_size=60, **kwargs)
+
+    def test_seed_is_reproducible_and_keeps_rollups(self):
+        result = self.seed()
+        self.assertEqual((result.participants, result.responses), (30, 180))
+        self.assertEqual(Response.objects.count(), 180)
+        rows = lambda: list(Response.objects.order_by('id').values_list(*scoring.Q_FIELDS, 'phase', 'timestamp'))
+        first = rows()
+
+        stored = {(r.gender, r.phase, r.day): [getattr(r, field) for field in rollups.VALUE_FIELDS]
+                  for r in ScoreRollup.objects.all()}
+        expected = rollups.aggregate(Response.objects.all())
+        self.assertEqual(stored.keys(), expected.keys())
+        for key, values in expected.items():
+            for got, want in zip(stored[key], values):
+                self.assertAlmostEqual(got, want)
+
+        # Ответы настоящих участников очистка не трогает
+        real = Participant.objects.create(name='Иванов И.И.', gender='M', birth_date=date(1990, 5, 1))
+        Response.objects.create(participant=real, phase='before', **{field: 1 for field in scoring.Q_FIELDS})
+        self.assertEqual(synthetic.clear(), 30)
+        self.assertEqual(list(Response.objects.values_list('participant', flat=True)), [real.id])
+        self.assertEqual(ScoreRollup.objects.aggregate(n=Sum('count'))['n'], 1)
+        Response.objects.all().delete()
+        self.seed()
+        self.assertEqual(rows(), first)
+
+    def test_before_after_pattern(self):
+        self.seed()
+        pairs = pairing.load_pairs(Response.objects.all(), timedelta(hours=6))
+        self.assertEqual(len(pairs.before_ids), 90)
+        # После занятия все шкалы в среднем выше
+        self.assertTrue((pairs.deltas.mean(axis=0)[:3] > 0).all())
+        genders = set(Participant.objects.values_list('gender', flat=True))
+        self.assertEqual(genders, {'M', 'F'})
+
+    def test_command(self):
+        out = StringIO()
+        call_command('seed_data', '--participants', '5', '--responses', '4', '--until', '2025-01-01', stdout=out)
+        self.assertEqual(Response.objects.count(), 20)
+        call_command('seed_data', '--participants', '2', '--responses', '2', '--clear', stdout=out)
+        self.assertEqual(Participant.objects.count(), 2)
+
+
+class StartupImportTests(SimpleTestCase):
+    def test_workers_start_without_analytics_stack(self):
+        # Проверяется в чистом процессе: в процессе тестов numpy уже загружен
+        code = ("import sys, san.wsgi; from django.urls import get_resolver; get_resolver().url_patterns; "
+                "print(','.join(name for name in ('numpy', 'pandas', 'matplotlib') if name in sys.modules))")
+        result = subprocess.run([sys.executable, '-c', code], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                                check=True)
+        self.assertEqual(result.stdout.strip(), '')
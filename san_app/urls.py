@@ -1,20 +1,36 @@
-from django.urls import path
-from . import views
+from django.conf import settings
+from django.urls import path, re_path
+from . import async_views, views
 from django.contrib.auth import views as auth_views
 
+# Под ASGI опрос, профиль, панель, списки и отчет обслуживаются асинхронными версиями
+live = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     # Главная страница после входа - профиль или админ-панель
     path('', views.home, name='home'),
-    path('profile/', views.profile, name='profile'),
+    path('profile/', live.profile, name='profile'),
 
     # Админ-панель
-    path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
-    path('report/', views.report, name='report'),
-    path('participants/', views.participants_list, name='participants_list'),
-    path('responses/', views.responses_list, name='responses_list'),
+    path('admin-dashboard/', live.admin_dashboard, name='admin_dashboard'),
+    path('report/', live.report, name='report'),
+    path('report/jobs/<int:job_id>/', views.report_job_status, name='report_job_status'),
+    re_path(r'^report/chart/(?P<name>\w+)\.(?P<image_format>png|svg)$', live.report_chart, name='report_chart'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
+    path('profiles/', views.profiles_list, name='profiles_list'),
+    re_path(r'^profiles/(?P<name>[0-9a-f]{32})/$', views.profile_detail, name='profile_detail'),
+    re_path(r'^profiles/(?P<name>[0-9a-f]{32})\.prof$', views.profile_download, name='profile_download'),
+    path('participants/', live.participants_list, name='participants_list'),
+    path('responses/', live.responses_list, name='responses_list'),
+    re_path(r'^responses/export\.(?P<export_format>csv|xlsx|parquet)$', views.export_responses,
+            name='export_responses'),
+    path('responses/import/', views.import_responses, name='import_responses'),
+    re_path(r'^responses/import/errors/(?P<name>[0-9a-f]{32})/$', views.import_errors, name='import_errors'),
 
     # Прохождение опроса
-    path('survey/<int:participant_id>/', views.take_survey, name='take_survey'),
+    path('session/', views.group_session, name='group_session'),
+    path('survey/<int:participant_id>/', live.take_survey, name='take_survey'),
+    path('survey/sync/', views.survey_sync, name='survey_sync'),
 
     # Аутентификация
     path('register/', views.register, name='register'),
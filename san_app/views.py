@@ -1,21 +1,31 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
-from .forms import ParticipantForm, ResponseForm
-from .models import Participant, Response
-import pandas as pd
-import matplotlib
-
-matplotlib.use('Agg')  # Используем non-GUI backend
-import matplotlib.pyplot as plt
-from io import BytesIO
-import base64
-import seaborn as sns
-from datetime import datetime
+from .bulk import bulk_create_responses
+from .forms import (GroupResponseFormSet, GroupSessionForm, ImportUploadForm, ParticipantForm,
+                    ReportFilterForm, ResponseForm)
+from .models import Participant, ReportJob, Response
+from .report_cache import data_state, data_version, report_cache
+from . import dashboard, export, jobs, metrics, profiling, scoring, sync, write_buffer
+from .jobs import CHART_CONTENT_TYPES
+from .pagination import keyset_page
+import hashlib
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
 from django.contrib.auth import login, logout
 from .forms import CustomUserCreationForm
 from django.contrib.auth.views import LoginView as AuthLoginView
-from django.http import HttpResponseForbidden
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST
 from django.contrib import messages
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import IntegrityError
+from django.db.models import Count, OuterRef, Q, Subquery
 
 QUESTIONS = [
     {"num": 1, "left": "Самочувствие хорошее", "right": "Самочувствие плохое"},
@@ -67,51 +77,208 @@ def home(request):
 @login_required
 @user_passes_test(is_admin)
 def admin_dashboard(request):
-    """Главная панель администратора"""
-    total_participants = Participant.objects.count()
-    total_responses = Response.objects.count()
-    responses_before = Response.objects.filter(phase='before').count()
-    responses_after = Response.objects.filter(phase='after').count()
-
-    # Последние 10 ответов
-    recent_responses = Response.objects.select_related('participant').order_by('-timestamp')[:10]
-
-    context = {
-        'total_participants': total_participants,
-        'total_responses': total_responses,
-        'responses_before': responses_before,
-        'responses_after': responses_after,
-        'recent_responses': recent_responses,
+    """Главная панель администратора
+
+    Счетчики и последние ответы берутся из кэша; при промахе счетчики
+    считаются одним запросом к участникам и сводной таблице ScoreRollup.
+    """
+    return render(request, 'admin_dashboard.html', dashboard_context(dashboard.dashboard_data()))
+
+
+def dashboard_context(data):
+    """Контекст шаблона панели из данных dashboard_data()"""
+    counts = data['counts']
+    return {
+        'total_participants': counts['participants'],
+        'total_responses': counts['total'],
+        'responses_before': counts['before'],
+        'responses_after': counts['after'],
+        'recent_responses': data['recent_responses'],
+        'cache_stats': dashboard.stats,
+        'write_buffer': write_buffer.buffer_stats(),
     }
 
-    return render(request, 'admin_dashboard.html', context)
-
 
 @login_required
 @user_passes_test(is_admin)
 def participants_list(request):
-    """Список всех участников"""
-    participants = Participant.objects.all().order_by('-id')
-
-    # Добавляем статистику по каждому участнику
-    participants_data = []
-    for p in participants:
-        participants_data.append({
-            'participant': p,
-            'responses_count': p.responses.count(),
-            'last_response': p.responses.order_by('-timestamp').first(),
-        })
-
-    return render(request, 'participants_list.html', {'participants_data': participants_data})
+    """Список участников с поиском и постраничным выводом
+
+    Число ответов и данные последнего ответа добавляются в тот же запрос
+    (Count и подзапросы), поэтому число запросов не зависит от числа участников.
+    """
+    query = request.GET.get('q', '').strip()
+    page = Paginator(participants_queryset(query), settings.PARTICIPANTS_PAGE_SIZE).get_page(request.GET.get('page'))
+    return render(request, 'participants_list.html', {'page': page, 'query': query})
+
+
+def participants_queryset(query=''):
+    """Участники с числом ответов и данными последнего ответа, с поиском по имени и логину"""
+    latest = Response.objects.filter(participant=OuterRef('pk')).order_by('-timestamp', '-id')
+    participants = (
+        Participant.objects.select_related('user')
+        .annotate(
+            responses_count=Count('responses'),
+            last_timestamp=Subquery(latest.values('timestamp')[:1]),
+            last_phase=Subquery(latest.values('phase')[:1]),
+            last_overall=Subquery(latest.values('overall_score')[:1]),
+        )
+        .order_by('-id')
+    )
+    if query:
+        participants = participants.filter(Q(name__icontains=query) | Q(user__username__icontains=query))
+    return participants
 
 
 @login_required
 @user_passes_test(is_admin)
 def responses_list(request):
-    """Список всех ответов"""
-    responses = Response.objects.select_related('participant').order_by('-timestamp')
+    """Список ответов постранично, от новых к старым
+
+    Страницы выбираются по курсору (timestamp, id), фильтры - те же, что у
+    отчета. С параметром fragment=1 возвращаются только строки таблицы для
+    кнопки «Показать еще», курсор следующей страницы - в заголовке X-Next-Cursor.
+    """
+    filter_form = ReportFilterForm(request.GET)
+    responses = filter_form.filter_responses(Response.objects.select_related('participant'))
+    page = keyset_page(responses, request.GET.get('cursor'), _page_size(request))
+    return responses_page_response(request, filter_form, page)
+
+
+def responses_page_response(request, filter_form, page):
+    """Страница списка ответов или только строки таблицы (fragment=1) для готовой KeysetPage"""
+    next_url = None
+    if page.has_next:
+        params = request.GET.copy()
+        params['cursor'] = page.next_cursor
+        params.pop('fragment', None)
+        next_url = f"{reverse('responses_list')}?{params.urlencode()}"
+
+    context = {'filter_form': filter_form, 'page': page, 'next_url': next_url}
+    if request.GET.get('fragment'):
+        response = render(request, 'responses_rows.html', context)
+        if page.has_next:
+            response['X-Next-Cursor'] = page.next_cursor
+            response['X-Next-Url'] = next_url
+        return response
+    return render(request, 'responses_list.html', context)
 
-    return render(request, 'responses_list.html', {'responses': responses})
+
+@login_required
+@user_passes_test(is_admin)
+def export_responses(request, export_format):
+    """Выгрузка ответов с баллами в CSV, XLSX или Parquet (с фильтрами отчета)"""
+    missing = export.missing_dependency(export_format)
+    if missing:
+        raise Http404(f"Формат недоступен: не установлен пакет {missing}")
+
+    filter_form = ReportFilterForm(request.GET)
+    responses = filter_form.filter_responses(Response.objects.all())
+    content_type, stream, _ = export.EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(stream(responses, settings.EXPORT_CHUNK_SIZE), content_type=content_type)
+    filename = f"san_responses_{timezone.localdate():%Y%m%d}.{export_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@user_passes_test(is_admin)
+def group_session(request):
+    """Групповой ввод бланков занятия: все бланки проверяются и сохраняются одним запросом
+
+    Формсет проверяется за один проход, ответы записываются одним bulk_create
+    в одной транзакции, баллы всех участников возвращаются одной страницей.
+    """
+    participants = list(Participant.objects.order_by('name').values_list('id', 'name', 'gender'))
+    choices = [(pk, name) for pk, name, _ in participants]
+    genders = {pk: gender for pk, _, gender in participants}
+    names = dict(choices)
+
+    session_form = GroupSessionForm(request.POST or None)
+    if request.method == 'POST':
+        formset = GroupResponseFormSet(request.POST, form_kwargs={'participant_choices': choices})
+        if session_form.is_valid() and formset.is_valid():
+            phase = session_form.cleaned_data['phase']
+            filled = [form.cleaned_data for form in formset if form.cleaned_data.get('participant')]
+            responses = [
+                Response(participant_id=data['participant'], phase=phase,
+                         **{field: data[field] for field in scoring.Q_FIELDS})
+                for data in filled
+            ]
+            bulk_create_responses(responses, [genders[response.participant_id] for response in responses])
+            results = [{'name': names[response.participant_id], 'response': response} for response in responses]
+            return render(request, 'group_session.html', {
+                'session_form': GroupSessionForm(initial={'phase': phase}),
+                'formset': _empty_group_formset(choices, len(responses)),
+                'results': results,
+                'questions': QUESTIONS,
+            })
+    else:
+        try:
+            rows = int(request.GET.get('rows', settings.GROUP_SESSION_ROWS))
+        except ValueError:
+            rows = settings.GROUP_SESSION_ROWS
+        formset = _empty_group_formset(choices, rows)
+
+    return render(request, 'group_session.html', {
+        'session_form': session_form, 'formset': formset, 'questions': QUESTIONS,
+    })
+
+
+def _empty_group_formset(choices, rows):
+    """Формсет из rows пустых бланков (пустые строки при отправке пропускаются)"""
+    formset = GroupResponseFormSet(form_kwargs={'participant_choices': choices})
+    formset.extra = min(max(rows, 1), GroupResponseFormSet.max_num)
+    return formset
+
+
+@login_required
+@user_passes_test(is_admin)
+def import_responses(request):
+    """Загрузка оцифрованных бланков (CSV/XLSX): проверка, импорт и отчет о скорости и ошибках"""
+    # Импорт использует numpy: как и модуль отчетов, загружается только при первом обращении
+    from . import importer
+
+    result = errors_name = None
+    form = ImportUploadForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        file_format = upload.name.rsplit('.', 1)[-1].lower()
+        os.makedirs(settings.IMPORT_ERRORS_DIR, exist_ok=True)
+        errors_name = uuid.uuid4().hex
+        errors_path = os.path.join(settings.IMPORT_ERRORS_DIR, f'{errors_name}.csv')
+        try:
+            with open(errors_path, 'w', newline='', encoding='utf-8') as errors:
+                response_importer = importer.ResponseImporter(errors=errors, dry_run=form.cleaned_data['dry_run'])
+                result = response_importer.run(importer.READERS[file_format](upload.file))
+        except (importer.ImportFormatError, ImportError) as e:
+            form.add_error('file', str(e))
+        finally:
+            if result is None or not result.failed:
+                os.remove(errors_path)
+                errors_name = None
+
+    return render(request, 'import_responses.html', {'form': form, 'result': result, 'errors_name': errors_name})
+
+
+@login_required
+@user_passes_test(is_admin)
+def import_errors(request, name):
+    """Файл со строками, не прошедшими проверку при импорте"""
+    path = os.path.join(settings.IMPORT_ERRORS_DIR, f'{name}.csv')
+    if not os.path.exists(path):
+        raise Http404("Файл ошибок не найден")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename='import_errors.csv',
+                        content_type='text/csv; charset=utf-8')
+
+
+def _page_size(request):
+    """Размер страницы из параметра size (в пределах RESPONSES_PAGE_SIZE_MAX)"""
+    try:
+        size = int(request.GET.get('size', settings.RESPONSES_PAGE_SIZE))
+    except ValueError:
+        size = settings.RESPONSES_PAGE_SIZE
+    return min(max(size, 1), settings.RESPONSES_PAGE_SIZE_MAX)
 
 
 @login_required
@@ -170,219 +337,314 @@ def take_survey(request, participant_id=None):
         if form.is_valid():
             response = form.save(commit=False)
             response.participant = participant
-            response.save()
-
-            wellbeing = response.wellbeing_score
-            activity = response.activity_score
-            mood = response.mood_score
-            overall = response.overall_score
-
-            return render(request, 'take_survey.html', {
-                'form': ResponseForm(),
-                'participant': participant,
-                'questions': QUESTIONS,
-                'show_result': True,
-                'wellbeing': wellbeing,
-                'activity': activity,
-                'mood': mood,
-                'overall': overall
-            })
+            response.client_key = _client_key(request.POST.get('client_key'))
+            previous = Response.objects.filter(client_key=response.client_key).first() if response.client_key else None
+            if previous and previous.participant_id != participant.id:
+                # Чужой ключ не должен мешать сохранению: просто сохраняем бланк без него
+                response.client_key = previous = None
+            if previous:
+                # Повторная отправка того же бланка (например, после обрыва связи): дубль не создаем
+                response = previous
+            elif settings.SURVEY_WRITE_BUFFER:
+                # Баллы не зависят от записи в базу: считаем сейчас, а строку запишет буфер пачкой
+                response.compute_scores()
+                write_buffer.get_buffer().submit(response, participant.gender)
+            else:
+                response = _save_survey_response(response)
+            return survey_result(request, participant, response)
     else:
         form = ResponseForm()
 
+    return survey_page(request, participant, form)
+
+
+def survey_page(request, participant, form):
+    """Страница опроса с формой (новой или с ошибками)"""
     return render(request, 'take_survey.html', {
         'form': form,
         'participant': participant,
-        'questions': QUESTIONS
+        'questions': QUESTIONS,
+        'client_key': request.POST.get('client_key') or uuid.uuid4(),
+        'sync_max_batch': settings.SURVEY_SYNC_MAX_BATCH,
+    })
+
+
+def survey_result(request, participant, response):
+    """Страница опроса с результатами сохраненного ответа и новой пустой формой"""
+    wellbeing = response.wellbeing_score
+    activity = response.activity_score
+    mood = response.mood_score
+    overall = response.overall_score
+
+    return render(request, 'take_survey.html', {
+        'form': ResponseForm(),
+        'participant': participant,
+        'questions': QUESTIONS,
+        'client_key': uuid.uuid4(),
+        'sync_max_batch': settings.SURVEY_SYNC_MAX_BATCH,
+        'show_result': True,
+        'wellbeing': wellbeing,
+        'activity': activity,
+        'mood': mood,
+        'overall': overall
+    })
+
+
+def _client_key(value):
+    try:
+        return uuid.UUID(value) if value else None
+    except ValueError:
+        return None
+
+
+def _save_survey_response(response):
+    """Сохраняет бланк; возвращает сохраненный ответ
+
+    Два одновременных повтора одного бланка оба проходят проверку client_key,
+    и второй упирается в уникальный индекс. Тогда (как в sync.sync_responses)
+    перечитываем уже сохраненный ответ и возвращаем его. Response.save()
+    выполняется в своей транзакции, так что ошибка не ломает внешнюю.
+    """
+    try:
+        response.save()
+    except IntegrityError:
+        previous = Response.objects.filter(client_key=response.client_key).first() if response.client_key else None
+        if previous is None:
+            raise
+        if previous.participant_id == response.participant_id:
+            return previous
+        # Ключ одновременно занял чужой бланк: сохраняем без ключа
+        response.client_key = None
+        response.save()
+    return response
+
+
+@login_required
+@require_POST
+def survey_sync(request):
+    """Пакетная синхронизация бланков из очереди браузера (JSON)
+
+    Тело запроса: {"responses": [{"client_key", "participant", "phase", "submitted_at", "q1".."q30"}, ...]}.
+    Ответ: результат по каждому бланку в том же порядке (см. sync.sync_responses).
+    """
+    try:
+        items = json.loads(request.body)['responses']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Ожидается JSON с полем responses'}, status=400)
+    if not isinstance(items, list) or len(items) > settings.SURVEY_SYNC_MAX_BATCH:
+        return JsonResponse({'error': f'Не больше {settings.SURVEY_SYNC_MAX_BATCH} бланков за раз'}, status=400)
+    return JsonResponse({'results': sync.sync_responses(items, request.user)})
+
+
+@login_required
+@user_passes_test(is_admin)
+def prometheus_metrics(request):
+    """Метрики запросов и графиков отчета этого процесса в текстовом формате Prometheus"""
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+@user_passes_test(is_admin)
+def profiles_list(request):
+    """Последние профили запросов (сохраняются запросами сотрудников с ?profile=1)"""
+    return render(request, 'profiles_list.html', {
+        'profiles': profiling.list_profiles(),
+        'keep': settings.PROFILES_KEEP,
+        'enabled': settings.PROFILING_ENABLED,
+    })
+
+
+@login_required
+@user_passes_test(is_admin)
+def profile_detail(request, name):
+    """Сведения о профиле и таблица самых затратных функций (pstats)"""
+    meta = profiling.load_profile(name)
+    if meta is None:
+        raise Http404("Профиль не найден")
+    sort = request.GET.get('sort')
+    if sort not in profiling.SORT_KEYS:
+        sort = 'cumulative'
+    return render(request, 'profile_detail.html', {
+        'profile': meta,
+        'sort': sort,
+        'sort_keys': profiling.SORT_KEYS,
+        'stats': profiling.profile_text(name, sort),
     })
 
 
+@login_required
+@user_passes_test(is_admin)
+def profile_download(request, name):
+    """Файл профиля .prof (для pstats, snakeviz и т. п.)"""
+    path = profiling.profile_path(name)
+    if not os.path.exists(path):
+        raise Http404("Профиль не найден")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof',
+                        content_type='application/octet-stream')
+
+
+def load_reporting():
+    """Модуль отчетов (pandas, matplotlib, seaborn) загружается только при построении отчета
+
+    Так рабочие процессы сервера не тратят время и память на аналитический стек
+    при старте: отчеты открывают только администраторы.
+    """
+    from . import reporting
+    return reporting
+
+
 @login_required
 @user_passes_test(is_admin)
 def report(request):
-    """Страница с отчетами и графиками (только для администраторов)"""
-    responses = Response.objects.all()
+    """Страница с отчетами и графиками (только для администраторов)
+
+    Страница содержит только сводную таблицу и ссылки на графики; сами
+    графики загружаются отдельными запросами к report_chart. Фильтры из
+    GET-параметров применяются в запросах к базе.
+    """
+    return report_page(request)
+
+
+def report_page(request):
+    """Построение страницы отчета (без проверки доступа; общее для report и async_views.report)"""
+    filter_form = ReportFilterForm(request.GET)
+    responses = filter_form.filter_responses(Response.objects.all())
 
     if not responses.exists():
         return render(request, 'report.html', {
-            'img_base64_list': [],
+            'filter_form': filter_form,
+            'charts': {},
             'table_html': '<p>Нет данных для отображения.</p>',
             'error': 'Нет доступных данных для построения отчета.'
         })
 
-    # Подготовка данных
-    data = []
-    for resp in responses:
-        data.append({
-            'participant': resp.participant.name,
-            'gender': resp.participant.gender,
-            'phase': resp.phase,
-            'wellbeing': resp.wellbeing_score,
-            'activity': resp.activity_score,
-            'mood': resp.mood_score,
-            'overall': resp.overall_score,
-            'birth_date': resp.participant.birth_date,
-            'timestamp': resp.timestamp,
-        })
+    reporting = load_reporting()
+    version = data_version()
+    query = filter_form.query_string()
+    table_html = report_cache.get_or_build(
+        ('table', version, query), lambda: build_summary_table(filter_form, responses), len)
+    context = {'filter_form': filter_form, 'charts': {}, 'table_html': table_html, 'pairs_html': None}
+
+    if settings.REPORT_JOBS_ENABLED:
+        # Графики и таблицу пар (полный бутстреп) строит фоновое задание; пока оно не готово,
+        # страница показывает прогресс
+        job = jobs.enqueue(version, filters=query)
+        # Если обработчик заданий не запущен, все строится в запросах, как без заданий
+        if not jobs.unclaimed(job):
+            context['job'] = job
+            if job.status != 'done':
+                context['pairs_html'] = '<p>Парные изменения рассчитываются вместе с графиками.</p>'
+                return render(request, 'report.html', context)
+            context['pairs_html'] = jobs.job_pairs_table(job)
+
+    if context['pairs_html'] is None:
+        # В запросе страницы бутстреп укороченный, чтобы страница не ждала его секундами
+        context['pairs_html'] = report_cache.get_or_build(
+            ('pairs', version, query),
+            lambda: build_pairs_table(responses, settings.PAIRING_BOOTSTRAP_RESAMPLES_INTERACTIVE), len)
+
+    suffix = f'?{query}' if query else ''
+    context['charts'] = {
+        name: reverse('report_chart', args=[name, 'png']) + suffix for name in reporting.CHARTS
+    }
+    return render(request, 'report.html', context)
 
-    df = pd.DataFrame(data)
 
-    # Расчет возраста
-    df['birth_date'] = pd.to_datetime(df['birth_date'], errors='coerce')
-    current_date = pd.to_datetime(datetime.now().date())
-    df['age'] = (current_date - df['birth_date']).dt.days / 365.25
-    df['age'] = pd.to_numeric(df['age'], errors='coerce').fillna(0)
+@login_required
+@user_passes_test(is_admin)
+def report_job_status(request, job_id):
+    """Состояние фонового задания отчета в JSON (для опроса со страницы отчета)"""
+    job = get_object_or_404(ReportJob, id=job_id)
+    return JsonResponse({
+        'id': job.id,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'stage': job.stage,
+        'timings': job.timings,
+        'error': job.error,
+        'unclaimed': jobs.unclaimed(job),
+    })
 
-    # Конвертация score-колонок в числовой тип
-    for col in ['wellbeing', 'activity', 'mood', 'overall']:
-        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
 
-    img_base64_list = []
+def _report_state(request):
+    # Версия данных нужна и для ETag, и для Last-Modified - считаем ее один раз на запрос
+    if not hasattr(request, '_report_state'):
+        request._report_state = data_state()
+    return request._report_state
 
-    # 1. Столбчатый график
-    try:
-        grouped = df.groupby(['gender', 'phase'])[['wellbeing', 'activity', 'mood']].mean()
-        if not grouped.empty:
-            fig1, ax1 = plt.subplots(figsize=(10, 6))
-            grouped.unstack().plot(kind='bar', ax=ax1)
-            plt.title('Средние баллы САН до и после занятия по полу')
-            plt.ylabel('Балл')
-            plt.xlabel('Пол')
-            plt.xticks(rotation=45)
-            plt.legend(title='Показатель / Фаза')
-            plt.tight_layout()
-            buf1 = BytesIO()
-            fig1.savefig(buf1, format='png', bbox_inches='tight')
-            buf1.seek(0)
-            img_base64_list.append(base64.b64encode(buf1.read()).decode('utf-8'))
-            plt.close(fig1)
-    except Exception as e:
-        print(f"Ошибка при создании графика 1: {e}")
 
-    # 2. Линейный график изменений
-    try:
-        fig2, ax2 = plt.subplots(figsize=(10, 6))
-        for gender in ['M', 'F']:
-            gender_data = df[df['gender'] == gender].groupby('phase')[['wellbeing', 'activity', 'mood']].mean()
-            if not gender_data.empty:
-                gender_label = 'Мужской' if gender == 'M' else 'Женский'
-                for metric in ['wellbeing', 'activity', 'mood']:
-                    metric_label = {'wellbeing': 'Самочувствие', 'activity': 'Активность', 'mood': 'Настроение'}[metric]
-                    ax2.plot(gender_data.index, gender_data[metric],
-                             label=f'{metric_label} ({gender_label})', marker='o')
-        plt.title('Динамика баллов САН по фазам и полу')
-        plt.ylabel('Балл')
-        plt.xlabel('Фаза')
-        plt.legend()
-        plt.tight_layout()
-        buf2 = BytesIO()
-        fig2.savefig(buf2, format='png', bbox_inches='tight')
-        buf2.seek(0)
-        img_base64_list.append(base64.b64encode(buf2.read()).decode('utf-8'))
-        plt.close(fig2)
-    except Exception as e:
-        print(f"Ошибка при создании графика 2: {e}")
-
-    # 3. Круговые диаграммы
-    for gender in ['M', 'F']:
-        for phase in ['before', 'after']:
-            try:
-                fig3, ax3 = plt.subplots(figsize=(6, 6))
-                subset = df[(df['gender'] == gender) & (df['phase'] == phase)]['wellbeing']
-                labels = ['>5', '4-5', '<4']
-                sizes = [
-                    len(subset[subset > 5.0]),
-                    len(subset[(subset >= 4.0) & (subset <= 5.0)]),
-                    len(subset[subset < 4.0])
-                ]
-
-                if sum(sizes) > 0:
-                    ax3.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
-                    ax3.axis('equal')
-                    gender_label = 'Мужской' if gender == 'M' else 'Женский'
-                    phase_label = 'До занятия' if phase == 'before' else 'После занятия'
-                    plt.title(f'{gender_label} - {phase_label}\n(Самочувствие)')
-                else:
-                    ax3.text(0.5, 0.5, 'Нет данных', horizontalalignment='center',
-                             verticalalignment='center', transform=ax3.transAxes)
-                    ax3.axis('equal')
-                    plt.title(f'{gender} - {phase} (Нет данных)')
-
-                plt.tight_layout()
-                buf3 = BytesIO()
-                fig3.savefig(buf3, format='png', bbox_inches='tight')
-                buf3.seek(0)
-                img_base64_list.append(base64.b64encode(buf3.read()).decode('utf-8'))
-                plt.close(fig3)
-            except Exception as e:
-                print(f"Ошибка при создании круговой диаграммы {gender}-{phase}: {e}")
-
-    # 4. График рассеяния
-    try:
-        fig4, ax4 = plt.subplots(figsize=(10, 6))
-        for phase in ['before', 'after']:
-            subset = df[df['phase'] == phase]
-            if not subset.empty:
-                phase_label = 'До занятия' if phase == 'before' else 'После занятия'
-                ax4.scatter(subset['age'], subset['overall'], label=phase_label, alpha=0.6, s=50)
-        plt.title('Общий балл vs Возраст по фазам')
-        plt.ylabel('Общий балл')
-        plt.xlabel('Возраст (лет)')
-        plt.legend()
-        plt.grid(True, alpha=0.3)
-        plt.tight_layout()
-        buf4 = BytesIO()
-        fig4.savefig(buf4, format='png', bbox_inches='tight')
-        buf4.seek(0)
-        img_base64_list.append(base64.b64encode(buf4.read()).decode('utf-8'))
-        plt.close(fig4)
-    except Exception as e:
-        print(f"Ошибка при создании графика 4: {e}")
+def _chart_etag(request, name, image_format):
+    query = ReportFilterForm(request.GET).query_string()
+    digest = hashlib.sha1(query.encode()).hexdigest()[:8]
+    return f"{_report_state(request)[0]}-{digest}-{name}-{image_format}"
 
-    # 5. Ящик с усами
-    try:
-        fig5, ax5 = plt.subplots(figsize=(10, 6))
-        df.boxplot(column=['wellbeing', 'activity', 'mood'], by='phase', ax=ax5)
-        plt.title('Распределение баллов по фазам')
-        plt.suptitle('')
-        plt.ylabel('Балл')
-        plt.xlabel('Фаза')
-        plt.tight_layout()
-        buf5 = BytesIO()
-        fig5.savefig(buf5, format='png', bbox_inches='tight')
-        buf5.seek(0)
-        img_base64_list.append(base64.b64encode(buf5.read()).decode('utf-8'))
-        plt.close(fig5)
-    except Exception as e:
-        print(f"Ошибка при создании графика 5: {e}")
 
-    # 6. Тепловая карта корреляции
-    try:
-        fig6, ax6 = plt.subplots(figsize=(8, 6))
-        correlation_matrix = df[['wellbeing', 'activity', 'mood', 'age']].corr()
-        sns.heatmap(correlation_matrix, annot=True, cmap='coolwarm',
-                    vmin=-1, vmax=1, center=0, ax=ax6, fmt='.2f')
-        plt.title('Корреляция между баллами и возрастом')
-        plt.tight_layout()
-        buf6 = BytesIO()
-        fig6.savefig(buf6, format='png', bbox_inches='tight')
-        buf6.seek(0)
-        img_base64_list.append(base64.b64encode(buf6.read()).decode('utf-8'))
-        plt.close(fig6)
-    except Exception as e:
-        print(f"Ошибка при создании графика 6: {e}")
+def _chart_last_modified(request, name, image_format):
+    return _report_state(request)[1]
+
 
-    # Таблица в HTML
+@login_required
+@user_passes_test(is_admin)
+def report_chart(request, name, image_format):
+    """Отдельный график отчета в PNG или SVG с поддержкой условных запросов (304)"""
+    return chart_response(request, name, image_format)
+
+
+@condition(etag_func=_chart_etag, last_modified_func=_chart_last_modified)
+def chart_response(request, name, image_format):
+    """Ответ с графиком (без проверки доступа; общее для report_chart и async_views.report_chart)"""
+    if name not in load_reporting().CHARTS:
+        raise Http404("Неизвестный график")
+
+    version = _report_state(request)[0]
+    filter_form = ReportFilterForm(request.GET)
+    query = filter_form.query_string()
+    # Все графики версии строятся за один проход в пуле процессов и кэшируются вместе.
+    # Сначала ищем графики, построенные фоновым заданием, иначе строим сами
+    images = report_cache.get_or_build(
+        ('charts', version, query, image_format),
+        lambda: (jobs.job_charts(version, image_format, filters=query)
+                 or build_report_charts(filter_form, image_format)),
+        lambda built: sum(len(image) for image in built.values() if image),
+    )
+    image = images.get(name)
+    if not image:
+        raise Http404("График не построен")
+
+    response = HttpResponse(image, content_type=CHART_CONTENT_TYPES[image_format])
+    patch_cache_control(response, private=True, max_age=0, must_revalidate=True)
+    return response
+
+
+def build_report_charts(filter_form, image_format='png', on_chart=None, workers=None):
+    """Строит все графики отчета по фильтрам, возвращает словарь имя -> байты изображения"""
+    reporting = load_reporting()
+    responses = filter_form.filter_responses(Response.objects.all())
+    # Подготовка данных: один запрос с JOIN участника, DataFrame собирается по столбцам
+    df = reporting.load_report_frame(responses)
+    # Средние для столбчатого и линейного графиков по возможности берутся из ScoreRollup
+    means = reporting.means_frame(filter_form.group_stats(responses))
+    # В веб-процессе графики по умолчанию строятся в нем же (REPORT_CHART_WORKERS = 0)
+    if workers is None:
+        workers = settings.REPORT_CHART_WORKERS
+    return reporting.render_charts(df, workers=workers, image_format=image_format, means=means,
+                                   on_chart=on_chart)
+
+
+def build_summary_table(filter_form, responses):
+    """Сводная таблица средних баллов по полу и фазе в HTML"""
+    # Без фильтров по возрасту и участникам средние читаются из ScoreRollup
     try:
-        grouped = df.groupby(['gender', 'phase'])[['wellbeing', 'activity', 'mood']].mean()
-        table_html = grouped.to_html(float_format='%.2f')
+        grouped = load_reporting().means_frame(filter_form.group_stats(responses))
+        return grouped.to_html(float_format='%.2f')
     except Exception as e:
-        table_html = f'<p>Ошибка при создании таблицы: {e}</p>'
+        return f'<p>Ошибка при создании таблицы: {e}</p>'
 
-    return render(request, 'report.html', {
-        'img_base64_list': img_base64_list,
-        'table_html': table_html
-    })
+
+def build_pairs_table(responses, resamples):
+    """Таблица изменений «после - до» по парам ответов участников с парными тестами в HTML"""
+    return load_reporting().pairs_table_html(responses, timedelta(hours=settings.PAIRING_WINDOW_HOURS), resamples)
 
 
 def register(request):
@@ -0,0 +1,303 @@
+"""Буфер записи ответов опроса: объединение одновременных отправок в пакетные транзакции
+
+При массовой отправке бланков (конец занятия) каждый POST take_survey
+открывает свою транзакцию, и запросы ждут единственную блокировку записи
+SQLite. С включенным SURVEY_WRITE_BUFFER проверенные ответы кладутся в очередь
+процесса, а фоновый поток записывает их пачками: каждые
+SURVEY_WRITE_BUFFER_INTERVAL_MS миллисекунд или по SURVEY_WRITE_BUFFER_MAX_ROWS
+строк. Баллы считаются до постановки в очередь, поэтому пользователь видит
+результат сразу.
+
+Сохранность: flush() ждет записи всего, что уже в очереди; при штатной
+остановке процесса (atexit) очередь дописывается. Пачка, которую не удалось
+записать и после повторов, не теряется: ответы дописываются в файл
+SURVEY_WRITE_BUFFER_SPILL (JSON по строке на ответ) и записываются в базу
+повторно при следующем запуске буфера или командой replay_survey_spill.
+Ответы, принятые за последний интервал, теряются только при аварийном
+завершении процесса.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.utils.dateparse import parse_datetime
+
+from .bulk import bulk_create_responses
+from .models import Response
+from .scoring import Q_FIELDS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBuffer:
+    """Очередь ответов и поток, записывающий их пачками через bulk_create_responses()"""
+
+    def __init__(self, interval_ms=200, max_rows=50, retries=3, spill_path=None):
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        self.retries = retries
+        self.spill_path = spill_path
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Метрики
+        self.flushed_rows = 0
+        self.batches = 0
+        self.failed_rows = 0
+        self.replayed_rows = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='survey-write-buffer', daemon=True)
+                self._thread.start()
+
+    def submit(self, response, gender):
+        """Ставит в очередь ответ с уже посчитанными баллами; gender - пол участника"""
+        self.start()
+        self._queue.put((response, gender))
+
+    def flush(self, timeout=None):
+        """Ждет, пока будет записано все, что уже поставлено в очередь
+
+        Возвращает False, если за timeout секунд очередь не опустела.
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Queue.join() не принимает timeout, поэтому ждем по счетчику незавершенных задач
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout=None):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            'queue_depth': self.depth,
+            'flushed_rows': self.flushed_rows,
+            'batches': self.batches,
+            'failed_rows': self.failed_rows,
+            'replayed_rows': self.replayed_rows,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'avg_flush_ms': round(self._total_flush_ms / self.batches, 2) if self.batches else 0.0,
+            'max_flush_ms': round(self.max_flush_ms, 2),
+            'total_flush_ms': self._total_flush_ms,
+            'spilled_rows': self.spilled_rows(),
+        }
+
+    def spilled_rows(self):
+        """Сколько ответов ждет повторной записи в файле SURVEY_WRITE_BUFFER_SPILL"""
+        if self.spill_path is None:
+            return 0
+        try:
+            with open(self.spill_path, 'rb') as f:
+                return sum(1 for _ in f)
+        except FileNotFoundError:
+            return 0
+
+    def _run(self):
+        try:
+            self.replay_spill()
+            stopping = False
+            while not stopping:
+                batch, stopping = self._collect()
+                if batch:
+                    self._write(batch)
+                for _ in range(len(batch) + stopping):
+                    self._queue.task_done()
+        finally:
+            connection.close()
+
+    def _collect(self):
+        """Первый ответ ждем без ограничения, остальные - до конца интервала или до max_rows"""
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    @staticmethod
+    def _drop_duplicates(batch):
+        """Убирает повторно отправленные бланки (тот же client_key уже в базе или в пачке)"""
+        keys = [response.client_key for response, _ in batch if response.client_key]
+        if not keys:
+            return batch
+        known = set(Response.objects.filter(client_key__in=keys).values_list('client_key', flat=True))
+        unique = []
+        for response, gender in batch:
+            if response.client_key:
+                if response.client_key in known:
+                    continue
+                known.add(response.client_key)
+            unique.append((response, gender))
+        return unique
+
+    def _write(self, batch):
+        batch = self._drop_duplicates(batch)
+        if not batch:
+            return
+        responses = [response for response, _ in batch]
+        genders = [gender for _, gender in batch]
+        for attempt in range(1, self.retries + 1):
+            started = time.perf_counter()
+            try:
+                bulk_create_responses(responses, genders)
+            except OperationalError:
+                # «database is locked»: ждем и повторяем пачку целиком
+                if attempt == self.retries:
+                    logger.exception("Не удалось записать %d ответов из буфера", len(batch))
+                    self._spill(batch)
+                    return
+                time.sleep(self.interval * attempt)
+                continue
+            except Exception:
+                logger.exception("Не удалось записать %d ответов из буфера", len(batch))
+                self._spill(batch)
+                return
+            elapsed = (time.perf_counter() - started) * 1000
+            self.flushed_rows += len(batch)
+            self.batches += 1
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self._total_flush_ms += elapsed
+            return
+
+    def _spill(self, batch):
+        """Дописывает незаписанные ответы в файл для повторной записи; каждый ответ - и в лог"""
+        self.failed_rows += len(batch)
+        lines = [json.dumps(spill_row(response, gender), ensure_ascii=False) for response, gender in batch]
+        for line in lines:
+            logger.error("Ответ не записан в базу: %s", line)
+        if self.spill_path is None:
+            return
+        try:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(line + '\n' for line in lines))
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            logger.exception("Не удалось сохранить %d ответов в %s", len(batch), self.spill_path)
+
+    def replay_spill(self):
+        """Записывает в базу ответы из файла незаписанных; возвращает число записанных
+
+        Файл сначала атомарно переименовывается, поэтому из нескольких процессов
+        его забирает один. Ответы, которые не записались и сейчас, снова
+        попадают в файл.
+        """
+        if self.spill_path is None or not os.path.exists(self.spill_path):
+            return 0
+        claimed = f'{self.spill_path}.{uuid.uuid4().hex}'
+        try:
+            os.replace(self.spill_path, claimed)
+        except FileNotFoundError:
+            return 0
+        with open(claimed, encoding='utf-8') as f:
+            batch = [spilled_response(json.loads(line)) for line in f if line.strip()]
+        failed = []
+        try:
+            written = self._write_spilled(self._drop_duplicates(batch), failed)
+        finally:
+            if failed:
+                self._spill(failed)
+            os.remove(claimed)
+        self.replayed_rows += written
+        if written:
+            logger.info("Из %s записано %d ответов", self.spill_path, written)
+        return written
+
+    @staticmethod
+    def _write_spilled(batch, failed):
+        """Пачкой, а если пачка не записывается - по одному ответу; незаписанные - в failed"""
+        if not batch:
+            return 0
+        try:
+            bulk_create_responses([response for response, _ in batch], [gender for _, gender in batch])
+            return len(batch)
+        except Exception:
+            logger.exception("Не удалось записать пачку из %d сохраненных ответов", len(batch))
+        written = 0
+        for response, gender in batch:
+            try:
+                bulk_create_responses([response], [gender])
+                written += 1
+            except Exception:
+                logger.exception("Не удалось записать сохраненный ответ")
+                failed.append((response, gender))
+        return written
+
+
+def spill_row(response, gender):
+    """Ответ из буфера в виде словаря для JSON"""
+    row = {field: getattr(response, field) for field in Q_FIELDS + Response.SCORE_FIELDS}
+    row.update(participant_id=response.participant_id, phase=response.phase, gender=gender,
+               timestamp=response.timestamp.isoformat(),
+               client_key=str(response.client_key) if response.client_key else None)
+    return row
+
+
+def spilled_response(row):
+    """Обратно к (Response, пол) из spill_row()"""
+    row = dict(row)
+    gender = row.pop('gender')
+    row['timestamp'] = parse_datetime(row['timestamp'])
+    return Response(**row), gender
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """Общий буфер процесса (создается при первой отправке, дописывается при выходе)"""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = WriteBuffer(settings.SURVEY_WRITE_BUFFER_INTERVAL_MS, settings.SURVEY_WRITE_BUFFER_MAX_ROWS,
+                                  spill_path=settings.SURVEY_WRITE_BUFFER_SPILL)
+            atexit.register(_buffer.stop)
+        return _buffer
+
+
+def buffer_stats():
+    """Метрики общего буфера или None, если он еще не создавался"""
+    return _buffer.stats() if _buffer is not None else None